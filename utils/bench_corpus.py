@@ -0,0 +1,308 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Synthetic benchmark corpus
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Deterministic generator of English-Icelandic bitext for benchmarks.
+     Sentences are built from a small aligned lexicon so that the two sides
+     have related lengths, numbers and quotes, and a share of the pairs is
+     damaged in the ways the filters look for: duplicates, OCR errors,
+     bullets, banned symbols, wrong quotes, untranslated or truncated
+     sides. The same seed always gives the same corpus. Also writes the
+     corpus as a TMX file and a subword vocabulary covering its alphabet,
+     so that the subword filters can run without the real vocabulary.
+
+"""
+
+import random
+from xml.sax.saxutils import escape
+
+from symbols import BANNED_SYMBOLS, WRONG_QUOTES
+
+# (English, Icelandic) word pairs, roughly in order of frequency
+LEXICON = [
+    ("the", "það"),
+    ("and", "og"),
+    ("of", "af"),
+    ("to", "til"),
+    ("in", "í"),
+    ("is", "er"),
+    ("that", "sem"),
+    ("for", "fyrir"),
+    ("with", "með"),
+    ("on", "á"),
+    ("not", "ekki"),
+    ("from", "frá"),
+    ("or", "eða"),
+    ("this", "þetta"),
+    ("he", "hann"),
+    ("she", "hún"),
+    ("was", "var"),
+    ("about", "um"),
+    ("shall", "skal"),
+    ("must", "verður"),
+    ("regulation", "reglugerð"),
+    ("commission", "framkvæmdastjórn"),
+    ("agreement", "samningur"),
+    ("government", "ríkisstjórn"),
+    ("law", "lög"),
+    ("member", "aðildarríki"),
+    ("state", "ríki"),
+    ("council", "ráðið"),
+    ("decision", "ákvörðun"),
+    ("article", "grein"),
+    ("paragraph", "málsgrein"),
+    ("provisions", "ákvæði"),
+    ("market", "markaður"),
+    ("products", "vörur"),
+    ("information", "upplýsingar"),
+    ("measures", "ráðstafanir"),
+    ("authority", "yfirvald"),
+    ("country", "land"),
+    ("year", "ár"),
+    ("people", "fólk"),
+    ("water", "vatn"),
+    ("house", "hús"),
+    ("ship", "skip"),
+    ("fish", "fiskur"),
+    ("weather", "veður"),
+    ("children", "börn"),
+    ("school", "skóli"),
+    ("work", "vinna"),
+    ("important", "mikilvægur"),
+    ("new", "nýr"),
+    ("European", "evrópskur"),
+    ("Icelandic", "íslenskur"),
+    ("Union", "sambandið"),
+    ("Iceland", "Ísland"),
+    ("Reykjavík", "Reykjavík"),
+    ("Norway", "Noregur"),
+    ("directive", "tilskipun"),
+    ("application", "umsókn"),
+    ("procedure", "málsmeðferð"),
+    ("committee", "nefnd"),
+]
+
+NOISE_KINDS = (
+    "duplicate",
+    "near_duplicate",
+    "bullet",
+    "banned_symbol",
+    "ocr_quotes",
+    "soft_hyphen",
+    "line_split",
+    "corrupt_symbol",
+    "wrong_quote",
+    "dashes",
+    "spaces",
+    "untranslated",
+    "truncated",
+    "empty",
+)
+DEFAULT_NOISE = 0.3  # share of pairs damaged in one of the NOISE_KINDS
+DEFAULT_SEED = 1
+
+_WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(LEXICON))]
+_BANNED = sorted(BANNED_SYMBOLS)
+_WRONG_QUOTES = sorted(WRONG_QUOTES)
+
+
+def _sentence_pair(rng):
+    """ A clean sentence pair, words drawn with Zipfian weights """
+    length = rng.randint(3, 30)
+    pairs = rng.choices(LEXICON, weights=_WORD_WEIGHTS, k=length)
+    eng = [en for (en, _) in pairs]
+    ice = [is_ for (_, is_) in pairs]
+    # Icelandic word order differs a little
+    for _ in range(rng.randint(0, length // 4)):
+        i = rng.randrange(length - 1)
+        ice[i], ice[i + 1] = ice[i + 1], ice[i]
+    if rng.random() < 0.3:
+        number = str(rng.randint(1, 2020))
+        pos = rng.randrange(length)
+        eng.insert(pos, number)
+        ice.insert(min(pos + rng.randint(-1, 1), len(ice)), number)
+    if rng.random() < 0.1:
+        start = rng.randrange(len(eng))
+        eng[start] = '"' + eng[start]
+        eng[-1] = eng[-1] + '"'
+        ice[start] = "„" + ice[start]
+        ice[-1] = ice[-1] + "“"
+    if rng.random() < 0.2:
+        comma = rng.randrange(1, length)
+        eng[comma - 1] += ","
+        ice[comma - 1] += ","
+    end = rng.choice(".....?!:")
+    eng_text = " ".join(eng) + end
+    ice_text = " ".join(ice) + end
+    return eng_text[:1].upper() + eng_text[1:], ice_text[:1].upper() + ice_text[1:]
+
+
+def _insert(rng, text, chars):
+    pos = rng.randint(0, len(text))
+    return text[:pos] + chars + text[pos:]
+
+
+def _inside_word(rng, text, chars):
+    """ Insert chars between two letters of a word, if there is one """
+    words = text.split(" ")
+    candidates = [i for (i, word) in enumerate(words) if len(word) > 3]
+    if not candidates:
+        return _insert(rng, text, chars)
+    i = rng.choice(candidates)
+    pos = rng.randint(1, len(words[i]) - 2)
+    words[i] = words[i][:pos] + chars + words[i][pos:]
+    return " ".join(words)
+
+
+def _add_noise(rng, kind, eng, ice, earlier):
+    if kind == "duplicate" and earlier:
+        return rng.choice(earlier)
+    if kind == "near_duplicate" and earlier:
+        eng, ice = rng.choice(earlier)
+        return eng.lower() if rng.random() < 0.5 else eng.rstrip(".") + " .", ice
+    if kind == "bullet":
+        bullet = rng.choice("•-–")
+        return bullet + " " + eng, (bullet + " " if rng.random() < 0.8 else "") + ice
+    if kind == "banned_symbol":
+        return eng, _insert(rng, ice, rng.choice(_BANNED))
+    if kind == "ocr_quotes":
+        return eng, ",," + ice.rstrip(".") + "“."
+    if kind == "soft_hyphen":
+        return eng, _inside_word(rng, ice, "\xad")
+    if kind == "line_split":
+        return eng, _inside_word(rng, ice, "- ")
+    if kind == "corrupt_symbol":
+        return eng, _inside_word(rng, ice, "?")
+    if kind == "wrong_quote":
+        quote = rng.choice(_WRONG_QUOTES)
+        return eng, quote + ice.rstrip(".") + quote + "."
+    if kind == "dashes":
+        return _insert(rng, eng, " — "), _insert(rng, ice, " – ")
+    if kind == "spaces":
+        return eng, ice.replace(" ", "  ", rng.randint(1, 3))
+    if kind == "untranslated":
+        return eng, eng
+    if kind == "truncated":
+        words = ice.split()
+        return eng, " ".join(words[: max(1, len(words) // 3)])
+    if kind == "empty":
+        return eng, ""
+    return eng, ice
+
+
+def generate_bitext(num_pairs, seed=DEFAULT_SEED, noise=DEFAULT_NOISE):
+    """ List of num_pairs (English, Icelandic) sentence pairs """
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(num_pairs):
+        eng, ice = _sentence_pair(rng)
+        if rng.random() < noise:
+            eng, ice = _add_noise(rng, rng.choice(NOISE_KINDS), eng, ice, pairs)
+        pairs.append((eng, ice))
+    return pairs
+
+
+def write_tsv(path, pairs):
+    with open(str(path), "w", encoding="utf-8") as fh:
+        for (eng, ice) in pairs:
+            fh.write(eng + "\t" + ice + "\n")
+
+
+def write_tmx(path, pairs, src_lang="EN-GB", tgt_lang="IS-IS"):
+    """ Write pairs as a TMX file in the format read by tmx2tsv """
+    with open(str(path), "w", encoding="utf-8") as fh:
+        fh.write("<?xml version='1.0' encoding='UTF-8'?>")
+        fh.write('<tmx version="1.4">\n')
+        fh.write(
+            ' <header adminlang="{0}" creationtool="bench_corpus" '
+            'datatype="unknown" o-tmf="bench_corpus" segtype="sentence" '
+            'srclang="{0}">\n </header>\n <body>\n'.format(src_lang)
+        )
+        for (idx, (eng, ice)) in enumerate(pairs):
+            fh.write("  <tu>\n")
+            fh.write(
+                '    <prop type="fileId">bench{0:06d}</prop>'
+                '<prop type="Txt::Note">{1:.4f}</prop>\n'.format(idx // 100, 1.0)
+            )
+            for (lang, seg) in ((src_lang, eng), (tgt_lang, ice)):
+                fh.write(
+                    '    <tuv xml:lang="{0}"><seg>{1}</seg></tuv>\n'.format(
+                        lang, escape(seg)
+                    )
+                )
+            fh.write("  </tu>\n")
+        fh.write(" </body>\n</tmx>\n")
+
+
+def write_vocab(path, pairs):
+    """ Write a subword vocabulary in the tensor2tensor format with every
+        character of pairs, the escape characters and the lexicon words """
+    alphabet = sorted({c for pair in pairs for text in pair for c in text})
+    alphabet = [c for c in alphabet if c not in "\r\n'"]
+    subtokens = ["<pad>", "<EOS>", "_", "\\", "u", ";"]
+    subtokens += [str(digit) for digit in range(10)]
+    subtokens += alphabet + [c + "_" for c in alphabet]
+    subtokens += [word + "_" for pair in LEXICON for word in pair]
+    seen = set()
+    with open(str(path), "w", encoding="utf-8") as fh:
+        for subtoken in subtokens:
+            if subtoken not in seen:
+                seen.add(subtoken)
+                fh.write("'" + subtoken + "'\n")
+
+
+def main():
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(
+        "Write a synthetic English-Icelandic corpus (corpus.tsv, corpus.tmx "
+        "and vocab.subwords) for benchmarks."
+    )
+    parser.add_argument(
+        "out_dir", help="Directory to write the corpus to, created if missing"
+    )
+    parser.add_argument(
+        "-n",
+        "--num_pairs",
+        dest="num_pairs",
+        type=int,
+        default=10000,
+        help="Number of sentence pairs",
+    )
+    parser.add_argument(
+        "--seed", dest="seed", type=int, default=DEFAULT_SEED, help="Random seed"
+    )
+    parser.add_argument(
+        "--noise",
+        dest="noise",
+        type=float,
+        default=DEFAULT_NOISE,
+        help="Share of damaged sentence pairs",
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    pairs = generate_bitext(args.num_pairs, seed=args.seed, noise=args.noise)
+    write_tsv(os.path.join(args.out_dir, "corpus.tsv"), pairs)
+    write_tmx(os.path.join(args.out_dir, "corpus.tmx"), pairs)
+    write_vocab(os.path.join(args.out_dir, "vocab.subwords"), pairs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Benchmarks
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Reproducible benchmarks on a synthetic corpus (see bench_corpus):
+     micro benchmarks of every stage of a pipeline plan, each timed on the
+     examples that reach it when the pipeline runs, and end-to-end
+     throughput of the pipelines, dedup_files, comm_csv, count_store and
+     TMXFile.bitext, and the startup time of filters.py in a fresh
+     interpreter, which has to stay within a budget since the command line
+     tool is run once per shard from shell loops. Every benchmark reports
+     the best of a number of repeats. Results are written as JSON and can
+     be compared with a stored baseline, e.g.
+
+         python benchmark.py -o baseline.json
+         ... change something ...
+         python benchmark.py --baseline baseline.json
+
+"""
+
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import bench_corpus
+import filters
+from comm_csv import comm_csv
+from count_store import open_counts, write_counts
+from dedup_tsv import dedup_files
+from filters import Example, Stage
+from subword_encoder import SubwordEncoder
+from tmx2tsv import TMXFile
+from tsv_index import TSVIndex
+
+FORMAT_VERSION = 1
+DEFAULT_NUM_PAIRS = 10000
+DEFAULT_REPEATS = 3
+DEFAULT_TOLERANCE = 0.10  # relative slowdown reported as a regression
+# MinFrequency gathers and filters in one run
+GatherPipeline = filters.Pipeline.from_config(
+    {
+        "name": "GatherPipeline",
+        "stages": ["null_sentence", "merge_spaces", "MinFrequency", "deduplicate"],
+    }
+)
+PIPELINES = (filters.MinimalPipeline, filters.Pipeline, GatherPipeline)
+DEFAULT_STARTUP_BUDGET = 0.1  # seconds to import filters and run a transform
+# Modules that filters.py must not import unless a selected filter needs them
+HEAVY_MODULES = (
+    "tensorflow",
+    "tensor2tensor",
+    "tokenizer",
+    "editdistance",
+    "hashlib",
+    "multiprocessing",
+)
+_STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import filters
+ex = next(filters.lines_to_examples(["Some  text\\tEinhver  texti"]))
+filters.Transformations.apply("merge_spaces", ex)
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(" ".join(name for name in {0!r} if name in sys.modules))
+"""
+
+
+def best_time(fn, repeats, setup=lambda: ()):
+    """ Smallest wall time of repeats calls of fn(*setup()), setup is not
+        timed. Returns the time and the result of the last call. """
+    best, result = None, None
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def reset_state(vocab_path):
+    """ Forget everything stateful filters have seen and reload the subword
+        encoder, so that every repeat starts cold """
+    filters.Deduplifier.use_backend("set")
+    near = filters.NearDeduplifier
+    near.configure(near.threshold, near.num_perm, near.shingle_size)
+    filters.ENC = SubwordEncoder(vocab_path)
+
+
+def run_stage(stage, exs, batch_size):
+    """ Apply a stage to exs in batches, as the pipeline does, returning the
+        examples that continue to the next stage """
+    out = []
+    for start in range(0, len(exs), batch_size):
+        batch = exs[start : start + batch_size]
+        if stage.kind == Stage.TRANSFORM:
+            out.extend(stage.fn(batch))
+        elif stage.kind == Stage.FUSED:
+            out.extend(ex for (ex, _) in stage.fn(batch))
+        else:
+            out.extend(ex for (ex, keep) in zip(batch, stage.fn(batch)) if keep)
+    return out
+
+
+def micro_benchmarks(
+    pipeline, lines, vocab_path, repeats, batch_size=filters.DEFAULT_BATCH_SIZE
+):
+    """ Time each stage of the pipeline plan on the examples that reach it.
+        Each repeat gets fresh examples, so a stage pays for all of the
+        analysis it uses. Fused transformations are timed both as one stage
+        and member by member. """
+    results = {}
+
+    def time_stage(stage, texts):
+        def setup():
+            reset_state(vocab_path)
+            return ([Example(eng, ice) for (eng, ice) in texts],)
+
+        seconds, out = best_time(
+            lambda exs: run_stage(stage, exs, batch_size), repeats, setup
+        )
+        results[pipeline.__name__ + "." + stage.name] = {
+            "kind": stage.kind,
+            "items": len(texts),
+            "seconds": seconds,
+        }
+        return [(ex.source, ex.target) for ex in out]
+
+    texts = [(ex.source, ex.target) for ex in filters.lines_to_examples(lines)]
+    for stage in pipeline.compile_plan():
+        if stage.kind == Stage.GATHER:
+            continue
+        if stage.kind == Stage.FUSED:
+            member_texts = texts
+            for member in stage.members:
+                member_texts = time_stage(member, member_texts)
+        texts = time_stage(stage, texts)
+    return results
+
+
+def _consume(iterable):
+    count = 0
+    for _ in iterable:
+        count += 1
+    return count
+
+
+def end_to_end_benchmarks(paths, lines, repeats, jobs=1):
+    """ Throughput of whole pipelines and of the other corpus tools """
+    results = {}
+
+    def record(name, items, fn, setup=lambda: ()):
+        seconds, _ = best_time(fn, repeats, setup)
+        results[name] = {"kind": "end_to_end", "items": items, "seconds": seconds}
+
+    def pipeline_setup():
+        reset_state(paths["vocab"])
+        return ()
+
+    for pipeline in PIPELINES:
+        record(
+            pipeline.__name__ + ".run",
+            len(lines),
+            lambda: _consume(pipeline.run(filters.lines_to_examples(lines))),
+            pipeline_setup,
+        )
+        if jobs > 1:
+            record(
+                pipeline.__name__ + ".run_parallel",
+                len(lines),
+                lambda: _consume(pipeline.run_parallel(lines, jobs)),
+                pipeline_setup,
+            )
+            with TSVIndex(paths["tsv"]) as index:
+                record(
+                    pipeline.__name__ + ".run_parallel.indexed",
+                    len(lines),
+                    lambda: _consume(pipeline.run_parallel(index, jobs)),
+                    pipeline_setup,
+                )
+
+    keep, remove = Path(paths["keep"]), Path(paths["remove"])
+    with open(str(remove), encoding="utf-8") as fh:
+        num_lines = _consume(fh)
+    with contextlib.redirect_stdout(io.StringIO()):
+        record("dedup_files", num_lines, lambda: dedup_files(keep, remove))
+        record(
+            "dedup_files.fuzzy",
+            num_lines,
+            lambda: dedup_files(keep, remove, fuzzy=True),
+        )
+        record(
+            "dedup_files.external",
+            num_lines,
+            lambda: dedup_files(keep, remove, external=True),
+        )
+        record("comm_csv", num_lines, lambda: comm_csv(keep, {1, 2}, remove, {1, 2}))
+    record(
+        "TSVIndex.build",
+        len(lines),
+        lambda: TSVIndex(paths["tsv"]).close(),
+    )
+    words = [word for line in lines for word in line.split()]
+    counts_path = os.path.join(os.path.dirname(paths["tsv"]), "words.counts")
+    record(
+        "count_store.write",
+        len(words),
+        lambda: write_counts(counts_path, collections.Counter(words)),
+    )
+    table = open_counts(counts_path)
+    record("count_store.lookup", len(words), lambda: sum(map(table.get, words)))
+    record(
+        "TMXFile.bitext",
+        len(lines),
+        lambda: _consume(TMXFile(Path(paths["tmx"])).bitext()),
+    )
+    return results
+
+
+def startup_benchmarks(repeats):
+    """ Time to import filters and apply a light transformation in a fresh
+        interpreter, measured in-process so that interpreter startup is not
+        included, and wall time of the command line tool on one line. Also
+        reports which HEAVY_MODULES got imported. """
+    utils_dir = os.path.dirname(os.path.abspath(filters.__file__))
+    script = _STARTUP_SCRIPT.format(HEAVY_MODULES)
+    best, heavy = None, []
+    # The first run writes the bytecode caches
+    for _ in range(repeats + 1):
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=utils_dir,
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout.split("\n")
+        elapsed, heavy = float(output[0]), output[1].split()
+        best = elapsed if best is None else min(best, elapsed)
+    results = {
+        "startup.import_filters": {
+            "kind": "startup",
+            "items": 1,
+            "seconds": best,
+            "heavy_modules": heavy,
+        }
+    }
+    command = [sys.executable, os.path.join(utils_dir, "filters.py")]
+    command += ["-t", "merge_spaces", "-q"]
+    seconds, _ = best_time(
+        lambda: subprocess.run(
+            command,
+            input="Some text\tEinhver texti\n",
+            check=True,
+            stdout=subprocess.DEVNULL,
+            universal_newlines=True,
+        ),
+        repeats,
+    )
+    results["startup.cli_transform"] = {
+        "kind": "startup",
+        "items": 1,
+        "seconds": seconds,
+    }
+    return results
+
+
+def write_corpus(out_dir, num_pairs, seed):
+    """ Write the benchmark corpus files to out_dir, returns their paths """
+    pairs = bench_corpus.generate_bitext(num_pairs, seed=seed)
+    paths = {
+        name: os.path.join(out_dir, filename)
+        for (name, filename) in (
+            ("tsv", "corpus.tsv"),
+            ("tmx", "corpus.tmx"),
+            ("vocab", "vocab.subwords"),
+            ("keep", "keep.tsv"),
+            ("remove", "remove.tsv"),
+        )
+    }
+    bench_corpus.write_tsv(paths["tsv"], pairs)
+    bench_corpus.write_tmx(paths["tmx"], pairs)
+    bench_corpus.write_vocab(paths["vocab"], pairs)
+    # Overlapping halves for the tools that compare two files
+    half = len(pairs) // 2
+    bench_corpus.write_tsv(paths["keep"], pairs[: half + half // 2])
+    bench_corpus.write_tsv(paths["remove"], pairs[half:])
+    return paths
+
+
+def run_benchmarks(
+    out_dir,
+    num_pairs=DEFAULT_NUM_PAIRS,
+    seed=bench_corpus.DEFAULT_SEED,
+    repeats=DEFAULT_REPEATS,
+    jobs=1,
+    vocab_path=None,
+    micro=True,
+    end_to_end=True,
+    startup=True,
+):
+    paths = write_corpus(out_dir, num_pairs, seed)
+    if vocab_path is not None:
+        paths["vocab"] = vocab_path
+    with open(paths["tsv"], encoding="utf-8") as fh:
+        lines = fh.read().splitlines()
+    benchmarks = {}
+    if micro:
+        for pipeline in PIPELINES:
+            benchmarks.update(
+                micro_benchmarks(pipeline, lines, paths["vocab"], repeats)
+            )
+    if end_to_end:
+        benchmarks.update(end_to_end_benchmarks(paths, lines, repeats, jobs=jobs))
+    if startup:
+        benchmarks.update(startup_benchmarks(repeats))
+    for result in benchmarks.values():
+        result["us_per_item"] = 1e6 * result["seconds"] / max(result["items"], 1)
+    return {
+        "version": FORMAT_VERSION,
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "num_pairs": num_pairs,
+            "seed": seed,
+            "repeats": repeats,
+            "jobs": jobs,
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ (name, baseline, current, ratio, verdict) for each benchmark in both,
+        comparing time per item. verdict is "slower" or "faster" if the ratio
+        is beyond the tolerance, otherwise "" """
+    rows = []
+    for (name, result) in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+        ratio = result["us_per_item"] / (base["us_per_item"] or 1e-9)
+        verdict = ""
+        if ratio > 1 + tolerance:
+            verdict = "slower"
+        elif ratio < 1 / (1 + tolerance):
+            verdict = "faster"
+        rows.append((name, base["us_per_item"], result["us_per_item"], ratio, verdict))
+    return rows
+
+
+def print_results(results, rows=None, file=sys.stdout):
+    """ Print the results, or the comparison rows if given, as a table """
+    width = max(len(name) for name in results["benchmarks"])
+    if rows is None:
+        header = ("seconds", "us/item")
+        rows = [
+            (name, result["seconds"], result["us_per_item"])
+            for (name, result) in results["benchmarks"].items()
+        ]
+        row_format = "{0:<{width}s}  {1:>10.3f}  {2:>12.2f}"
+    else:
+        header = ("baseline", "us/item", "ratio")
+        row_format = "{0:<{width}s}  {1:>10.2f}  {2:>12.2f}  {3:>7.2f}  {4}"
+    header_format = "{0:<{width}s}  {1:>10s}  {2:>12s}  {3:>7s}"
+    print(header_format.format("", *header, "", width=width).rstrip(), file=file)
+    for row in rows:
+        print(row_format.format(*row, width=width).rstrip(), file=file)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        "Benchmark the filters and corpus tools on a synthetic corpus, "
+        "optionally comparing with a baseline written by an earlier run."
+    )
+    parser.add_argument(
+        "-n",
+        "--num_pairs",
+        dest="num_pairs",
+        type=int,
+        default=DEFAULT_NUM_PAIRS,
+        help="Number of sentence pairs in the corpus",
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        type=int,
+        default=bench_corpus.DEFAULT_SEED,
+        help="Random seed of the corpus",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        dest="repeats",
+        type=int,
+        default=DEFAULT_REPEATS,
+        help="Runs of each benchmark, the best one is reported",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Also benchmark run_parallel with this many processes",
+    )
+    parser.add_argument(
+        "--only",
+        dest="only",
+        choices=("micro", "end_to_end", "startup"),
+        default=None,
+        help="Run only one kind of benchmark",
+    )
+    parser.add_argument(
+        "--vocab",
+        dest="vocab",
+        default=None,
+        help="Subword vocabulary, defaults to one generated for the corpus",
+    )
+    parser.add_argument(
+        "--corpus_dir",
+        dest="corpus_dir",
+        default=None,
+        help="Keep the generated corpus in this directory",
+    )
+    parser.add_argument(
+        "-o",
+        "--out_file",
+        dest="out_file",
+        default=None,
+        help="Write the results as JSON to this file",
+    )
+    parser.add_argument(
+        "--baseline",
+        dest="baseline",
+        type=argparse.FileType("r"),
+        default=None,
+        help="Results of an earlier run to compare with",
+    )
+    parser.add_argument(
+        "--startup_budget",
+        dest="startup_budget",
+        type=float,
+        default=DEFAULT_STARTUP_BUDGET,
+        help="Seconds filters may take to import and run a transformation",
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Relative slowdown reported as a regression",
+    )
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        out_dir = args.corpus_dir
+        if out_dir is None:
+            out_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(out_dir, exist_ok=True)
+        results = run_benchmarks(
+            out_dir,
+            num_pairs=args.num_pairs,
+            seed=args.seed,
+            repeats=args.repeats,
+            jobs=args.jobs,
+            vocab_path=args.vocab,
+            micro=args.only in (None, "micro"),
+            end_to_end=args.only in (None, "end_to_end"),
+            startup=args.only in (None, "startup"),
+        )
+    if args.out_file is not None:
+        with open(args.out_file, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    over_budget = False
+    startup = results["benchmarks"].get("startup.import_filters")
+    if startup is not None and startup["seconds"] > args.startup_budget:
+        over_budget = True
+        print(
+            "filters took {0:.3f}s to start, the budget is {1:.3f}s".format(
+                startup["seconds"], args.startup_budget
+            ),
+            file=sys.stderr,
+        )
+    if startup is not None and startup["heavy_modules"]:
+        over_budget = True
+        print(
+            "filters imported {0} for a light transformation".format(
+                ", ".join(startup["heavy_modules"])
+            ),
+            file=sys.stderr,
+        )
+
+    if args.baseline is None:
+        print_results(results)
+        if over_budget:
+            sys.exit(1)
+        return
+    baseline = json.load(args.baseline)
+    if baseline.get("version") != FORMAT_VERSION:
+        raise ValueError("Unsupported baseline version")
+    for key in ("num_pairs", "seed"):
+        if baseline["meta"].get(key) != results["meta"][key]:
+            print(
+                "Warning: baseline has {0} {1}, this run {2}".format(
+                    key, baseline["meta"].get(key), results["meta"][key]
+                ),
+                file=sys.stderr,
+            )
+    rows = compare(results, baseline, args.tolerance)
+    print_results(results, rows)
+    if over_budget or any(verdict == "slower" for (_, _, _, _, verdict) in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,30 +23,29 @@
 
 import sys
 
+from stream_io import LineWriter, open_input, open_output
+from tsv_index import iter_selected_lines
+
 
 def index_lines_in_file(path, fields):
     fields_idxs = [i - 1 for i in fields]
-    lines = []
-    table = {idx: dict() for idx in fields}
-    with open(str(path), "r", encoding="utf8") as fp:
+    table = {idx: dict() for idx in fields_idxs}
+    with open_input(path) as fp:
         for (line_idx, line) in enumerate(fp):
             fields = line.strip("\n").split("\t")
-            lines.append(line)
             for field_idx in fields_idxs:
                 table[field_idx][fields[field_idx]] = line_idx
-    return lines, table
+    return table
 
 
-def get_line_intersections(lines, table, path, fields2):
+def get_line_intersections(table, path, fields2):
     fields1_idxs = list(table.keys())
     fields2_idxs = [i - 1 for i in fields2]
-    lines = []
     file1_idxs = set()
     file2_idxs = set()
-    with open(str(path), "r", encoding="utf8") as fp:
+    with open_input(path) as fp:
         for (line_idx, line) in enumerate(fp):
             fields = line.strip("\n").split("\t")
-            lines.append(line)
             for i1, i2 in zip(fields1_idxs, fields2_idxs):
                 field = fields[i2]
                 if field in table[i1]:
@@ -55,23 +54,25 @@ def get_line_intersections(lines, table, path, fields2):
     return file1_idxs, file2_idxs
 
 
-def comm_csv(file_keep, fields_keep, file_remove, fields_remove, index_left=True):
+def comm_csv(
+    file_keep, fields_keep, file_remove, fields_remove, index_left=True, out_file=None
+):
     items = [(file_keep, fields_keep ), (file_remove, fields_remove )]
     pair1, pair2 = items if index_left else reversed(items)
     file1, fields1 = pair1
     file2, fields2 = pair2
 
-    lines, table = index_lines_in_file(file1, fields1)
-    idxs_1, idxs_2 = get_line_intersections(lines, table, file2, fields2)
+    table = index_lines_in_file(file1, fields1)
+    idxs_1, idxs_2 = get_line_intersections(table, file2, fields2)
 
-    idxs = idxs_2
+    # Line numbers in file_remove
+    idxs = idxs_1
     if index_left:
-        idxs = idxs_1
+        idxs = idxs_2
 
-    with open(file_remove, "r", "utf8") as fp:
-        for (idx, line) in enumerate(fp):
-            if idx in idxs:
-                sys.stdout.write(line)  # has newline
+    writer = LineWriter(out_file or sys.stdout)
+    writer.write_lines(iter_selected_lines(file_remove, sorted(idxs)))
+    writer.flush()
 
 
 def comma_separated_ints(arg_string):
@@ -130,17 +131,33 @@ def main():
         action="store_true",
         help="Use right-side file path for indexing rather than the left",
     )
+    opts.add_argument(
+        "-o",
+        "--out_file",
+        dest="out_file",
+        default=None,
+        help="Output file, compressed if it ends with .gz, .xz, .bz2 or .zst",
+    )
 
 
     args = parser.parse_args()
-    parser.print_help()
     if len(args.fields_remove) != len(args.fields_keep):
         raise argparse.ArgumentError(fields_arg, "Fields must be equal in number")
     elif any(i < 1 for i in args.fields_remove.union(args.fields_remove)):
         print(args.fields_remove, args.fields_remove)
         raise argparse.ArgumentError(fields_arg, "Fields must be equal greater or equal to 1")
 
-    comm_csv(args.file_keep, args.fields_keep, args.file_remove, args.fields_remove, not args.index_right):
+    out_file = open_output(args.out_file)
+    comm_csv(
+        args.file_keep,
+        args.fields_keep,
+        args.file_remove,
+        args.fields_remove,
+        not args.index_right,
+        out_file,
+    )
+    if out_file is not sys.stdout:
+        out_file.close()
 
 
 if __name__ == "__main__":
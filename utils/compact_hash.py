@@ -0,0 +1,124 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Compact hash set
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     A set of strings that only stores fixed-width hashes of its members in
+     an array-backed open addressing table. It uses a small fraction of the
+     memory of a Python set of strings, at the cost of a (configurable)
+     probability of false positives from hash collisions.
+
+"""
+
+import array
+import hashlib
+
+HASH_BITS = (64, 128)
+
+
+def hash_key(key, bits=64):
+    """ Hash a string to an integer of the given width, never 0 """
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=bits // 8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+class CompactHashSet:
+    """ Open addressing (linear probing) hash table of 64 or 128 bit hashes.
+        Each entry takes bits / 8 bytes; the table doubles when it is more
+        than max_load full. Supports the subset of the set interface used
+        for deduplication: add, `in` and len. """
+
+    def __init__(self, bits=64, capacity=1 << 16, max_load=0.7):
+        if bits not in HASH_BITS:
+            raise ValueError("Hash width must be one of {0}".format(HASH_BITS))
+        if not 0 < max_load < 1:
+            raise ValueError("max_load must be between 0 and 1")
+        self.bits = bits
+        self.max_load = max_load
+        self._words = bits // 64  # 64 bit words per entry
+        self._len = 0
+        size = 1
+        while size * max_load < capacity:
+            size *= 2
+        self._allocate(size)
+
+    def _allocate(self, size):
+        self._size = size
+        self._mask = size - 1
+        self._table = array.array("Q", bytes(8 * self._words * size))
+
+    def _split(self, hashed):
+        if self._words == 1:
+            return (hashed,)
+        return (hashed & 0xFFFFFFFFFFFFFFFF, hashed >> 64)
+
+    def _find(self, words):
+        """ Slot holding words, or the empty slot where it would go """
+        table = self._table
+        step = self._words
+        slot = words[0] & self._mask
+        while True:
+            pos = slot * step
+            if table[pos] == 0 and (step == 1 or table[pos + 1] == 0):
+                return slot, False
+            if step == 1:
+                if table[pos] == words[0]:
+                    return slot, True
+            elif table[pos] == words[0] and table[pos + 1] == words[1]:
+                return slot, True
+            slot = (slot + 1) & self._mask
+
+    def _insert(self, words, slot):
+        pos = slot * self._words
+        for (i, word) in enumerate(words):
+            self._table[pos + i] = word
+
+    def _grow(self):
+        old_table, step = self._table, self._words
+        self._allocate(self._size * 2)
+        for pos in range(0, len(old_table), step):
+            words = tuple(old_table[pos : pos + step])
+            if any(words):
+                slot, _ = self._find(words)
+                self._insert(words, slot)
+
+    def add(self, key):
+        """ Add key, returns False if it (or a colliding key) was present """
+        words = self._split(hash_key(key, self.bits))
+        slot, found = self._find(words)
+        if found:
+            return False
+        self._insert(words, slot)
+        self._len += 1
+        if self._len > self._size * self.max_load:
+            self._grow()
+        return True
+
+    def __contains__(self, key):
+        return self._find(self._split(hash_key(key, self.bits)))[1]
+
+    def __len__(self):
+        return self._len
+
+    def memory_usage(self):
+        """ Size of the table in bytes """
+        return self._table.itemsize * len(self._table)
+
+    def collision_probability(self):
+        """ Approximate probability that any two members share a hash,
+            i.e. that a unique key has been reported as a duplicate """
+        return min(1.0, self._len * (self._len - 1) / 2 ** (self.bits + 1))
@@ -0,0 +1,246 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Compact persistent word counts
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Binary files of word counts that are memory-mapped when loaded, so
+     that opening one takes milliseconds whatever its size.
+
+     An exact table stores the count and UTF-8 text of each word and an
+     open addressing hash table (linear probing, at most half full) of
+     their positions, so a lookup is usually a single probe followed by a
+     comparison of the text. Its hash is CRC32 and Adler-32 side by side,
+     which is cheap and the same in every process. Counts are gathered in
+     a collections.Counter and written with write_counts.
+
+     A CountMinSketch (Cormode & Muthukrishnan 2005) keeps depth rows of
+     width counters in an array and never takes more memory than that. It
+     may overestimate a count, by at most 2 * total / width with
+     probability 1 - 2 ** -depth, but never underestimates one. Sketches of
+     the same dimensions merge by adding their arrays, so counts from
+     parallel workers or shards add up exactly as a single sketch would.
+
+"""
+
+import array
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import zlib
+
+_MAGIC = b"GTCOUNT1"
+_TABLE = b"T"
+_SKETCH = b"S"
+# magic, kind, padding and two sizes: number of words and bytes of text for
+# a table, width and depth for a sketch
+_HEADER = struct.Struct("<8sc7xQQ")
+
+DEFAULT_SKETCH_DEPTH = 4
+
+
+def _table_hash(data):
+    """ Nonzero 64 bit hash for the lookup table of an exact table """
+    return (zlib.crc32(data) | (zlib.adler32(data) << 32)) or 1
+
+
+def _table_size(num_words):
+    """ Number of slots in the lookup table, a power of two """
+    size = 1
+    while size < 2 * num_words:
+        size *= 2
+    return size
+
+
+def _map_file(path):
+    with open(str(path), "rb") as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _write_atomically(path, chunks):
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as fh:
+        for chunk in chunks:
+            if isinstance(chunk, array.array):
+                chunk.tofile(fh)
+            else:
+                fh.write(chunk)
+    os.replace(tmp_path, str(path))
+
+
+class CountTable:
+    """ Read-only word counts of an exact table file, memory-mapped """
+
+    def __init__(self, path, data, num_words, text_size):
+        self.path = str(path)
+        self._data = data
+        view = memoryview(data)
+        start = _HEADER.size
+        arrays = []
+        table_size = _table_size(num_words)
+        for size in (num_words, num_words, num_words + 1, table_size):
+            arrays.append(view[start : start + 8 * size].cast("Q"))
+            start += 8 * size
+        self._hashes, self._counts, self._offsets, self._slots = arrays
+        self._mask = table_size - 1
+        self._text_start = start
+        self._len = num_words
+        self._text_size = text_size
+
+    def _text(self, idx):
+        base = self._text_start
+        return self._data[base + self._offsets[idx] : base + self._offsets[idx + 1]]
+
+    def get(self, word, default=0):
+        data = word.encode("utf-8")
+        hashed = _table_hash(data)
+        slots = self._slots
+        slot = hashed & self._mask
+        while True:
+            idx = slots[slot]
+            if not idx:
+                return default
+            # Slots hold word index + 1, 0 is empty
+            idx -= 1
+            if self._hashes[idx] == hashed and self._text(idx) == data:
+                return self._counts[idx]
+            slot = (slot + 1) & self._mask
+
+    def __getitem__(self, word):
+        return self.get(word)
+
+    def __contains__(self, word):
+        return self.get(word, None) is not None
+
+    def __len__(self):
+        return self._len
+
+    def items(self):
+        for idx in range(self._len):
+            yield (self._text(idx).decode("utf-8"), self._counts[idx])
+
+    def __reduce__(self):
+        # The contents are copied, the file may be gone by the time the copy
+        # is loaded (see MinFrequency.finalize)
+        return (
+            CountTable,
+            (self.path, bytes(self._data), self._len, self._text_size),
+        )
+
+
+class CountMinSketch:
+    """ Approximate counts in depth rows of width counters. update() takes
+        an iterable of words, a mapping of words to counts or another
+        sketch of the same dimensions, like collections.Counter.update. """
+
+    def __init__(self, width, depth=DEFAULT_SKETCH_DEPTH, counts=None):
+        if width < 1 or depth < 1:
+            raise ValueError("Sketch width and depth must be positive")
+        self.width = width
+        self.depth = depth
+        if counts is None:
+            counts = array.array("Q", bytes(8 * width * depth))
+        self._counts = counts
+
+    def _slots(self, word):
+        # Double hashing (Kirsch & Mitzenmacher 2006), one hash for all rows
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=16).digest()
+        hashed = int.from_bytes(digest, "little")
+        first, step = hashed & 0xFFFFFFFFFFFFFFFF, (hashed >> 64) | 1
+        width = self.width
+        return [
+            row * width + (first + row * step) % width for row in range(self.depth)
+        ]
+
+    def add(self, word, count=1):
+        counts = self._counts
+        for slot in self._slots(word):
+            counts[slot] += count
+
+    def update(self, other):
+        if isinstance(other, CountMinSketch):
+            if (other.width, other.depth) != (self.width, self.depth):
+                raise ValueError("Cannot merge sketches of different dimensions")
+            counts = self._counts
+            for (slot, count) in enumerate(other._counts):
+                if count:
+                    counts[slot] += count
+        elif hasattr(other, "items"):
+            for (word, count) in other.items():
+                self.add(word, count)
+        else:
+            for word in other:
+                self.add(word)
+
+    def get(self, word, default=0):
+        counts = self._counts
+        return min(counts[slot] for slot in self._slots(word)) or default
+
+    def __getitem__(self, word):
+        return self.get(word)
+
+    def memory_usage(self):
+        return 8 * self.width * self.depth
+
+    def __getstate__(self):
+        # A mapped sketch is copied into memory
+        return (self.width, self.depth, array.array("Q", self._counts))
+
+    def __setstate__(self, state):
+        self.width, self.depth, self._counts = state
+
+
+def write_counts(path, counts):
+    """ Write counts, a CountMinSketch or a mapping of words to counts (e.g.
+        a collections.Counter), to a file at path for open_counts """
+    if isinstance(counts, CountMinSketch):
+        header = _HEADER.pack(_MAGIC, _SKETCH, counts.width, counts.depth)
+        _write_atomically(path, [header, array.array("Q", counts._counts)])
+        return
+    items = [(word, count) for (word, count) in counts.items() if count > 0]
+    datas = [word.encode("utf-8") for (word, _) in items]
+    table_counts = array.array("Q", (count for (_, count) in items))
+    hashes = array.array("Q", map(_table_hash, datas))
+    offsets = array.array("Q", [0])
+    offsets.extend(itertools.accumulate(map(len, datas)))
+    table_size = _table_size(len(datas))
+    mask = table_size - 1
+    slots = array.array("Q", bytes(8 * table_size))
+    for (idx, hashed) in enumerate(hashes, 1):
+        slot = hashed & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = idx
+    text = b"".join(datas)
+    header = _HEADER.pack(_MAGIC, _TABLE, len(datas), len(text))
+    _write_atomically(path, [header, hashes, table_counts, offsets, slots, text])
+
+
+def open_counts(path):
+    """ Memory-map a file written by write_counts, returns a CountTable or
+        a CountMinSketch """
+    data = _map_file(path)
+    if len(data) < _HEADER.size:
+        raise ValueError("{0} is not a counts file".format(path))
+    magic, kind, first, second = _HEADER.unpack_from(data)
+    if magic != _MAGIC or kind not in (_TABLE, _SKETCH):
+        raise ValueError("{0} is not a counts file".format(path))
+    if kind == _TABLE:
+        return CountTable(path, data, first, second)
+    counts = memoryview(data)[_HEADER.size :].cast("Q")
+    return CountMinSketch(first, second, counts=counts)
@@ -25,6 +25,10 @@ import re
 import string
 import sys
 
+from external_dedup import ExternalSorter, split_hash
+from stream_io import LineWriter, open_input, open_output
+from tsv_index import iter_selected_lines
+
 DIGIT_PROG = re.compile(r"\d+")
 PUNCT_PROG = re.compile(r"[{}]".format(string.punctuation))
 SPACE_PROG = re.compile(r"\s+")
@@ -78,7 +82,11 @@ def dedup_files(
     fuzzy=False,
     case=False,
     concat=False,
+    external=False,
+    tmp_dir=None,
+    out_file=None,
 ):
+    writer = LineWriter(out_file or sys.stdout)
     deduplifier = SegmentDeduplifier(case=case, concat=concat)
     def split_and_preprocess(line):
         parts = line.strip("\n").split("\t")
@@ -86,17 +94,61 @@ def dedup_files(
             parts =  [deduplifier.preprocess(part) for part in parts]
         return list(parts)
 
+    if external:
+        common_idxs = iter_common_line_idxs_external(
+            file_keep, file_remove, split_and_preprocess, tmp_dir=tmp_dir
+        )
+        writer.write_lines(
+            iter_selected_lines(file_remove, common_idxs, invert=invert)
+        )
+        writer.flush()
+        return
+
     segments = set()
-    with file_keep.open("r") as fp:
+    with open_input(file_keep) as fp:
         for line in fp:
             segments.update(split_and_preprocess(line))
 
-    with file_remove.open("r") as fp:
+    with open_input(file_remove) as fp:
         for line in fp:
             has_common_field = set(split_and_preprocess(line)).intersection(segments)
             should_print = has_common_field if not invert else not has_common_field
             if should_print:
-                sys.stdout.write(line)  # has newline
+                writer.write_line(line.rstrip("\n"))
+    writer.flush()
+
+
+def iter_common_line_idxs_external(file_keep, file_remove, split_fn, tmp_dir=None):
+    """ Yield, in ascending order, the indices of lines in file_remove that
+        have a field in common with some line of file_keep. Fields are hashed
+        and joined by sorting in external memory, so neither file needs to
+        fit in memory. """
+    with ExternalSorter(2, tmp_dir=tmp_dir) as keep_hashes, ExternalSorter(
+        3, tmp_dir=tmp_dir
+    ) as remove_hashes, ExternalSorter(1, tmp_dir=tmp_dir) as common:
+        with open_input(file_keep) as fp:
+            for line in fp:
+                for part in split_fn(line):
+                    keep_hashes.add(split_hash(part))
+        with open_input(file_remove) as fp:
+            for (idx, line) in enumerate(fp):
+                for part in set(split_fn(line)):
+                    remove_hashes.add(split_hash(part) + (idx,))
+
+        # Merge join of the two sorted hash streams
+        keep_iter = iter(keep_hashes)
+        keep = next(keep_iter, None)
+        for (high, low, idx) in remove_hashes:
+            while keep is not None and keep < (high, low):
+                keep = next(keep_iter, None)
+            if keep == (high, low):
+                common.add((idx,))
+
+        prev = None
+        for (idx,) in common:
+            if idx != prev:
+                yield idx
+                prev = idx
 
 
 def path_filetype(path_string):
@@ -155,8 +207,28 @@ def main():
         action="store_true",
         help="Remove spaces between words",
     )
+    opts.add_argument(
+        "--external",
+        dest="external",
+        action="store_true",
+        help="Compare hashed fields by sorting on disk, for files larger than memory",
+    )
+    opts.add_argument(
+        "--tmp_dir",
+        dest="tmp_dir",
+        default=None,
+        help="Directory for temporary files (with --external)",
+    )
+    opts.add_argument(
+        "-o",
+        "--out_file",
+        dest="out_file",
+        default=None,
+        help="Output file, compressed if it ends with .gz, .xz, .bz2 or .zst",
+    )
 
     args = parser.parse_args()
+    out_file = open_output(args.out_file)
 
     dedup_files(
         args.file_keep,
@@ -165,7 +237,12 @@ def main():
         args.fuzzy,
         args.case,
         args.concat,
+        args.external,
+        args.tmp_dir,
+        out_file,
     )
+    if out_file is not sys.stdout:
+        out_file.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Bounded edit distance
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Levenshtein distance for callers that only need to know whether it
+     reaches a bound. A common prefix and suffix never change the distance
+     and a length difference is a lower bound for it, which settles most
+     pairs of sentences that are translations of each other without any
+     dynamic programming. Small bounds, such as the fixed ones of the
+     edit-distance filters, are settled in Ukkonen's (1985) band of the
+     table, which usually gives up after a few rows. For larger bounds the
+     band is wider than it is worth in Python and the C implementation of
+     editdistance computes the full distance instead.
+
+"""
+
+import math
+
+# Largest bound settled in the band, above it editdistance is faster
+_MAX_BAND_BOUND = 3
+
+
+def bounded_edit_distance(a, b, bound):
+    """ Levenshtein distance between the sequences a and b if it is less
+        than bound, otherwise bound """
+    if bound <= 0 or abs(len(a) - len(b)) >= bound:
+        # Every extra element of the longer one costs an insertion
+        return bound
+    # A common prefix or suffix never changes the distance
+    common = min(len(a), len(b))
+    start = 0
+    while start < common and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < common - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start : len(a) - end]
+    b = b[start : len(b) - end]
+    if not a or not b:
+        return len(a) or len(b)
+    if bound <= _MAX_BAND_BOUND:
+        return _banded_distance(a, b, bound)
+    import editdistance  # only needed for large bounds
+
+    return min(editdistance.eval(a, b), bound)
+
+
+def _banded_distance(a, b, bound):
+    """ Levenshtein distance between a and b, capped at bound, filling only
+        the diagonals of the table that can hold a value below bound
+        (Ukkonen 1985) and stopping at the first row without one """
+    if len(a) > len(b):
+        a, b = b, a
+    n, m = len(a), len(b)
+    width = bound - 1  # diagonals further from the main one cost >= bound
+    prev = [j if j < bound else bound for j in range(m + 1)]
+    cur = [bound] * (m + 1)
+    for i in range(1, n + 1):
+        lo = i - width if i > width else 1
+        hi = i + width if i + width < m else m
+        left = i if lo == 1 and i < bound else bound
+        cur[lo - 1] = left
+        row_min = left
+        diag = prev[lo - 1]
+        x = a[i - 1]
+        for j in range(lo, hi + 1):
+            up = prev[j]
+            value = diag if x == b[j - 1] else diag + 1
+            if up < value:
+                value = up + 1
+            if left < value:
+                value = left + 1
+            if value > bound:
+                value = bound
+            cur[j] = value
+            left = value
+            diag = up
+            if value < row_min:
+                row_min = value
+        if row_min >= bound:
+            # Distances never decrease along a diagonal
+            return bound
+        if hi < m:
+            cur[hi + 1] = bound
+        prev, cur = cur, prev
+    return prev[m]
+
+
+def relative_edit_bound(length, ratio):
+    """ Smallest number of edits d with d / length >= ratio """
+    bound = math.ceil(length * ratio)
+    while bound > 0 and (bound - 1) / length >= ratio:
+        bound -= 1
+    while bound / length < ratio:
+        bound += 1
+    return bound
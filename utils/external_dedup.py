@@ -0,0 +1,193 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     External memory deduplication
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Deduplication of key streams that do not fit in memory. Keys are hashed
+     to 128 bits and sorted in bounded memory by spilling sorted runs to a
+     temporary directory and merging them. With 128 bit hashes a collision
+     is not expected before ~10^18 keys, so the result is exact in practice.
+
+     The records held in memory before a run is spilled are limited by an
+     estimate of their size in Python objects, 64 MiB by default, which is
+     a few hundred thousand records. Runs are merged in groups of _FAN_IN
+     as they accumulate, so that the final merge has few files open
+     however long the input.
+
+"""
+
+import heapq
+import itertools
+import os
+import struct
+import tempfile
+
+from compact_hash import hash_key
+
+DEFAULT_BUFFER_BYTES = 64 << 20  # memory for records before spilling a run
+_READ_RECORDS = 1 << 12  # records read or written at a time
+_FAN_IN = 64  # runs merged at a time
+_LOW_MASK = (1 << 64) - 1
+
+
+def split_hash(key):
+    """ 128 bit hash of key as a (high, low) pair of 64 bit integers """
+    hashed = hash_key(key, bits=128)
+    return (hashed >> 64, hashed & _LOW_MASK)
+
+
+def records_in(buffer_bytes, width):
+    """ Number of buffered records of width integers that take about
+        buffer_bytes: a tuple, its integers of up to 64 bits and a list slot
+        come to about 56 + 40 * width bytes """
+    return max(1, buffer_bytes // (56 + 40 * width))
+
+
+class ExternalSorter:
+    """ Sort tuples of unsigned 64 bit integers with bounded memory. Records
+        are buffered and written to disk as sorted runs, iterating merges
+        the runs. max_records defaults to what fits in
+        DEFAULT_BUFFER_BYTES. """
+
+    def __init__(self, width, tmp_dir=None, max_records=None):
+        self._struct = struct.Struct("<" + "Q" * width)
+        self._tmp_dir = tmp_dir
+        self._max_records = max_records or records_in(DEFAULT_BUFFER_BYTES, width)
+        self._buffer = []
+        self._runs = []
+        self._levels = []  # number of merges behind each run
+        self.num_records = 0
+
+    def add(self, record):
+        self._buffer.append(record)
+        self.num_records += 1
+        if len(self._buffer) >= self._max_records:
+            self._spill()
+
+    def _write_run(self, records):
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self._tmp_dir)
+        pack = self._struct.pack
+        with os.fdopen(fd, "wb") as fh:
+            records = iter(records)
+            while True:
+                chunk = list(itertools.islice(records, _READ_RECORDS))
+                if not chunk:
+                    return path
+                fh.write(b"".join(pack(*rec) for rec in chunk))
+
+    def _spill(self):
+        self._buffer.sort()
+        self._runs.append(self._write_run(self._buffer))
+        self._levels.append(0)
+        self._buffer = []
+        # Levels do not increase along the list, merge the last _FAN_IN runs
+        # when they are of the same level
+        while len(self._runs) >= _FAN_IN and self._levels[-_FAN_IN] == self._levels[-1]:
+            paths = self._runs[-_FAN_IN:]
+            merged = self._write_run(heapq.merge(*map(self._read_run, paths)))
+            for path in paths:
+                os.remove(path)
+            level = self._levels[-1] + 1
+            del self._runs[-_FAN_IN:], self._levels[-_FAN_IN:]
+            self._runs.append(merged)
+            self._levels.append(level)
+
+    def _read_run(self, path):
+        chunk_size = self._struct.size * _READ_RECORDS
+        with open(path, "rb") as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    return
+                yield from self._struct.iter_unpack(chunk)
+
+    def __iter__(self):
+        self._buffer.sort()
+        runs = [self._read_run(path) for path in self._runs]
+        return heapq.merge(*runs, iter(self._buffer))
+
+    def close(self):
+        for path in self._runs:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._runs = []
+        self._levels = []
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ExternalDeduplifier:
+    """ Find the first occurrence of each key in a stream of keys too large
+        to keep in memory. Keys are numbered in the order they are added and
+        first_occurrences() yields the numbers of the first occurrence of
+        each distinct key, in ascending (i.e. original input) order.
+        num_unique_keys is known once the first of those has been read. """
+
+    def __init__(self, tmp_dir=None, max_records=None):
+        self._tmp_dir = tmp_dir
+        self._max_records = max_records
+        self._keys = ExternalSorter(3, tmp_dir=tmp_dir, max_records=max_records)
+        self.num_keys = 0
+        self.num_unique_keys = 0
+
+    def add(self, key):
+        """ Add a key, returns its sequence number """
+        seq = self.num_keys
+        self._keys.add(split_hash(key) + (seq,))
+        self.num_keys += 1
+        return seq
+
+    def first_occurrences(self):
+        with ExternalSorter(
+            1, tmp_dir=self._tmp_dir, max_records=self._max_records
+        ) as firsts:
+            prev = None
+            # Sorted by (hash, seq), so the first record of a hash has the
+            # lowest sequence number
+            for (high, low, seq) in self._keys:
+                if (high, low) != prev:
+                    firsts.add((seq,))
+                    prev = (high, low)
+            self.num_unique_keys = firsts.num_records
+            self._keys.close()
+            for (seq,) in firsts:
+                yield seq
+
+    def close(self):
+        self._keys.close()
+
+
+class FirstOccurrences:
+    """ Answer "is key number seq the first occurrence of its key?" for
+        nondecreasing seq, while streaming the result of an
+        ExternalDeduplifier. """
+
+    def __init__(self, deduplifier):
+        self._firsts = deduplifier.first_occurrences()
+        self._next = -1
+
+    def is_first(self, seq):
+        while self._next is not None and self._next < seq:
+            self._next = next(self._firsts, None)
+        return self._next == seq
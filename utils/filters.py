@@ -24,8 +24,10 @@
 
 
 import collections
+import bisect
 import functools
-import json
+import itertools
+import math
 import os
 import re
 import sys
@@ -34,30 +36,41 @@ import time
 # from langid.langid import LanguageIdentifier, model
 # import pycld2 as cld2
 
-import editdistance
 
 from symbols import (
-    SYMBOL_WHITELIST,
-    BANNED_SYMBOLS,
+    BANNED,
     SUBSTITUTE_FOR_NULL,
     PUNCTUATION_SYMBOLS,
-    QUOTE_LIKE,
     ICE_QUOTE,
+    WRONG_QUOTE,
+    SymbolScan,
 )
 
-import tokenizer
+# Importing this module does not import tokenizer (see get_tokenizer),
+# editdistance (only used by edit_distance for large bounds), hashlib (used
+# by compact_hash, count_store and external_dedup, which are imported by the
+# backends that need them) or multiprocessing (--jobs), nor json and pickle.
+# They are imported where they are first used, so that running a few light
+# filters from the command line starts fast.
+from edit_distance import bounded_edit_distance, relative_edit_bound
+from minhash import MinHashLSH, minhash_signature
+from stream_io import (
+    LineWriter,
+    compression_of_path,
+    decode_line,
+    iter_lines,
+    iter_range_lines,
+    open_input,
+    open_output,
+    shard_range,
+)
+from tsv_index import TSVIndex, can_index
+from subword_encoder import SubwordEncoder
 
 _PROJECT_DIR = os.path.dirname(os.path.realpath("__file__"))
 _ENIS_VOCAB_PATH = "/home/haukur/github/Reynir/resources/vocab.enis.16384.subwords"
 _TMP_DIR = "/tmp/filters"
 
-T2T_AVAILABLE = True
-try:
-    from tensor2tensor.data_generators import text_encoder
-except ImportError:
-    print("Running without tensor2tensor", file=sys.stderr)
-    T2T_AVAILABLE = False
-
 ENC = None
 
 # LANGID_IDENTIFIER = LanguageIdentifier.from_modelstring(model, norm_probs=True)
@@ -68,36 +81,288 @@ ENC = None
 
 MAX_SUBTOKENS_PER_SENTENCE = 256
 MAX_CHARS_PER_SENTENCE = 500
-BANNED_SYMBOLS_PAT = "[" + re.escape(BANNED_SYMBOLS) + "]"
 DEFAULT_MIN_WORD_COUNT = 3
+DEFAULT_MAX_WORD_LENGTH = 50
+DEFAULT_CHUNK_SIZE = 2000
+DEFAULT_BATCH_SIZE = 250
+DEFAULT_CHECKPOINT_EVERY = 1000000
+SHARD_FORMAT_VERSION = 2
 
 
 class Example:
-    def __init__(self, src, tgt, file_id=None, align_score=None):
+    """ A sentence pair, source is English and target Icelandic. line is the
+        input line for as long as the example is unchanged and analysis the
+        cached Analysis of its sentences. Filters written for the older dict
+        representation can still use ex.source, ex.target and ex.get. """
+
+    __slots__ = ("source", "target", "file_id", "align_score", "line", "analysis")
+    _FIELDS = {
+        "en": "source",
+        "is": "target",
+        "file_id": "file_id",
+        "align_score": "align_score",
+    }
+
+    def __init__(self, src, tgt, file_id=None, align_score=None, line=None):
         self.source = src
         self.target = tgt
         self.file_id = file_id
         self.align_score = align_score
+        self.line = line
+        self.analysis = None
+
+    @classmethod
+    def from_dict(cls, ex):
+        return cls(ex["en"], ex["is"], ex.get("file_id"), ex.get("align_score"))
+
+    def __getitem__(self, key):
+        if key not in self._FIELDS:
+            raise KeyError(key)
+        return getattr(self, self._FIELDS[key])
+
+    def __setitem__(self, key, value):
+        if key not in self._FIELDS:
+            raise KeyError(key)
+        setattr(self, self._FIELDS[key], value)
+        self.line = None
+
+    def __contains__(self, key):
+        return key in self._FIELDS
+
+    def get(self, key, default=None):
+        return self[key] if key in self._FIELDS else default
+
+    def __eq__(self, other):
+        if not isinstance(other, Example):
+            return NotImplemented
+        return (self.source, self.target, self.file_id, self.align_score) == (
+            other.source,
+            other.target,
+            other.file_id,
+            other.align_score,
+        )
+
+    __hash__ = None
 
     def __str__(self):
         return "\t".join([self.source, self.target])
 
     def __repr__(self):
         ret = [self.source, self.target, self.file_id, self.align_score]
-        return "[" + "\t".join(ret) + "]"
+        return "[" + "\t".join(str(item) for item in ret) + "]"
 
 
 def print_ex(ex):
-    print("\t".join([ex["en"], ex["is"]]))
+    print("\t".join([ex.source, ex.target]))
+
+
+def get_tokenizer():
+    """ The Greynir tokenizer module, imported on first use """
+    import tokenizer
+
+    return tokenizer
 
 
 def get_or_initialize_encoder():
     global ENC
     if ENC is None:
-        ENC = text_encoder.SubwordTextEncoder(_ENIS_VOCAB_PATH)
+        ENC = SubwordEncoder(_ENIS_VOCAB_PATH)
     return ENC
 
 
+class Analysis:
+    """ Data derived from the sentences of an example, computed lazily and
+        memoized so that filters sharing e.g. the subword encoding only pay
+        for it once. Each value is computed per language ("is" or "en"). """
+
+    def __init__(self, ice, eng):
+        self.ice = ice
+        self.eng = eng
+        self._cache = {}
+
+    def is_valid_for(self, ex):
+        # Identity rather than equality, transformations that changed
+        # anything return new strings.
+        return self.ice is ex.target and self.eng is ex.source
+
+    def text(self, lang):
+        return self.ice if lang == "is" else self.eng
+
+    def _memoize(self, key, lang, compute):
+        cache_key = (key, lang)
+        if cache_key not in self._cache:
+            self._cache[cache_key] = compute(self.text(lang))
+        return self._cache[cache_key]
+
+    def subwords(self, lang):
+        """ Subword ids from the shared encoder """
+        return self._memoize(
+            "subwords", lang, lambda text: get_or_initialize_encoder().encode(text)
+        )
+
+    def words(self, lang):
+        """ Matches of \\w+ """
+        prog = RegexCache.compile_rx(r"\w+")
+        return self._memoize("words", lang, prog.findall)
+
+    def tokens(self, lang):
+        """ Tokens from the Greynir tokenizer """
+        return self._memoize(
+            "tokens", lang, lambda text: list(get_tokenizer().tokenize(text))
+        )
+
+    def word_tokens(self, lang):
+        tokenizer = get_tokenizer()
+        return self._memoize(
+            "word_tokens",
+            lang,
+            lambda text: [
+                tok
+                for tok in self.tokens(lang)
+                if tok.txt is not None and tok.kind == tokenizer.TOK.WORD
+            ],
+        )
+
+    def has_word_tokens(self, lang, min_count):
+        """ Whether there are at least min_count word tokens, without
+            tokenizing more than needed """
+        if ("word_tokens", lang) in self._cache:
+            return len(self.word_tokens(lang)) >= min_count
+        return self._memoize(
+            ("has_word_tokens", min_count),
+            lang,
+            lambda text: has_word_tokens(text, min_count),
+        )
+
+    def num_subwords(self, lang):
+        return len(self.subwords(lang))
+
+    def cached(self, key, compute):
+        """ Memoized compute() for a value derived from both sentences """
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def is_cached(self, key):
+        return key in self._cache
+
+    def symbols(self):
+        """ SymbolScan of both sentences, shared by the symbol filters """
+        return self.cached("symbols", lambda: SymbolScan(self.ice, self.eng))
+
+    def pattern_rejects(self):
+        """ Names of the pattern filters that reject the sentences """
+        return self.cached(
+            "pattern_rejects", lambda: RejectPatterns.fired(self.ice, self.eng)
+        )
+
+
+_MERGING_WORDS = None
+_SYMBOL_UNITS = None
+
+
+def _tokenizer_word_tables():
+    """ Lowercase words that the tokenizer may merge with a neighbour into a
+        single token that is not a word (a time, date, year, amount or
+        measurement) or into one word with the words around it (composites
+        such as "fjármála- og efnahagsráðuneyti"), and units the tokenizer
+        makes word tokens of although they have no letters """
+    global _MERGING_WORDS, _SYMBOL_UNITS
+    if _MERGING_WORDS is None:
+        from tokenizer.definitions import (
+            AMOUNT_ABBREV,
+            CLOCK_ABBREVS,
+            CLOCK_HALF,
+            CLOCK_NUMBERS,
+            MONTHS,
+            SI_UNITS,
+            YEAR_WORD,
+        )
+
+        _MERGING_WORDS = frozenset(
+            word.lower()
+            for word in itertools.chain(
+                MONTHS,
+                CLOCK_ABBREVS,
+                CLOCK_NUMBERS,
+                CLOCK_HALF,
+                YEAR_WORD,
+                AMOUNT_ABBREV,
+                SI_UNITS,
+                ("hálf", "og", "eða"),
+            )
+        )
+        _SYMBOL_UNITS = [
+            unit for unit in SI_UNITS if not any(c.isalpha() for c in unit)
+        ]
+    return _MERGING_WORDS, _SYMBOL_UNITS
+
+
+# Runs of \w characters other than digits, letters unless there are other
+# numerals such as "²" or "Ⅷ" in the text
+_LETTER_RUN_PROG = re.compile(r"[^\W\d_]+")
+_DIGIT_PROG = re.compile(r"\d")
+
+
+def has_word_tokens(text, min_count):
+    """ Whether the Greynir tokenizer finds at least min_count word tokens in
+        text. In text without numerals every word token contains a run of
+        letters (or is a symbol unit), and a lowercase word between spaces
+        is a word token unless the tokenizer may merge it with a neighbour,
+        which settles most sentences without tokenizing. Otherwise tokens
+        are only generated until the count is reached. """
+    if min_count <= 0:
+        return True
+    merging_words, symbol_units = _tokenizer_word_tables()
+    runs = None if _DIGIT_PROG.search(text) else _LETTER_RUN_PROG.findall(text)
+    if runs is not None and all(map(str.isalpha, runs)):
+        if len(runs) + sum(text.count(unit) for unit in symbol_units) < min_count:
+            return False
+        count = 0
+        for chunk in text.split():
+            word = chunk.rstrip(".,;:!?")
+            if word.isalpha() and word.islower() and word not in merging_words:
+                count += 1
+                if count >= min_count:
+                    return True
+    tokenizer = get_tokenizer()
+    count = 0
+    for tok in tokenizer.tokenize(text):
+        if tok.txt is not None and tok.kind == tokenizer.TOK.WORD:
+            count += 1
+            if count >= min_count:
+                return True
+    return False
+
+
+def analyze(ex):
+    """ Get the Analysis attached to an example, (re)creating it if the
+        example has none or its sentences have been transformed since. """
+    analysis = ex.analysis
+    if analysis is None or not analysis.is_valid_for(ex):
+        analysis = Analysis(ex.target, ex.source)
+        ex.analysis = analysis
+    return analysis
+
+
+def same_text(ex, other):
+    return ex.target == other.target and ex.source == other.source
+
+
+def with_text(ex, ice, eng):
+    """ Result of a transformation: ex itself if the sentences are unchanged,
+        which tells the pipeline that nothing happened, otherwise a new
+        example with the same provenance. """
+    if ice == ex.target and eng == ex.source:
+        return ex
+    return Example(eng, ice, ex.file_id, ex.align_score)
+
+
+def example_to_line(ex):
+    line = ex.line
+    return line if line is not None else "\t".join([ex.source, ex.target])
+
+
 # def probably_correct_language(text, lang_code, lower_bound=0.8):
 #     isReliable, bytesFound, *rest = list(cld2.detect(text.lower()))
 #     langName, langCode, prob, _ = rest[0][0]
@@ -112,7 +377,44 @@ class Deduplifier:
     """Deduplify sentence pairs using Tilde's approach (Tilde 2018)
        Along with a few others."""
 
+    BACKENDS = ("set", "hash64", "hash128")
     _set = set()
+    _added = None  # keys added since the last checkpoint, if checkpointing
+    _num_external_keys = None  # unique keys of the last Pipeline.run_external
+
+    @classmethod
+    def use_backend(cls, backend="set", capacity=1 << 16):
+        """ Choose how seen keys are stored: "set" keeps the full keys,
+            "hash64" and "hash128" keep only a hash of each key in a
+            CompactHashSet. 64 bit hashes take a quarter of the space of the
+            smallest Python strings but make a false duplicate likely after
+            a few billion keys, 128 bits take twice the space of 64. """
+        if backend not in cls.BACKENDS:
+            raise ValueError("Unknown deduplication backend {0}".format(backend))
+        cls._added = None
+        if backend == "set":
+            cls._set = set()
+        else:
+            from compact_hash import CompactHashSet
+
+            bits = int(backend[len("hash") :])
+            cls._set = CompactHashSet(bits=bits, capacity=capacity)
+
+    @classmethod
+    def describe(cls):
+        if cls._num_external_keys is not None:
+            return "{0} keys in external memory".format(cls._num_external_keys)
+        if isinstance(cls._set, set):
+            return "{0} keys in a set".format(len(cls._set))
+        return (
+            "{num} keys as {bits} bit hashes in {mib:.1f} MiB, "
+            "collision probability {prob:.2g}".format(
+                num=len(cls._set),
+                bits=cls._set.bits,
+                mib=cls._set.memory_usage() / 2 ** 20,
+                prob=cls._set.collision_probability(),
+            )
+        )
 
     @classmethod
     def preprocess_sentence(cls, sentence):
@@ -127,32 +429,85 @@ class Deduplifier:
 
     @classmethod
     def preprocess_example(cls, ex):
-        ice, eng = ex["is"], ex["en"]
+        ice, eng = ex.target, ex.source
         ice = cls.preprocess_sentence(ice)
         eng = cls.preprocess_sentence(eng)
         return eng + "\t" + ice
 
+    @classmethod
+    def is_unique_key(cls, key):
+        if not isinstance(cls._set, set):
+            # CompactHashSet
+            is_unique = cls._set.add(key)
+        elif key in cls._set:
+            is_unique = False
+        else:
+            cls._set.add(key)
+            is_unique = True
+        if is_unique and cls._added is not None:
+            cls._added.append(key)
+        return is_unique
+
     @classmethod
     def is_unique_example(cls, ex):
-        key = cls.preprocess_example(ex)
-        if key in cls._set:
-            return False
-        cls._set.add(key)
-        return True
+        return cls.is_unique_key(cls.preprocess_example(ex))
+
+
+class NearDeduplifier:
+    """Reject sentence pairs that are near duplicates of an earlier pair,
+       i.e. whose character shingles have an estimated Jaccard similarity
+       of at least the threshold, using MinHash signatures and an LSH index."""
+
+    threshold = 0.8
+    num_perm = 32
+    shingle_size = 5  # bytes of normalized text
+    _index = None
+
+    @classmethod
+    def configure(cls, threshold=0.8, num_perm=32, shingle_size=5):
+        cls.threshold = threshold
+        cls.num_perm = num_perm
+        cls.shingle_size = shingle_size
+        cls._index = None
+
+    @classmethod
+    def preprocess_sentence(cls, sentence):
+        # Like Deduplifier but keeping word boundaries for the shingles
+        digit_prog = RegexCache.compile_rx(r"\d+")
+        punct_prog = RegexCache.compile_rx("[" + re.escape(PUNCTUATION_SYMBOLS) + "]")
+        space_prog = RegexCache.compile_rx(r"\s+")
+        sentence = sentence.lower()
+        sentence = digit_prog.sub("0", sentence)
+        sentence = punct_prog.sub("", sentence)
+        sentence = space_prog.sub(" ", sentence).strip()
+        return sentence
+
+    @classmethod
+    def signature(cls, ex):
+        text = (
+            cls.preprocess_sentence(ex.source)
+            + "\t"
+            + cls.preprocess_sentence(ex.target)
+        )
+        return minhash_signature(text, cls.num_perm, cls.shingle_size)
+
+    @classmethod
+    def is_unique_signature(cls, sig):
+        if cls._index is None:
+            cls._index = MinHashLSH(threshold=cls.threshold, num_perm=cls.num_perm)
+        return cls._index.insert_if_unique(sig)
 
     @classmethod
     def is_unique_example(cls, ex):
-        key = cls.preprocess_example(ex)
-        if key in cls._set:
-            return False
-        cls._set.add(key)
-        return True
+        return cls.is_unique_signature(cls.signature(ex))
 
 
 class Transformations:
     """Transformations of examples to be used in a pipeline"""
 
     _transforms = {}  # registered transformations
+    _batch_transforms = {}  # batch versions of registered transformations
+    _text_transforms = {}  # name -> (function of a sentence, langs, char map)
 
     @classmethod
     def apply(cls, name, ex):
@@ -161,6 +516,10 @@ class Transformations:
         else:
             return cls._transforms[name](ex)
 
+    @classmethod
+    def apply_batch(cls, name, exs):
+        return cls.get_batch(name)(exs)
+
     @classmethod
     def register(cls, fun):
         if fun.__name__ not in cls._transforms:
@@ -170,6 +529,36 @@ class Transformations:
                 "Tried to register transform {0} more than once".format(fun.__name__)
             )
 
+    @classmethod
+    def register_text(cls, name, text_fun, langs, char_map=None):
+        if name not in cls._transforms:
+            raise KeyError("Could not find transformation {0}".format(name))
+        cls._text_transforms[name] = (text_fun, tuple(langs), char_map)
+
+    @classmethod
+    def register_batch(cls, name, fun):
+        if name not in cls._transforms:
+            raise KeyError("Could not find transformation {0}".format(name))
+        if name in cls._batch_transforms:
+            raise ValueError(
+                "Tried to register batch transform {0} more than once".format(name)
+            )
+        cls._batch_transforms[name] = fun
+
+    @classmethod
+    def get_batch(cls, name):
+        """ Return a function that maps a list of examples to a list of
+            (possibly) rewritten examples. Transformations without a batch
+            version are applied to one example at a time. """
+        if name in cls._batch_transforms:
+            return cls._batch_transforms[name]
+        if name not in cls._transforms:
+            raise KeyError("Could not find transformation {0}".format(name))
+        fun = cls._transforms[name]
+        batch_fun = functools.wraps(fun)(lambda exs: [fun(ex) for ex in exs])
+        cls._batch_transforms[name] = batch_fun
+        return batch_fun
+
 
 class RegexCache:
     _programs = {}  # compiled regular expressions
@@ -182,10 +571,130 @@ class RegexCache:
         return cls._programs[pattern]
 
 
+class RejectPatterns:
+    """ Filters that reject an example when a regular expression matches its
+        Icelandic and/or English sentence. The patterns of the filters in use
+        are combined into one alternation per language, so a sentence is
+        scanned once, and a batch is first scanned as a whole to find the few
+        examples with any match. Only for those are the individual patterns
+        run, to find exactly which filters reject the example. Patterns that
+        start with a literal are much cheaper to search for. """
+
+    _patterns = {}  # filter name -> {lang: compiled pattern}
+    _require_all = set()  # filters that reject only if every side matches
+    _active = None  # names of the filters in the combined patterns, None = all
+    _combined = {}  # lang -> compiled alternation, or None
+
+    @classmethod
+    def register(cls, name, ice=None, eng=None, require_all=False):
+        patterns = {lang: pat for (lang, pat) in (("is", ice), ("en", eng)) if pat}
+        if not patterns:
+            raise ValueError("Pattern filter {0} has no patterns".format(name))
+        cls._patterns[name] = {
+            lang: RegexCache.compile_rx(pat) for (lang, pat) in patterns.items()
+        }
+        if require_all:
+            cls._require_all.add(name)
+        cls._combined = {}
+
+    @classmethod
+    def use(cls, names):
+        """ Only combine the patterns of these filters, e.g. those of the
+            pipeline that is about to run """
+        active = frozenset(name for name in names if name in cls._patterns)
+        if active != cls._active:
+            cls._active = active
+            cls._combined = {}
+
+    @classmethod
+    def is_active(cls, name):
+        return cls._active is None or name in cls._active
+
+    @classmethod
+    def combined(cls, lang):
+        if lang not in cls._combined:
+            alternatives = [
+                "(?:{0})".format(progs[lang].pattern)
+                for (name, progs) in cls._patterns.items()
+                if lang in progs and cls.is_active(name)
+            ]
+            cls._combined[lang] = (
+                re.compile("|".join(alternatives)) if alternatives else None
+            )
+        return cls._combined[lang]
+
+    @classmethod
+    def accepts(cls, name, ex):
+        """ Evaluate a single filter on its own """
+        texts = {"is": ex.target, "en": ex.source}
+        matched = [
+            prog.search(texts[lang]) is not None
+            for (lang, prog) in cls._patterns[name].items()
+        ]
+        return not (all(matched) if name in cls._require_all else any(matched))
+
+    @classmethod
+    def fired(cls, ice, eng):
+        """ Names of the active filters that reject the sentence pair """
+        texts = {"is": ice, "en": eng}
+        hits = {}
+        for lang in texts:
+            prog = cls.combined(lang)
+            hits[lang] = prog is not None and prog.search(texts[lang]) is not None
+        if not any(hits.values()):
+            return frozenset()
+        fired = set()
+        for (name, progs) in cls._patterns.items():
+            if not cls.is_active(name):
+                continue
+            matched = [
+                hits[lang] and prog.search(texts[lang]) is not None
+                for (lang, prog) in progs.items()
+            ]
+            if all(matched) if name in cls._require_all else any(matched):
+                fired.add(name)
+        return frozenset(fired)
+
+    @classmethod
+    def apply_batch(cls, name, exs):
+        """ Keep-mask of the filter name """
+        if not cls.is_active(name):
+            return [cls.accepts(name, ex) for ex in exs]
+        analyses = [analyze(ex) for ex in exs]
+        unscanned = [a for a in analyses if not a.is_cached("pattern_rejects")]
+        if unscanned:
+            cls._prescan(unscanned)
+        return [name not in analysis.pattern_rejects() for analysis in analyses]
+
+    @classmethod
+    def _prescan(cls, analyses):
+        """ Search each side of a batch at once and record that the examples
+            outside of every match are rejected by none of the filters. A
+            match within a sentence is also a match within the joined text,
+            so no sentence with a match is missed. """
+        candidates = set()
+        for lang in ("is", "en"):
+            prog = cls.combined(lang)
+            if prog is None:
+                continue
+            texts = [analysis.text(lang) for analysis in analyses]
+            starts = [0]
+            for text in texts[:-1]:
+                starts.append(starts[-1] + len(text) + 1)
+            for match in prog.finditer("\n".join(texts)):
+                first = bisect.bisect_right(starts, match.start()) - 1
+                last = bisect.bisect_right(starts, match.end() - 1) - 1
+                candidates.update(range(first, last + 1))
+        for (i, analysis) in enumerate(analyses):
+            if i not in candidates:
+                analysis.cached("pattern_rejects", frozenset)
+
+
 class Filters:
 
     _programs = {}  # compiled regular expressions
     _filters = {}  # registered filters
+    _batch_filters = {}  # batch versions of registered filters
 
     @classmethod
     def register(cls, fun):
@@ -204,6 +713,54 @@ class Filters:
             res = cls._filters[filter_name](ex)
             return not res if inverted else res
 
+    @classmethod
+    def apply_batch(cls, filter_name, exs, inverted=False):
+        mask = cls.get_batch(filter_name)(exs)
+        return [not keep for keep in mask] if inverted else mask
+
+    @classmethod
+    def register_batch(cls, filter_name, fun):
+        if filter_name not in cls._filters:
+            raise KeyError("Could not find filter {0}".format(filter_name))
+        if filter_name in cls._batch_filters:
+            raise ValueError(
+                "Tried to register batch filter {0} more than once".format(
+                    filter_name
+                )
+            )
+        cls._batch_filters[filter_name] = fun
+
+    @classmethod
+    def get_batch(cls, filter_name):
+        """ Return a function that maps a list of examples to a keep-mask.
+            Filters without a batch version are applied to one example
+            at a time. """
+        if filter_name in cls._batch_filters:
+            return cls._batch_filters[filter_name]
+        if filter_name not in cls._filters:
+            raise KeyError("Could not find filter {0}".format(filter_name))
+        fun = cls._filters[filter_name]
+        batch_fun = functools.wraps(fun)(lambda exs: [bool(fun(ex)) for ex in exs])
+        cls._batch_filters[filter_name] = batch_fun
+        return batch_fun
+
+
+def register_pattern_filter(name, ice=None, eng=None, require_all=False):
+    """ Create and register a filter (with its batch version) that rejects
+        an example when ice matches its Icelandic sentence or eng its English
+        one, or only when both match if require_all is set. """
+    RejectPatterns.register(name, ice=ice, eng=eng, require_all=require_all)
+
+    def fun(ex):
+        if not RejectPatterns.is_active(name):
+            return RejectPatterns.accepts(name, ex)
+        return name not in analyze(ex).pattern_rejects()
+
+    fun.__name__ = fun.__qualname__ = name
+    Filters.register(fun)
+    Filters.register_batch(name, lambda exs: RejectPatterns.apply_batch(name, exs))
+    return fun
+
 
 def register_filter(fun):
     @functools.wraps(fun)
@@ -223,9 +780,202 @@ def register_transformation(fun):
     return wrapper
 
 
-@register_transformation
-def fix_ice_quotes(ex):
-    ice, eng = ex["is"], ex["en"]
+def register_batch_filter(scalar_fun):
+    """ Register the decorated function as the batch version of scalar_fun.
+        It receives a list of examples and returns a list of booleans. """
+
+    def decorator(fun):
+        Filters.register_batch(scalar_fun.__name__, fun)
+        return fun
+
+    return decorator
+
+
+def register_batch_transformation(scalar_fun):
+    """ Register the decorated function as the batch version of scalar_fun.
+        It receives a list of examples and returns a list of examples. """
+
+    def decorator(fun):
+        Transformations.register_batch(scalar_fun.__name__, fun)
+        return fun
+
+    return decorator
+
+
+def register_text_transformation(langs=("is", "en"), char_map=None):
+    """ Register a transformation given as a function of one sentence and its
+        language, which is applied to the sentences of langs. The function
+        must return the sentence itself if it changes nothing. Runs of such
+        transformations are fused into one stage when a plan is compiled. """
+
+    def decorator(text_fun):
+        @functools.wraps(text_fun)
+        def fun(ex):
+            ice = text_fun(ex.target, "is") if "is" in langs else ex.target
+            eng = text_fun(ex.source, "en") if "en" in langs else ex.source
+            return with_text(ex, ice, eng)
+
+        Transformations.register(fun)
+        Transformations.register_text(fun.__name__, text_fun, langs, char_map)
+        return fun
+
+    return decorator
+
+
+def register_char_map_transformation(name, char_map):
+    """ Create and register a transformation that replaces single characters,
+        char_map maps each character to its replacement (possibly empty). """
+    table = str.maketrans(char_map)
+    prog = re.compile("[" + re.escape("".join(char_map)) + "]")
+    only_non_ascii = not any(char.isascii() for char in char_map)
+
+    def text_fun(text, lang):
+        if (only_non_ascii and text.isascii()) or prog.search(text) is None:
+            return text
+        return text.translate(table)
+
+    text_fun.__name__ = text_fun.__qualname__ = name
+    return register_text_transformation(char_map=char_map)(text_fun)
+
+
+class FusedRewrite:
+    """ A run of consecutive text transformations applied as one stage. Each
+        sentence goes through the whole run at once, without intermediate
+        examples, and adjacent character map transformations are merged into
+        a single str.translate. The result and the transformations reported
+        as fired are exactly those of applying the run one by one. Given a
+        Profiler, the time of each member is recorded as well; a merged
+        character map is one str.translate and its time is split evenly
+        between its members. """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self._steps = {lang: self._compile(lang) for lang in ("is", "en")}
+
+    def _compile(self, lang):
+        steps = []
+        char_maps = []  # pending run of (name, char map) to merge
+        for name in self.names:
+            text_fun, langs, char_map = Transformations._text_transforms[name]
+            if lang not in langs:
+                continue
+            if char_map is not None and self._can_merge(char_maps, char_map):
+                char_maps.append((name, char_map))
+                continue
+            steps.extend(self._char_map_steps(char_maps, lang))
+            char_maps = [(name, char_map)] if char_map is not None else []
+            if char_map is None:
+                steps.append(self._text_step(name, text_fun, lang))
+        steps.extend(self._char_map_steps(char_maps, lang))
+        return steps
+
+    @staticmethod
+    def _can_merge(char_maps, char_map):
+        # Merging is exact if no character is replaced twice and no earlier
+        # replacement produces a character that a later map replaces
+        for (_, earlier) in char_maps:
+            produced = set("".join(earlier.values()))
+            if set(earlier) & set(char_map) or produced & set(char_map):
+                return False
+        return True
+
+    @staticmethod
+    def _text_step(name, text_fun, lang):
+        fired = (name,)
+
+        def step(text):
+            new_text = text_fun(text, lang)
+            return new_text, (fired if new_text != text else ())
+
+        step.names = fired
+        return step
+
+    @staticmethod
+    def _char_map_steps(char_maps, lang):
+        if not char_maps:
+            return []
+        if len(char_maps) == 1:
+            name = char_maps[0][0]
+            text_fun = Transformations._text_transforms[name][0]
+            return [FusedRewrite._text_step(name, text_fun, lang)]
+        merged = {}
+        for (_, char_map) in char_maps:
+            merged.update(char_map)
+        table = str.maketrans(merged)
+        prog = re.compile("[" + re.escape("".join(merged)) + "]")
+        member_progs = [
+            (name, re.compile("[" + re.escape("".join(char_map)) + "]"))
+            for (name, char_map) in char_maps
+        ]
+        only_non_ascii = not any(char.isascii() for char in merged)
+
+        def step(text):
+            if (only_non_ascii and text.isascii()) or prog.search(text) is None:
+                return text, ()
+            fired = tuple(name for (name, p) in member_progs if p.search(text))
+            return text.translate(table), fired
+
+        step.names = tuple(name for (name, _) in char_maps)
+        return [step]
+
+    def __call__(self, exs, profiler=None):
+        """ List of (example, names of the transformations that fired) """
+        ice_steps, eng_steps = self._steps["is"], self._steps["en"]
+        elapsed = None if profiler is None else collections.Counter()
+        results = []
+        for ex in exs:
+            fired = set()
+            ice = self._run_steps(ice_steps, ex.target, fired, elapsed)
+            eng = self._run_steps(eng_steps, ex.source, fired, elapsed)
+            if fired:
+                fired = [name for name in self.names if name in fired]
+                results.append((with_text(ex, ice, eng), fired))
+            else:
+                results.append((ex, ()))
+        if profiler is not None and exs:
+            member_elapsed = collections.Counter()
+            for (step, seconds) in elapsed.items():
+                for name in step.names:
+                    member_elapsed[name] += seconds / len(step.names)
+            for name in self.names:
+                if name in member_elapsed:
+                    profiler.record(name, member_elapsed[name], len(exs), member=True)
+        return results
+
+    @staticmethod
+    def _run_steps(steps, text, fired, elapsed=None):
+        if elapsed is None:
+            for step in steps:
+                text, names = step(text)
+                fired.update(names)
+            return text
+        for step in steps:
+            start = time.perf_counter()
+            text, names = step(text)
+            elapsed[step] += time.perf_counter() - start
+            fired.update(names)
+        return text
+
+
+def batch_sub(prog, repl, exs):
+    """ Apply prog.sub to both sides of every example in one pass, returns
+        None if the batch cannot be split back up unambiguously. """
+    texts = [text for ex in exs for text in (ex.target, ex.source)]
+    res, num_subs = prog.subn(repl, "\n".join(texts))
+    if not num_subs:
+        return list(exs)
+    parts = res.split("\n")
+    if len(parts) != len(texts):
+        return None
+    return [
+        with_text(ex, parts[2 * i], parts[2 * i + 1]) for (i, ex) in enumerate(exs)
+    ]
+
+
+@register_text_transformation(langs=("is",))
+def fix_ice_quotes(ice, lang):
+    if ice.isascii():
+        return ice
     ice = ice.replace(  # 0x201d  RIGHT DOUBLE QUOTATION MARK
         "”", ICE_QUOTE.PRIMARY.RIGHT
     )
@@ -234,52 +984,59 @@ def fix_ice_quotes(ex):
         ice = ice.replace(ICE_QUOTE.SECONDARY.LEFT, ICE_QUOTE.PRIMARY.LEFT)
         ice = ice.replace(ICE_QUOTE.SECONDARY.RIGHT, ICE_QUOTE.PRIMARY.RIGHT)
 
-    return {"is": ice, "en": eng}
+    return ice
 
 
-@register_transformation
-def fix_improper_line_split(ex):
-    ice_prog = RegexCache.compile_rx(r"(\b(?!\d)\w+)- (\b(?!eða|og)\w+\b)")
-    eng_prog = RegexCache.compile_rx(r"(\b(?!\d)\w+)- (\b(?!or|and)\w+\b)")
-    ice = ice_prog.sub(r"\1\2", ex["is"])
-    eng = eng_prog.sub(r"\1\2", ex["en"])
-    return {"is": ice, "en": eng}
+@register_text_transformation()
+def fix_improper_line_split(text, lang):
+    if "- " not in text:
+        return text
+    if lang == "is":
+        prog = RegexCache.compile_rx(r"(\b(?!\d)\w+)- (\b(?!eða|og)\w+\b)")
+    else:
+        prog = RegexCache.compile_rx(r"(\b(?!\d)\w+)- (\b(?!or|and)\w+\b)")
+    return prog.sub(r"\1\2", text)
 
 
-@register_transformation
-def remove_leading_bullet(ex):
-    ice, eng = ex["is"], ex["en"]
+@register_text_transformation()
+def remove_leading_bullet(text, lang):
     # bullet, hyphen-minus, n-dash, horizontal bar
+    if not text.startswith(("•", "-", "–", "―", ".")):
+        return text
     prog = RegexCache.compile_rx(r"(^(• ?|- |– |― |\.\s?)+)")
-    sice = prog.sub("", ice)
-    seng = prog.sub("", eng)
-    return {"is": sice, "en": seng}
+    return prog.sub("", text)
+
+
+# hyphen, n-dash, horizontal bar, m-dash, minus sign, figure dash
+replace_dashes = register_char_map_transformation(
+    "replace_dashes", dict.fromkeys("‐–―—−‒", "-")  # hyphen-minus
+)
 
 
-@register_transformation
-def replace_dashes(ex):
-    ice, eng = ex["is"], ex["en"]
-    # hyphen, n-dash, horizontal bar, m-dash, minus sign, figure dash
+@register_batch_transformation(replace_dashes)
+def replace_dashes_batch(exs):
     prog = RegexCache.compile_rx(r"(‐|–|―|—|−|‒)")
-    sice = prog.sub("-", ice)  # hyphen-minus
-    seng = prog.sub("-", eng)  # hyphen-minus
-    return {"is": sice, "en": seng}
+    res = batch_sub(prog, "-", exs)
+    return res if res is not None else [replace_dashes(ex) for ex in exs]
+
+
+soft_hyphen = register_char_map_transformation(
+    "soft_hyphen", {SUBSTITUTE_FOR_NULL: ""}
+)
 
 
-@register_transformation
-def soft_hyphen(ex):
-    ice, eng = ex["is"], ex["en"]
+@register_batch_transformation(soft_hyphen)
+def soft_hyphen_batch(exs):
     prog = RegexCache.compile_rx(SUBSTITUTE_FOR_NULL)
-    return {"is": prog.sub("", ice), "en": prog.sub("", eng)}
+    res = batch_sub(prog, "", exs)
+    return res if res is not None else [soft_hyphen(ex) for ex in exs]
 
 
-@register_transformation
-def merge_spaces(ex):
-    ice, eng = ex["is"], ex["en"]
-    prog = RegexCache.compile_rx(r"\s+")
-    ice = prog.sub(" ", ice).strip(" ")
-    eng = prog.sub(" ", eng).strip(" ")
-    return {"is": ice, "en": eng}
+@register_text_transformation()
+def merge_spaces(text, lang):
+    # Same as replacing runs of \s with a space and stripping spaces
+    merged = " ".join(text.split())
+    return text if merged == text else merged
 
 
 @register_filter
@@ -287,85 +1044,62 @@ def deduplicate(ex):
     return Deduplifier.is_unique_example(ex)
 
 
+@register_filter
+def near_duplicate(ex):
+    return NearDeduplifier.is_unique_example(ex)
+
+
 @register_filter
 def banned_symbol(ex):
     # TODO(haukurb): this filter is to gather file ids for filtering
-    ice, eng = ex["is"], ex["en"]
-    prog = RegexCache.compile_rx(BANNED_SYMBOLS_PAT)
-    backslash = "\\"
-    found = backslash in ice
-    found = found or backslash in eng
-    found = found or prog.search(ice) or prog.search(eng)
-    return not found
+    return not analyze(ex).symbols().has(BANNED)
 
 
 @register_filter
 def whitelist_symbol(ex):
-    ice, eng = ex["is"], ex["en"]
-    chars_ex = set(ice)
-    chars_ex.update(eng)
-    has_non_whitelisted = bool(chars_ex - SYMBOL_WHITELIST)
-    return not has_non_whitelisted
+    return analyze(ex).symbols().all_whitelisted
 
 
 @register_filter
 def null_sentence(ex):
     prog = RegexCache.compile_rx(r"^\s+$")
-    is_only_spaces = prog.match(ex["is"]) or prog.match(ex["en"])
-    is_empty = not ex["is"] or not ex["en"]
+    is_only_spaces = prog.match(ex.target) or prog.match(ex.source)
+    is_empty = not ex.target or not ex.source
     return not is_only_spaces and not is_empty
 
 
-@register_filter
-def quote_inside_word(ex):
-    # TODO(haukurb): gather file ids from this filter
-    prog = RegexCache.compile_rx(r'\w+"\w')
-    has_error = prog.search(ex["is"]) or prog.search(ex["en"])
-    return not has_error
+# TODO(haukurb): gather file ids from this filter
+# Matches wherever \w+"\w does, but starts with a literal
+quote_inside_word = register_pattern_filter(
+    "quote_inside_word", ice=r'"(?<=\w")(?=\w)', eng=r'"(?<=\w")(?=\w)'
+)
 
 
-@register_filter
-def ocr_wrong_symbol(ex):
-    # TODO(haukurb): gather file ids from this filter
-    ice, eng = ex["is"], ex["en"]
-    prog = RegexCache.compile_rx(r",,")
-    return not prog.search(ice)
+# TODO(haukurb): gather file ids from this filter
+ocr_wrong_symbol = register_pattern_filter("ocr_wrong_symbol", ice=r",,")
 
 
 @register_filter
 def ocr_word_boundary_avg_length(ex):
-    ice, eng = ex["is"], ex["en"]
-    prog = RegexCache.compile_rx(r"\w+")
-    lens_ice = [len(m) for m in prog.findall(ice)]
-    lens_eng = [len(m) for m in prog.findall(eng)]
+    analysis = analyze(ex)
+    lens_ice = [len(m) for m in analysis.words("is")]
+    lens_eng = [len(m) for m in analysis.words("en")]
     avg_ice = sum(lens_ice) / len(lens_ice)
     avg_eng = sum(lens_eng) / len(lens_eng)
     return avg_ice > 1.8 and avg_eng > 1.8
 
 
-@register_filter
-def missing_letter(ex):
-    # TODO(haukurb): gather file ids from this filter
-    ice = ex["is"]
-    substrings = [
-        r" a ",
-        r" e ",
-        r" i ",
-        r" o ",
-        r" u ",
-        r" y ",
-        r"\bvi\b",
-        r"\bess\b",
-        r"\bme\b",
-        r"\bessum\b",
-    ]
-    found = re.search("(" + "|".join(substrings) + ")", ice)
-    return not found
+# TODO(haukurb): gather file ids from this filter
+missing_letter = register_pattern_filter(
+    "missing_letter",
+    # " a ", " e ", ..., "\bvi\b", "\bess\b", "\bme\b", "\bessum\b"
+    ice=r" [aeiouy] |\b(?:vi|me|ess(?:um)?)\b",
+)
 
 
 @register_filter
 def alphanumeric(ex):
-    ice, eng = ex["is"], ex["en"]
+    ice, eng = ex.target, ex.source
     prog = RegexCache.compile_rx(r"[^\d\W]")
     mice = prog.search(ice)
     meng = prog.search(eng)
@@ -373,46 +1107,37 @@ def alphanumeric(ex):
 
 
 @register_filter
-def sentence_length_ratio(ex):
-    ice, eng = len(ex["is"]), len(ex["en"])
-    res1 = ice > 3 or not (ice < 3 * eng)  # ice > 3 implies ice < 3 * eng
-    res2 = eng > 3 or not (eng < 3 * ice)
+def sentence_length_ratio(ex, factor=3):
+    ice, eng = len(ex.target), len(ex.source)
+    res1 = ice > 3 or not (ice < factor * eng)  # ice > 3 implies ice < 3 * eng
+    res2 = eng > 3 or not (eng < factor * ice)
     return res1 and res2
 
 
 @register_filter
-def strict_sentence_length_ratio(ex):
-    ice, eng = len(ex["is"]), len(ex["en"])
-    res1 = ice > 3 or not (ice < 2 * eng)  # ice > 3 implies ice < 3 * eng
-    res2 = eng > 3 or not (eng < 2 * ice)
+def strict_sentence_length_ratio(ex, factor=2):
+    ice, eng = len(ex.target), len(ex.source)
+    res1 = ice > 3 or not (ice < factor * eng)  # ice > 3 implies ice < 3 * eng
+    res2 = eng > 3 or not (eng < factor * ice)
     return res1 and res2
 
 
 @register_filter
-def token_count_ratio(ex):
-    if not T2T_AVAILABLE:
-        print(
-            "Skipping {0} because t2t is not available".format(
-                token_count_ratio.__name__
-            ),
-            file=sys.stderr,
-        )
-        return ex
-    enc = get_or_initialize_encoder()
-    ice = len(enc.encode(ex["is"]))
-    eng = len(enc.encode(ex["en"]))
+def token_count_ratio(ex, factor=0.5, min_count=4):
+    analysis = analyze(ex)
+    ice = analysis.num_subwords("is")
+    eng = analysis.num_subwords("en")
     # ice > n implies ice < k * eng is equivalent to
-    MIN_COUNT = 4
-    if ice < MIN_COUNT or eng < MIN_COUNT:
+    if ice < min_count or eng < min_count:
         return True
 
-    res = (0.5 * ice < eng) and (0.5 * eng < ice)
+    res = (factor * ice < eng) and (factor * eng < ice)
     return res
 
 
 @register_filter
 def case_mismatch(ex):
-    ice, eng = ex["is"], ex["en"]
+    ice, eng = ex.target, ex.source
     ice = ice.upper() == ice
     eng = eng.upper() == eng
     return ice == eng
@@ -422,8 +1147,8 @@ def case_mismatch(ex):
 def digit_mismatch(ex):
     prog = RegexCache.compile_rx(r"\D+")
     # Remove non-digit characters, group consecutive numbers, filter empty string
-    ice = [w for w in prog.sub(" ", ex["is"]).strip(" ").split(" ") if w]
-    eng = [w for w in prog.sub(" ", ex["en"]).strip(" ").split(" ") if w]
+    ice = [w for w in prog.sub(" ", ex.target).strip(" ").split(" ") if w]
+    eng = [w for w in prog.sub(" ", ex.source).strip(" ").split(" ") if w]
     dice = collections.Counter(ice)
     deng = collections.Counter(eng)
     mismatch = bool(dice - deng) or bool(deng - dice)
@@ -432,7 +1157,7 @@ def digit_mismatch(ex):
 
 @register_filter
 def quote_mismatch(ex):
-    ice, eng = ex["is"], ex["en"]
+    ice, eng = ex.target, ex.source
     prog = RegexCache.compile_rx(re.escape('"'))
     nice = len(prog.findall(ice))
     neng = len(prog.findall(eng))
@@ -441,16 +1166,18 @@ def quote_mismatch(ex):
 
 @register_filter
 def abs_min_string_edit(ex):
-    ice, eng = ex["is"], ex["en"]
-    dist = editdistance.eval(ice, eng)
+    ice, eng = ex.target, ex.source
+    dist = bounded_edit_distance(ice, eng, 3)
     return dist >= 3
 
 
 @register_filter
 def rel_min_string_edit(ex):
-    ice, eng = ex["is"], ex["en"]
-    num_edits = editdistance.eval(ice, eng)
+    ice, eng = ex.target, ex.source
     lengths = [len(ice), len(eng)]
+    # Any count of edits that passes both ratios gives the same verdict
+    bound = relative_edit_bound(max(lengths), 0.10)
+    num_edits = bounded_edit_distance(ice, eng, bound)
     min_ratio = num_edits / min(lengths)
     max_ratio = num_edits / max(lengths)
     return (max_ratio >= 0.10) and (min_ratio >= 0.10)
@@ -458,20 +1185,22 @@ def rel_min_string_edit(ex):
 
 @register_filter
 def abs_min_subtoken_edit(ex):
-    enc = get_or_initialize_encoder()
-    ice = enc.encode(ex["is"])
-    eng = enc.encode(ex["en"])
-    dist = editdistance.eval(ice, eng)
+    analysis = analyze(ex)
+    ice = analysis.subwords("is")
+    eng = analysis.subwords("en")
+    dist = bounded_edit_distance(ice, eng, 2)
     return dist >= 2
 
 
 @register_filter
 def rel_min_subtoken_edit(ex):
-    enc = get_or_initialize_encoder()
-    ice = enc.encode(ex["is"])
-    eng = enc.encode(ex["en"])
-    num_edits = editdistance.eval(ice, eng)
+    analysis = analyze(ex)
+    ice = analysis.subwords("is")
+    eng = analysis.subwords("en")
     lengths = [len(ice), len(eng)]
+    # Any count of edits that passes both ratios gives the same verdict
+    bound = relative_edit_bound(max(lengths), 0.10)
+    num_edits = bounded_edit_distance(ice, eng, bound)
     min_ratio = num_edits / min(lengths)
     max_ratio = num_edits / max(lengths)
     return (max_ratio >= 0.10) and (min_ratio >= 0.10)
@@ -479,193 +1208,512 @@ def rel_min_subtoken_edit(ex):
 
 @register_filter
 def colon_mismatch(ex):
-    ice, eng = ex["is"], ex["en"]
+    ice, eng = ex.target, ex.source
     mismatch = ":" in ice and (":" not in eng and ";" not in eng)
     mismatch = mismatch or (":" in eng and ":" not in ice)
     return not mismatch
 
 
-@register_filter
-def corrupt_symbol(ex):
-    ice, eng = ex["is"], ex["en"]
-    symbols = re.escape("?")
-    pat = r"\w[" + symbols + "]+\w"
-    prog = RegexCache.compile_rx(pat)
-    found = prog.search(ice) or prog.search(eng)
-    return not found
-
+# Matches wherever \w\?+\w does, but starts with a literal
+corrupt_symbol = register_pattern_filter(
+    "corrupt_symbol", ice=r"\?(?<=\w\?)\?*\w", eng=r"\?(?<=\w\?)\?*\w"
+)
 
-@register_filter
-def improper_line_split(ex):
-    ice, eng = ex["is"], ex["en"]
-    ice_prog = RegexCache.compile_rx(r"(\b(?!\d)\w+)- (\b(?!eða|og)\w+\b)")
-    ice_matches = ice_prog.findall(ice)
-    eng_prog = RegexCache.compile_rx(r"(\b(?!\d)\w+- \b(?!or|and)\w+\b)")
-    eng_matches = eng_prog.findall(eng)
-    return len(ice_matches) == 0 or len(eng_matches) == 0
 
+improper_line_split = register_pattern_filter(
+    "improper_line_split",
+    ice=r"(\b(?!\d)\w+)- (\b(?!eða|og)\w+\b)",
+    eng=r"(\b(?!\d)\w+- \b(?!or|and)\w+\b)",
+    require_all=True,
+)
 
-@register_filter
-def dot_pattern(ex):
-    ice, eng = ex["is"], ex["en"]
-    prog = RegexCache.compile_rx("(" + r"\.\s+" + "){2,}")
-    found = prog.search(ice) or prog.search(eng)
-    return not found
+# Matches wherever (\.\s+){2,} does
+dot_pattern = register_pattern_filter(
+    "dot_pattern", ice=r"\.\s+\.\s", eng=r"\.\s+\.\s"
+)
 
 
 @register_filter
 def bullet_mismatch(ex):
     # Suggests misalignment since a bullet is a sentence boundary
-    ice, eng = ex["is"], ex["en"]
+    ice, eng = ex.target, ex.source
     nice = ice.count("•")
     neng = eng.count("•")
     return nice == neng
 
 
 @register_filter
-def max_word_length(ex):
-    ice, eng = ex["is"], ex["en"]
-    word_prog = RegexCache.compile_rx(r"\b\w+\b")
-    ice_words = word_prog.findall(ice)
-    eng_words = word_prog.findall(eng)
-    max_ice_len = 50
-    max_eng_len = 50
+def max_word_length(ex, max_length=DEFAULT_MAX_WORD_LENGTH):
+    analysis = analyze(ex)
+    ice_words = analysis.words("is")
+    eng_words = analysis.words("en")
     return (
-        max(len(w) for w in ice_words) <= max_ice_len
-        and max(len(w) for w in eng_words) <= max_eng_len
+        max(len(w) for w in ice_words) <= max_length
+        and max(len(w) for w in eng_words) <= max_length
     )
 
 
 @register_filter
-def min_word_count(ex):
-    isl_toks = [
-        tok
-        for tok in tokenizer.tokenize(ex["is"])
-        if tok.txt is not None and tok.kind == tokenizer.TOK.WORD
-    ]
-    eng_toks = [
-        tok
-        for tok in tokenizer.tokenize(ex["en"])
-        if tok.txt is not None and tok.kind == tokenizer.TOK.WORD
-    ]
-    return (
-        len(isl_toks) >= DEFAULT_MIN_WORD_COUNT
-        and len(eng_toks) >= DEFAULT_MIN_WORD_COUNT
+def min_word_count(ex, min_count=DEFAULT_MIN_WORD_COUNT):
+    analysis = analyze(ex)
+    return analysis.has_word_tokens("is", min_count) and analysis.has_word_tokens(
+        "en", min_count
     )
 
 
 class Gather:
-
-    _store = None
-    _prev_store = None
-    _initialized_with_file = False
+    """ A filter that needs statistics of the whole input. Pipelines create
+        one instance per run: gather() adds an example and returns the key
+        that accept() later decides it by, instances that gathered other
+        parts of the input (chunks in worker processes, shards) are added
+        with merge() and finalize() is called once everything has been
+        gathered. The verdicts are replayed from traces, see
+        Pipeline._spool_gathered. Once finalized, gather() only returns the
+        key, so that a run resumed with the gatherers saved in a checkpoint
+        does not gather its input again. """
+
+    finalized = False
 
     @classmethod
-    def _idemp_init(cls):
-        """ Idempotently initialize, if gather data exists from last run
-            it will be used to filter/transform. Otherwise, pipeline needs
-            to be executed twice. """
+    def partial(cls):
+        """ Instance for gathering a chunk in a worker process, to be merged
+            into the instance of the run """
+        return cls()
+
+    def gather(self, ex):
+        key = self.key(ex)
+        if not self.finalized:
+            self.add(key)
+        return key
+
+    def key(self, ex):
         raise NotImplementedError
 
-    @classmethod
-    def gather(cls, ex):
+    def add(self, key):
         raise NotImplementedError
 
-    @classmethod
-    def save_to_file(cls):
-        # Write gathered data to file
-        # This depends on the data structure the gatherer uses
+    def merge(self, other):
+        raise NotImplementedError
+
+    def finalize(self):
+        pass
+
+    def accept(self, key):
         raise NotImplementedError
 
 
 class MinFrequency(Gather):
+    """ Reject pairs with a word seen fewer than min_freq times in the
+        input. Words are counted exactly, or approximately in a
+        CountMinSketch if configured. """
 
     auto_pass_len = 3  # for numbers and abbreviations
     min_freq = 2
-    word_prog = RegexCache.compile_rx(r"\b\w+\b")
+    sketch_width = None  # exact counts, see configure
+    sketch_depth = 4
     num_prog = RegexCache.compile_rx(r"^\d+$")
 
     @classmethod
-    def _idemp_init(cls):
-        if cls._store is not None:
-            return
-        try:
-            os.makedirs(_TMP_DIR, exist_ok=True)
-            path = os.path.join(_TMP_DIR, cls.__name__)
-            with open(path, "r") as fh:
-                cls._prev_store = json.load(fh)
-        except (FileNotFoundError, json.decoder.JSONDecodeError) as e:
-            pass
-        cls._store = {"eng": collections.Counter(), "ice": collections.Counter()}
+    def configure(cls, sketch_width=None, sketch_depth=4):
+        """ Gather exact counts, or if sketch_width is given approximate
+            counts in a CountMinSketch of sketch_width * sketch_depth
+            counters, which may let rare words pass but bounds memory """
+        cls.sketch_width = sketch_width
+        cls.sketch_depth = sketch_depth
 
     @classmethod
-    def save_to_file(cls):
-        try:
-            os.makedirs(_TMP_DIR, exist_ok=True)
-            path = os.path.join(_TMP_DIR, cls.__name__)
-            with open(path, "w") as fh:
-                json.dump(cls._store, fh, indent=2)
-        except FileNotFoundError:
-            pass
-
-    @classmethod
-    def gather(cls, ex):
-        cls._idemp_init()
-        ice, eng = ex["is"], ex["en"]
-        ice_words = cls.word_prog.findall(ice)
-        eng_words = cls.word_prog.findall(eng)
-        ice_words = [
-            w.lower()
-            for w in ice_words
-            if len(w) > cls.auto_pass_len and not cls.num_prog.match(w)
-        ]
-        eng_words = [
+    def partial(cls):
+        # A chunk has few words, a Counter of them is cheaper to send than
+        # a sketch
+        return cls(exact=True)
+
+    def __init__(self, exact=False):
+        if exact or self.sketch_width is None:
+            self._counts = (collections.Counter(), collections.Counter())
+        else:
+            from count_store import CountMinSketch
+
+            self._counts = tuple(
+                CountMinSketch(self.sketch_width, self.sketch_depth) for _ in range(2)
+            )
+
+    def _words(self, analysis, lang):
+        return [
             w.lower()
-            for w in eng_words
-            if len(w) > cls.auto_pass_len and not cls.num_prog.match(w)
+            for w in analysis.words(lang)
+            if len(w) > self.auto_pass_len and not self.num_prog.match(w)
         ]
-        cls._store["ice"].update(ice_words)
-        cls._store["eng"].update(eng_words)
 
-        if cls._prev_store:
-            pice = all(
-                cls._prev_store["ice"].get(w, 0) >= cls.min_freq for w in ice_words
-            )
-            peng = all(
-                cls._prev_store["eng"].get(w, 0) >= cls.min_freq for w in eng_words
-            )
-            return pice and peng
-        return True
+    def key(self, ex):
+        analysis = analyze(ex)
+        return (self._words(analysis, "en"), self._words(analysis, "is"))
 
+    def add(self, key):
+        for (counts, words) in zip(self._counts, key):
+            counts.update(words)
 
-@register_filter
-def wrong_quotes(ex):
-    ice, eng = ex["is"], ex["en"]
+    def merge(self, other):
+        for (counts, other_counts) in zip(self._counts, other._counts):
+            counts.update(other_counts)
 
-    QUOTES = set(QUOTE_LIKE)
-    QUOTES.remove("'")
-    QUOTES.remove('"')
-    QUOTES.remove(",")
-    for q in ICE_QUOTE.ALL:
-        try:
-            QUOTES.remove(q)
-        except:
-            pass
+    def finalize(self):
+        """ Move exact counts to memory-mapped tables, which take no heap
+            memory while the input is filtered """
+        import tempfile
+        from count_store import open_counts, write_counts
+
+        if not isinstance(self._counts[0], collections.Counter):
+            return
+        os.makedirs(_TMP_DIR, exist_ok=True)
+        tables = []
+        for counts in self._counts:
+            fd, path = tempfile.mkstemp(suffix=".counts", dir=_TMP_DIR)
+            os.close(fd)
+            try:
+                write_counts(path, counts)
+                tables.append(open_counts(path))
+            finally:
+                # The map stays valid
+                os.remove(path)
+        self._counts = tuple(tables)
+
+    def accept(self, key):
+        return all(
+            counts.get(w, 0) >= self.min_freq
+            for (counts, words) in zip(self._counts, key)
+            for w in words
+        )
 
-    chars_ex = set(ice)
-    chars_ex.update(eng)
 
-    return not bool(chars_ex & QUOTES)
+@register_filter
+def wrong_quotes(ex):
+    return not analyze(ex).symbols().has(WRONG_QUOTE)
 
 
 # @register_filter
 # def language(ex):
-#     ice, eng = ex["is"], ex["en"]
+#     ice, eng = ex.target, ex.source
 #     correct = probably_correct_language(ice, "is", lower_bound=0.995)
 #     correct = correct and probably_correct_language(eng, "en", lower_bound=0.995)
 #     return correct
 
 
+class FunctionStats:
+    """ Timing of one pipeline function. Functions are called on whole
+        batches, per-example latencies are the batch time divided by the
+        batch size and are kept in a histogram with logarithmic buckets so
+        that stats from worker processes can be merged. """
+
+    BUCKETS_PER_DOUBLING = 8
+
+    def __init__(self):
+        self.calls = 0  # number of examples the function was applied to
+        self.batches = 0
+        self.total_time = 0.0
+        self.buckets = collections.Counter()
+
+    def add(self, elapsed, num_examples):
+        self.calls += num_examples
+        self.batches += 1
+        self.total_time += elapsed
+        latency = elapsed / num_examples
+        bucket = math.floor(
+            math.log2(max(latency, 1e-9)) * self.BUCKETS_PER_DOUBLING
+        )
+        self.buckets[bucket] += num_examples
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.batches += other.batches
+        self.total_time += other.total_time
+        self.buckets.update(other.buckets)
+
+    @property
+    def mean(self):
+        return self.total_time / (self.calls or 1)
+
+    def quantile(self, q):
+        """ Upper bound of the bucket containing the q-th quantile """
+        target = q * self.calls
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return 2 ** ((bucket + 1) / self.BUCKETS_PER_DOUBLING)
+        return 0.0
+
+
+class Profiler:
+    """ Per-function wall time accounting for a pipeline run. Members of a
+        fused stage are recorded besides the stage and do not count towards
+        the total time. The p99 is that of per-batch mean latencies, see
+        FunctionStats. The JSON export and the Prometheus metrics
+        (filters_function_<key>) share the keys of METRICS. """
+
+    # (key, Prometheus type, help)
+    METRICS = [
+        ("seconds_total", "counter", "Cumulative wall time"),
+        ("calls_total", "counter", "Number of examples processed"),
+        ("batches_total", "counter", "Number of batches processed"),
+        ("mean_seconds", "gauge", "Mean latency per example"),
+        (
+            "p99_batch_mean_seconds",
+            "gauge",
+            "99th percentile of the mean latency per example of a batch",
+        ),
+        ("time_share", "gauge", "Share of total pipeline time"),
+    ]
+
+    def __init__(self):
+        self.stats = collections.OrderedDict()
+        self.members = set()  # names of fused stage members
+
+    def record(self, name, elapsed, num_examples, member=False):
+        if name not in self.stats:
+            self.stats[name] = FunctionStats()
+        self.stats[name].add(elapsed, num_examples)
+        if member:
+            self.members.add(name)
+
+    def merge(self, other):
+        for (name, stats) in other.stats.items():
+            if name not in self.stats:
+                self.stats[name] = FunctionStats()
+            self.stats[name].merge(stats)
+        self.members.update(other.members)
+
+    @property
+    def total_time(self):
+        return sum(
+            stats.total_time
+            for (name, stats) in self.stats.items()
+            if name not in self.members
+        )
+
+    def to_dict(self, names=None):
+        names = [name for name in (names or self.stats) if name in self.stats]
+        total_time = self.total_time
+        return {
+            "seconds_total": total_time,
+            "functions": [
+                {
+                    "name": name,
+                    "member": name in self.members,
+                    "seconds_total": self.stats[name].total_time,
+                    "calls_total": self.stats[name].calls,
+                    "batches_total": self.stats[name].batches,
+                    "mean_seconds": self.stats[name].mean,
+                    "p99_batch_mean_seconds": self.stats[name].quantile(0.99),
+                    "time_share": self.stats[name].total_time / (total_time or 1),
+                }
+                for name in names
+            ],
+        }
+
+    def write_json(self, path, names=None):
+        import json
+
+        with open(path, "w") as fh:
+            json.dump(self.to_dict(names), fh, indent=2)
+
+    def write_prometheus(self, path, pipeline_name, names=None):
+        functions = self.to_dict(names)["functions"]
+        lines = []
+        for (key, kind, help_text) in self.METRICS:
+            metric = "filters_function_" + key
+            lines.append("# HELP {0} {1}".format(metric, help_text))
+            lines.append("# TYPE {0} {1}".format(metric, kind))
+            for fn in functions:
+                lines.append(
+                    '{0}{{pipeline="{1}",function="{2}"}} {3!r}'.format(
+                        metric, pipeline_name, fn["name"], fn[key]
+                    )
+                )
+        with open(path, "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+
+    def summarize(self, names=None, indent=4):
+        print("-" * 80)
+        print(
+            "{indent}{name:<30s}  {calls:>9s}  {secs:>8s}  {mean:>9s}  {p99:>9s}  {share:>6s}".format(
+                indent=" " * indent,
+                name="Name",
+                calls="Calls",
+                secs="Seconds",
+                mean="Mean (us)",
+                p99="p99b (us)",
+                share="Share",
+            )
+        )
+        for fn in self.to_dict(names)["functions"]:
+            print(
+                "{indent}{name:<30s}  {calls:>9d}  {secs:>8.2f}  {mean:>9.1f}  {p99:>9.1f}  {share:>5.1f}%".format(
+                    indent=" " * indent,
+                    # Members of a fused stage are listed under it
+                    name=("  " if fn["member"] else "") + fn["name"],
+                    calls=fn["calls_total"],
+                    secs=fn["seconds_total"],
+                    mean=1e6 * fn["mean_seconds"],
+                    p99=1e6 * fn["p99_batch_mean_seconds"],
+                    share=100 * fn["time_share"],
+                )
+            )
+
+
+def check_params(fun, params):
+    """ Raise ValueError unless params are keyword arguments of fun with
+        values of the same type as their defaults """
+    import inspect
+
+    signature = inspect.signature(fun)
+    for (key, value) in params.items():
+        param = signature.parameters.get(key)
+        if param is None or param.default is param.empty:
+            raise ValueError(
+                "{0} has no parameter named {1}".format(fun.__name__, key)
+            )
+        default = param.default
+        if isinstance(default, (int, float)) and not isinstance(default, bool):
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            valid = default is None or isinstance(value, type(default))
+        if not valid:
+            raise ValueError(
+                "Invalid value {0!r} for parameter {1} of {2}".format(
+                    value, key, fun.__name__
+                )
+            )
+
+
+class Stage(
+    collections.namedtuple(
+        "Stage", "name kind fn scalar make_key members", defaults=(None,)
+    )
+):
+    """ A step of a compiled pipeline plan. fn maps a list of examples to a
+        list of examples (transformations) or a keep-mask (filters and
+        gatherers), scalar is its single example version with parameters
+        bound and make_key is the key function of deferred filters and
+        gatherers. A fused stage holds the transformation stages it replaces
+        in members and its fn returns (example, names of fired
+        transformations) pairs. """
+
+    __slots__ = ()
+
+    TRANSFORM = "transform"
+    FUSED = "fused"
+    FILTER = "filter"
+    GATHER = "gather"
+
+
+class FilterScheduler:
+    """ Adaptive ordering of a block of consecutive, stateless filters.
+
+        While the pipeline runs, the scheduler measures the cost per example
+        and the rejection rate of each filter in its block and periodically
+        sorts the block by cost / rejection rate, which minimizes the
+        expected cost per example when the filters are independent. Since an
+        example is kept only if every filter accepts it, the set of kept
+        examples does not depend on the order.
+
+        Which filter an example is counted against does depend on the order
+        when several filters would reject it. Two attribution modes:
+
+          canonical  (default) an example is counted against the first filter
+                     in the pipeline's own order that rejects it, exactly as
+                     without the scheduler. Filters that were skipped because
+                     of the reordering are evaluated for rejected examples
+                     until that filter is found.
+          first      an example is counted against whichever filter rejected
+                     it first under the current order. Cheaper, but the
+                     counts are not comparable between runs.
+
+        If a filter raises on a reordered batch, the batch is re-evaluated
+        in the original order so that errors surface exactly as they would
+        without the scheduler. Costs and rejections are only recorded for
+        the evaluation that gets through, so a batch counts once. """
+
+    ATTRIBUTION_MODES = ("canonical", "first")
+
+    def __init__(self, stages, attribution="canonical", reorder_interval=10):
+        if attribution not in self.ATTRIBUTION_MODES:
+            raise ValueError("Unknown attribution mode {0}".format(attribution))
+        self.stages = list(stages)
+        self.names = [stage.name for stage in self.stages]
+        self.attribution = attribution
+        self.reorder_interval = reorder_interval
+        self.order = list(range(len(self.names)))
+        self._cost = [0.0] * len(self.names)
+        self._calls = [0] * len(self.names)
+        self._rejects = [0] * len(self.names)
+        self._num_batches = 0
+
+    def rank(self, i):
+        if not self._calls[i]:
+            return 0.0
+        cost = self._cost[i] / self._calls[i]
+        reject_rate = (self._rejects[i] + 1) / (self._calls[i] + 2)
+        return cost / reject_rate
+
+    def reorder(self):
+        self.order = sorted(range(len(self.names)), key=lambda i: (self.rank(i), i))
+
+    def run_block(self, idxs, exs, count, profiler=None):
+        """ Apply the block to a batch, returns the surviving idxs and exs.
+            count(name, idx) is called for every rejected example. """
+        self._num_batches += 1
+        try:
+            rejected, idxs, exs, stats = self._evaluate(self.order, idxs, exs)
+        except Exception:
+            if self.order == sorted(self.order):
+                raise
+            canonical = range(len(self.names))
+            rejected, idxs, exs, stats = self._evaluate(canonical, idxs, exs)
+        for (i, elapsed, num_exs, num_rejects) in stats:
+            self._cost[i] += elapsed
+            self._calls[i] += num_exs
+            self._rejects[i] += num_rejects
+            if profiler is not None:
+                profiler.record(self.names[i], elapsed, num_exs)
+        for idx, name in rejected:
+            count(name, idx)
+        if self._num_batches % self.reorder_interval == 0:
+            self.reorder()
+        return idxs, exs
+
+    def _evaluate(self, order, idxs, exs):
+        """ Returns the rejected (idx, name) pairs, the surviving idxs and
+            exs and (filter, seconds, examples, rejections) for each filter
+            that ran """
+        rejected = []
+        stats = []
+        for pos, i in enumerate(order):
+            if not exs:
+                break
+            start = time.perf_counter()
+            mask = self.stages[i].fn(exs)
+            elapsed = time.perf_counter() - start
+            kept_idxs, kept_exs = [], []
+            for idx, ex, keep in zip(idxs, exs, mask):
+                if keep:
+                    kept_idxs.append(idx)
+                    kept_exs.append(ex)
+                    continue
+                rejected.append((idx, self._attribute(ex, i, order[:pos])))
+            stats.append((i, elapsed, len(exs), len(exs) - len(kept_exs)))
+            idxs, exs = kept_idxs, kept_exs
+        return rejected, idxs, exs, stats
+
+    def _attribute(self, ex, i, evaluated):
+        if self.attribution == "first":
+            return self.names[i]
+        evaluated = set(evaluated)
+        for j in range(i):
+            if j not in evaluated and not self.stages[j].scalar(ex):
+                return self.names[j]
+        return self.names[i]
+
+
 class Pipeline:
 
     counter = dict()
@@ -676,7 +1724,9 @@ class Pipeline:
         banned_symbol,
         whitelist_symbol,
         digit_mismatch,
+        # MinFrequency,  # gatherers come before stateful filters
         deduplicate,
+        # near_duplicate,
         case_mismatch,
         max_word_length,
         min_word_count,
@@ -706,54 +1756,808 @@ class Pipeline:
         dot_pattern,
         wrong_quotes,
         # language,
-        # MinFrequency.gather,
-        # MinFrequency,
         # MostCommon50k,
     ]
+    # Stateful filters whose verdict depends on every example seen before.
+    # In parallel runs the workers only compute the key (first function)
+    # and the parent process resolves it in input order (second function).
+    _deferred = {
+        deduplicate.__name__: (
+            Deduplifier.preprocess_example,
+            Deduplifier.is_unique_key,
+        ),
+        near_duplicate.__name__: (
+            NearDeduplifier.signature,
+            NearDeduplifier.is_unique_signature,
+        ),
+    }
+    _params = {}  # function name -> keyword arguments bound in the plan
+    hook = None  # default for --hook
+    hook_inverted = False  # default for --invert
+    _plan = None  # list of Stages, see compile_plan
+    _schedulers = None  # index of first filter in block -> FilterScheduler
+    _gatherers = None  # name -> Gather instance of the current run
+    profiler = None  # Profiler, if per-function timing is enabled
     start_time = None
     end_time = None
 
     @classmethod
-    def run(cls, examples, view_function=None, inverted=False, **kwargs):
+    def run(
+        cls,
+        examples,
+        view_function=None,
+        inverted=False,
+        batch_size=DEFAULT_BATCH_SIZE,
+        adaptive=False,
+        attribution="canonical",
+        profile=False,
+        checkpoint=None,
+        tmp_dir=None,
+        **kwargs
+    ):
         cls.start_time = time.time()
         cls.counter.clear()
         cls.counter["total"] = 0
-        for ex in examples:
+        Deduplifier._num_external_keys = None
+        cls.compile_plan()
+        cls.init_schedulers(adaptive, attribution=attribution)
+        cls.profiler = Profiler() if profile else None
+        cls._start_gatherers()
+        if checkpoint is not None:
+            checkpoint.restore(cls, stride=batch_size)
+        if cls._gatherers:
+            if view_function in cls._deferred or view_function in cls._gatherers:
+                raise ValueError(
+                    "{0} decides only once the input is gathered and cannot "
+                    "be hooked".format(view_function)
+                )
+            traced = cls.trace_examples(
+                examples, batch_size, view_function=view_function, inverted=inverted
+            )
+            if cls._is_gathering():
+                traced = cls._spool_gathered(traced, tmp_dir)
+            for ex, trace in traced:
+                cls.counter["total"] += 1
+                if cls._replay(trace) and ex is not None:
+                    yield ex
+                if checkpoint is not None and cls.counter["total"] % batch_size == 0:
+                    checkpoint(cls)
+            cls._finish()
+            if checkpoint is not None:
+                checkpoint.save(cls)
+            return
+        for batch in iter_chunks(examples, batch_size):
+            cls.counter["total"] += len(batch)
+            results = cls.process_batch(
+                batch, view_function=view_function, inverted=inverted
+            )
+            for ex in results:
+                if ex is not None:
+                    yield ex
+            # Everything read so far has been consumed by now
+            if checkpoint is not None:
+                checkpoint(cls)
+
+        cls._finish()
+        if checkpoint is not None:
+            checkpoint.save(cls)
+
+    @classmethod
+    def run_parallel(
+        cls,
+        lines,
+        jobs,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        adaptive=False,
+        attribution="canonical",
+        profile=False,
+        checkpoint=None,
+        tmp_dir=None,
+        **kwargs
+    ):
+        """ Run the pipeline over chunks of lines in a pool of worker processes.
+            Output is yielded in input order and the worker traces are replayed
+            into cls.counter, so the result is identical to that of run().
+            Gatherers gather in the workers. """
+        cls.start_time = time.time()
+        cls.counter.clear()
+        cls.counter["total"] = 0
+        Deduplifier._num_external_keys = None
+        # Set up before the pool forks, each worker then adapts on its own
+        cls.compile_plan()
+        cls.init_schedulers(adaptive, attribution=attribution)
+        cls.profiler = Profiler() if profile else None
+        cls._start_gatherers()
+        if checkpoint is not None:
+            checkpoint.restore(cls, stride=chunk_size)
+        traced = cls._iter_traced(lines, jobs, chunk_size)
+        if cls._is_gathering():
+            traced = cls._spool_gathered(traced, tmp_dir)
+        for ex, trace in traced:
             cls.counter["total"] += 1
-            ex = cls.process(ex, view_function=view_function, inverted=inverted)
-            if ex is not None:
+            if cls._replay(trace) and ex is not None:
                 yield ex
+            if checkpoint is not None and cls.counter["total"] % chunk_size == 0:
+                checkpoint(cls)
+
+        cls._finish()
+        if checkpoint is not None:
+            checkpoint.save(cls)
+
+    @classmethod
+    def run_external(
+        cls,
+        lines,
+        jobs=1,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        tmp_dir=None,
+        max_records=None,
+        adaptive=False,
+        attribution="canonical",
+        profile=False,
+        **kwargs
+    ):
+        """ Run the pipeline with deduplicate resolved in external memory,
+            for corpora whose keys do not fit in RAM. The first pass hashes
+            the deduplication keys into sorted runs in tmp_dir and spools
+            the traced results there, the second pass merges the runs and
+            replays the spool in input order. The result is identical to
+            that of run() (up to 128 bit hash collisions). Gatherers are
+            finalized between the passes; if they come before deduplicate
+            the keys are only hashed after that, in a pass over the spool,
+            leaving out examples that the gatherers reject. max_records
+            (keys held in memory) defaults to what fits in
+            external_dedup.DEFAULT_BUFFER_BYTES. """
+        from external_dedup import ExternalDeduplifier, FirstOccurrences
+
+        name = deduplicate.__name__
+        names = [obj.__name__ for obj in cls._fns]
+        if name not in names:
+            raise ValueError("{0} has no {1} filter".format(cls.__name__, name))
+        if any(other in cls._deferred for other in names[: names.index(name)]):
+            raise ValueError(
+                "External deduplication requires {0} to be the first "
+                "stateful filter".format(name)
+            )
+        cls.start_time = time.time()
+        cls.counter.clear()
+        cls.counter["total"] = 0
+        Deduplifier._num_external_keys = None
+        cls.compile_plan()
+        cls.init_schedulers(adaptive, attribution=attribution)
+        cls.profiler = Profiler() if profile else None
+        cls._start_gatherers()
+        dedup = ExternalDeduplifier(tmp_dir=tmp_dir, max_records=max_records)
+        # A key only counts as an occurrence if no gatherer before
+        # deduplicate rejects its example, which is known once the gatherers
+        # are finalized, so then the keys are added in a second pass
+        gatherers_first = any(
+            isinstance(obj, type) for obj in cls._fns[: names.index(name)]
+        )
+
+        def add_keys(trace):
+            # Deferred stages before deduplicate are gatherers
+            for (i, item) in enumerate(trace):
+                if not isinstance(item, tuple):
+                    continue
+                (stage, key) = item
+                if stage == name:
+                    return trace[:i] + [(stage, dedup.add(key))] + trace[i + 1 :]
+                if not cls._gatherers[stage].accept(key):
+                    # The replay stops here
+                    break
+            return trace
+
+        spool_paths = []
+        try:
+            traced = cls._iter_traced(lines, jobs, chunk_size)
+            if not gatherers_first:
+                traced = ((ex, add_keys(trace)) for (ex, trace) in traced)
+            spool_paths.append(_spool(traced, tmp_dir))
+            cls._finalize_gatherers()
+            if gatherers_first:
+                traced = _unspool(spool_paths[0])
+                traced = ((ex, add_keys(trace)) for (ex, trace) in traced)
+                spool_paths.append(_spool(traced, tmp_dir))
+            firsts = FirstOccurrences(dedup)
+            for ex, trace in _unspool(spool_paths[-1]):
+                cls.counter["total"] += 1
+                if cls._replay(trace, {name: firsts.is_first}) and ex is not None:
+                    yield ex
+            Deduplifier._num_external_keys = dedup.num_unique_keys
+        finally:
+            dedup.close()
+            for path in spool_paths:
+                os.remove(path)
+
+        cls._finish()
+
+    @classmethod
+    def run_shard(
+        cls,
+        lines,
+        shard_file,
+        shard,
+        input_size,
+        jobs=1,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        adaptive=False,
+        attribution="canonical",
+        profile=False,
+        **kwargs
+    ):
+        """ Run the pipeline over the lines of shard (k, n) of an input of
+            input_size bytes and write the results to the binary file object
+            shard_file, to be combined with the other shards by
+            merge_shards. Stateful filters and gatherers are not resolved,
+            their keys are written with the trace of each line, and the
+            gatherers are written at the end. """
+        import pickle
+
+        cls.start_time = time.time()
+        cls.counter.clear()
+        cls.counter["total"] = 0
+        Deduplifier._num_external_keys = None
+        cls.compile_plan()
+        cls.init_schedulers(adaptive, attribution=attribution)
+        cls.profiler = Profiler() if profile else None
+        cls._start_gatherers()
+        header = {
+            "version": SHARD_FORMAT_VERSION,
+            "pipeline": cls.__name__,
+            "functions": cls.function_names(),
+            "shard": shard,
+            "input_size": input_size,
+        }
+        pickle.dump(header, shard_file, pickle.HIGHEST_PROTOCOL)
+        for ex, trace in cls._iter_traced(lines, jobs, chunk_size):
+            cls.counter["total"] += 1
+            line = None if ex is None else example_to_line(ex)
+            pickle.dump((line, trace), shard_file, pickle.HIGHEST_PROTOCOL)
+        cls.end_time = time.time()
+        trailer = {
+            "lines": cls.counter["total"],
+            "elapsed": cls.end_time - cls.start_time,
+            "gatherers": cls._gatherers,
+            "profiler": cls.profiler,
+        }
+        pickle.dump(trailer, shard_file, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def merge_shards(cls, shard_files, profile=False, tmp_dir=None, **kwargs):
+        """ Combine the files written by run_shard for shards 1 to n of one
+            input and yield the output lines. Traces are replayed in shard
+            order, so duplicates across shards are resolved in input order
+            and the output and counter are those of run() over the whole
+            input. The gatherers of the shards are merged before any trace
+            is replayed. """
+        import pickle
+
+        headers = [pickle.load(fh) for fh in shard_files]
+        shards = sorted(zip(headers, shard_files), key=lambda pair: pair[0]["shard"])
+        num_shards = len(shards)
+        if [header["shard"] for (header, _) in shards] != [
+            (k, num_shards) for k in range(1, num_shards + 1)
+        ]:
+            raise ValueError(
+                "Expected shards 1/{0} to {0}/{0} of one input".format(num_shards)
+            )
+        if len({header["input_size"] for (header, _) in shards}) > 1:
+            raise ValueError("Shards were made from inputs of different sizes")
+        cls.start_time = time.time()
+        cls.counter.clear()
+        cls.counter["total"] = 0
+        Deduplifier._num_external_keys = None
+        cls.compile_plan()
+        cls.profiler = Profiler() if profile else None
+        cls._start_gatherers()
+        for (header, _) in shards:
+            if header.get("version") != SHARD_FORMAT_VERSION:
+                raise ValueError("Unsupported shard format")
+            if header["functions"] != cls.function_names():
+                raise ValueError(
+                    "Shard {0}/{1} was made by a different pipeline".format(
+                        *header["shard"]
+                    )
+                )
+        trailers = []
+
+        def records():
+            for (_, fh) in shards:
+                while True:
+                    record = pickle.load(fh)
+                    if isinstance(record, dict):
+                        break
+                    yield record
+                trailers.append(record)
+                for (name, gatherer) in record["gatherers"].items():
+                    cls._gatherers[name].merge(gatherer)
+
+        traced = records()
+        if cls._gatherers:
+            traced = cls._spool_gathered(traced, tmp_dir)
+        for (line, trace) in traced:
+            cls.counter["total"] += 1
+            if cls._replay(trace) and line is not None:
+                yield line
+        elapsed = 0
+        for trailer in trailers:
+            elapsed = max(elapsed, trailer["elapsed"])
+            if cls.profiler is not None and trailer["profiler"] is not None:
+                cls.profiler.merge(trailer["profiler"])
+
+        cls._finish()
+        # The shards are taken to have run side by side
+        cls.start_time -= elapsed
+
+    @classmethod
+    def _iter_traced(cls, lines, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Yield (example or None, trace) for each line, in input order,
+            processing chunks of lines in a pool of jobs worker processes.
+            If lines is a TSVIndex the workers read their chunks from the
+            file, chunks then have about the same number of bytes. """
+        if jobs <= 1:
+            for chunk in iter_chunks(lines, chunk_size):
+                yield from cls.trace_lines(chunk)
+            return
+        # Pool.imap consumes its input eagerly, so we bound the number of
+        # chunks in flight ourselves to keep memory use flat.
+        import multiprocessing
+
+        if isinstance(lines, TSVIndex):
+            num_chunks = -(-len(lines) // chunk_size)
+            tasks = (
+                (_process_range, (lines.path, lines.offset(start), lines.offset(stop)))
+                for (start, stop) in lines.split(num_chunks)
+            )
+        else:
+            tasks = (
+                (_process_chunk, (chunk,)) for chunk in iter_chunks(lines, chunk_size)
+            )
+        # Workers must inherit the compiled plan and everything configured
+        # at class level (filter parameters, schedulers, gatherers, ...),
+        # which only a forked process does. Under spawn they would import
+        # filters afresh and run unconfigured stages.
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("Parallel runs need the fork start method")
+        context = multiprocessing.get_context("fork")
+        pending = collections.deque()
+        with context.Pool(jobs, initializer=_init_worker, initargs=(cls,)) as pool:
+            for (fn, args) in tasks:
+                pending.append(pool.apply_async(fn, args))
+                if len(pending) >= 2 * jobs:
+                    yield from cls._unpack_chunk(pending.popleft().get())
+            while pending:
+                yield from cls._unpack_chunk(pending.popleft().get())
+
+    @classmethod
+    def _unpack_chunk(cls, chunk_result):
+        results, profiler, gatherers = chunk_result
+        if profiler is not None:
+            cls.profiler.merge(profiler)
+        for (name, gatherer) in gatherers.items():
+            cls._gatherers[name].merge(gatherer)
+        return results
+
+    @classmethod
+    def trace_examples(
+        cls, examples, batch_size=DEFAULT_BATCH_SIZE, view_function=None, inverted=False
+    ):
+        """ Process examples with traces, yields (example or None, trace)
+            pairs """
+        for batch in iter_chunks(examples, batch_size):
+            traces = [[] for _ in batch]
+            exs = cls.process_batch(
+                batch, view_function=view_function, inverted=inverted, traces=traces
+            )
+            for ex in exs:
+                if ex is not None:
+                    ex.analysis = None  # not worth pickling
+            yield from zip(exs, traces)
+
+    @classmethod
+    def trace_lines(cls, lines):
+        """ Process lines with traces, returns a list of (example or None,
+            trace) pairs """
+        return list(cls.trace_examples(lines_to_examples(lines)))
 
+    @classmethod
+    def _start_gatherers(cls):
+        """ Create the gatherers of a run. A gatherer decides only once the
+            whole input is gathered, and so do stateful filters in traced
+            runs, so a gatherer cannot follow either: it would gather
+            examples that they reject. """
+        cls._gatherers = {}
+        deferred = None
         for obj in cls._fns:
-            if not isinstance(obj, type):
+            name = obj.__name__
+            if isinstance(obj, type):
+                if deferred is not None:
+                    raise ValueError(
+                        "Gatherer {0} cannot follow {1}".format(name, deferred)
+                    )
+                cls._gatherers[name] = obj()
+            if isinstance(obj, type) or name in cls._deferred:
+                deferred = deferred or name
+
+    @classmethod
+    def _is_gathering(cls):
+        """ Whether the gatherers have yet to see the input, they have not if
+            they were restored from a checkpoint """
+        return any(not gatherer.finalized for gatherer in cls._gatherers.values())
+
+    @classmethod
+    def _finalize_gatherers(cls):
+        for gatherer in cls._gatherers.values():
+            gatherer.finalize()
+            gatherer.finalized = True
+
+    @classmethod
+    def _spool_gathered(cls, traced, tmp_dir=None):
+        """ Write the (example, trace) pairs of traced to a temporary file
+            in tmp_dir while the gatherers see the whole input, then
+            finalize the gatherers and yield the pairs again for replay """
+        spool_path = _spool(traced, tmp_dir)
+        try:
+            cls._finalize_gatherers()
+            yield from _unspool(spool_path)
+        finally:
+            os.remove(spool_path)
+
+    @classmethod
+    def _replay(cls, trace, resolvers=None):
+        """ Apply the counts recorded in a trace. Deferred filters are resolved
+            here (by resolvers[name] if given), returns False if one of them
+            rejects the example. """
+        for item in trace:
+            if isinstance(item, tuple):
+                name, key = item
+                if resolvers and name in resolvers:
+                    is_accepted = resolvers[name]
+                elif name in cls._deferred:
+                    _, is_accepted = cls._deferred[name]
+                else:
+                    is_accepted = cls._gatherers[name].accept
+                if not is_accepted(key):
+                    cls._count(name)
+                    return False
+            elif isinstance(item, Exception):
+                # Raised by a stage after a deferred filter, which accepted
+                raise item
+            else:
+                cls._count(item)
+        return True
+
+    @classmethod
+    def compile_plan(cls):
+        """ Validate _fns and _params and compile them into a flat list of
+            Stages with parameters pre-bound, so that processing does no
+            lookups by name. Called at the start of every run. """
+        names = {obj.__name__ for obj in cls._fns}
+        unknown = sorted(set(cls._params) - names)
+        if unknown:
+            raise ValueError(
+                "Parameters given for functions not in {0}: {1}".format(
+                    cls.__name__, ", ".join(unknown)
+                )
+            )
+        plan = [cls._compile_stage(obj) for obj in cls._fns]
+        RejectPatterns.use(stage.name for stage in plan)
+        cls._plan = cls._fuse_transforms(plan)
+        return cls._plan
+
+    @classmethod
+    def _fuse_transforms(cls, plan):
+        """ Replace runs of two or more text transformations with a fused
+            stage (see FusedRewrite) """
+        fused_plan, run = [], []
+        for stage in plan + [None]:
+            if (
+                stage is not None
+                and stage.kind == Stage.TRANSFORM
+                and stage.name in Transformations._text_transforms
+                and stage.name not in cls._params
+            ):
+                run.append(stage)
+                continue
+            if len(run) > 1:
+                rewrite = FusedRewrite([member.name for member in run])
+                name = "+".join(rewrite.names)
+                fused_plan.append(Stage(name, Stage.FUSED, rewrite, None, None, run))
+            else:
+                fused_plan.extend(run)
+            run = []
+            if stage is not None:
+                fused_plan.append(stage)
+        return fused_plan
+
+    @classmethod
+    def from_config(cls, config):
+        """ Create a pipeline from a config, typically loaded from JSON:
+
+            {
+              "name": "MyPipeline",
+              "stages": [
+                "null_sentence",
+                {"name": "min_word_count", "params": {"min_count": 4}},
+                "MinFrequency"
+              ],
+              "hook": {"function": "min_word_count", "inverted": false}
+            }
+
+            Stages are registered filters and transformations or Gather
+            subclasses, run in the given order. The config is validated and
+            compiled here, errors raise ValueError. """
+        if not isinstance(config, dict):
+            raise ValueError("Pipeline config must be an object")
+        unknown = sorted(set(config) - {"name", "stages", "hook"})
+        if unknown:
+            raise ValueError("Unknown config keys: {0}".format(", ".join(unknown)))
+        stages = config.get("stages")
+        if not isinstance(stages, list) or not stages:
+            raise ValueError("Pipeline config needs a non-empty list of stages")
+        available = dict(Filters._filters)
+        available.update(Transformations._transforms)
+        available.update((sub.__name__, sub) for sub in Gather.__subclasses__())
+        fns, params = [], {}
+        for spec in stages:
+            if isinstance(spec, str):
+                spec = {"name": spec}
+            if not isinstance(spec, dict) or set(spec) - {"name", "params"}:
+                raise ValueError("Invalid stage {0!r}".format(spec))
+            name = spec.get("name")
+            if name not in available:
+                raise ValueError("Unknown filter or transformation {0!r}".format(name))
+            if name in (obj.__name__ for obj in fns):
+                raise ValueError("Stage {0} occurs more than once".format(name))
+            fns.append(available[name])
+            if spec.get("params"):
+                if not isinstance(spec["params"], dict):
+                    raise ValueError("Parameters of {0} must be an object".format(name))
+                params[name] = dict(spec["params"])
+        hook = config.get("hook") or {}
+        if not isinstance(hook, dict) or set(hook) - {"function", "inverted"}:
+            raise ValueError("Invalid hook {0!r}".format(hook))
+        hook_function = hook.get("function")
+        if hook_function is not None and hook_function not in (
+            obj.__name__ for obj in fns
+        ):
+            raise ValueError("Hook {0!r} is not a stage".format(hook_function))
+        pipeline = type(
+            str(config.get("name", "ConfigPipeline")),
+            (cls,),
+            {
+                "counter": dict(),
+                "_fns": fns,
+                "_params": params,
+                "hook": hook_function,
+                "hook_inverted": bool(hook.get("inverted", False)),
+            },
+        )
+        pipeline.compile_plan()
+        return pipeline
+
+    @classmethod
+    def get_plan(cls):
+        plan = cls.__dict__.get("_plan")
+        return plan if plan is not None else cls.compile_plan()
+
+    @classmethod
+    def _compile_stage(cls, obj):
+        name = obj.__name__
+        params = cls._params.get(name, {})
+        if isinstance(obj, type):
+            if params:
+                raise ValueError("Gatherer {0} takes no parameters".format(name))
+            # The gatherer of the current run returns the key
+            return Stage(
+                name,
+                Stage.GATHER,
+                None,
+                None,
+                lambda ex: cls._gatherers[name].gather(ex),
+            )
+        if name in Transformations._transforms:
+            kind = Stage.TRANSFORM
+            scalar = Transformations._transforms[name]
+            batch = Transformations.get_batch(name)
+        elif name in Filters._filters:
+            kind = Stage.FILTER
+            scalar = Filters._filters[name]
+            batch = Filters.get_batch(name)
+        else:
+            raise ValueError("Unknown filter or transformation {0}".format(name))
+        make_key = cls._deferred[name][0] if name in cls._deferred else None
+        if params:
+            if make_key is not None:
+                raise ValueError("Stateful filter {0} takes no parameters".format(name))
+            check_params(scalar, params)
+            scalar = functools.partial(scalar, **params)
+            if kind == Stage.TRANSFORM:
+                batch = lambda exs: [scalar(ex) for ex in exs]
+            else:
+                batch = lambda exs: [bool(scalar(ex)) for ex in exs]
+        return Stage(name, kind, batch, scalar, make_key)
+
+    @classmethod
+    def _is_reorderable(cls, stage):
+        return stage.kind == Stage.FILTER and stage.make_key is None
+
+    @classmethod
+    def init_schedulers(cls, adaptive, attribution="canonical"):
+        """ Create a FilterScheduler for each block of two or more consecutive
+            stateless filters, transformations and stateful filters stay
+            where they are. """
+        cls._schedulers = None
+        if not adaptive:
+            return
+        cls._schedulers = {}
+        block = []
+        for (pos, stage) in enumerate(cls.get_plan() + [None]):
+            if stage is not None and cls._is_reorderable(stage):
+                block.append(stage)
                 continue
-            obj.save_to_file()
+            if len(block) > 1:
+                start = pos - len(block)
+                cls._schedulers[start] = FilterScheduler(block, attribution)
+            block = []
+
+    @classmethod
+    def _finish(cls):
         cls.end_time = time.time()
 
     @classmethod
-    def process(cls, ex, view_function=None, inverted=False):
-        for obj in cls._fns:
-            fn = obj.gather if isinstance(obj, type) else obj
-            name = obj.__name__ if isinstance(obj, type) else fn.__name__
+    def _count(cls, name, trace=None):
+        if trace is not None:
+            trace.append(name)
+        else:
+            cls.counter[name] = cls.counter.get(name, 0) + 1
+
+    @classmethod
+    def process(cls, ex, view_function=None, inverted=False, trace=None):
+        """ Run a single example through the pipeline, see process_batch. """
+        traces = None if trace is None else [trace]
+        return cls.process_batch(
+            [ex], view_function=view_function, inverted=inverted, traces=traces
+        )[0]
+
+    @classmethod
+    def process_batch(cls, batch, view_function=None, inverted=False, traces=None):
+        """ Run a list of examples through the pipeline, one function at a time.
+            Returns a list of the same length where rejected examples are None.
+            If traces is a list of lists (one per example) the counts are
+            appended to them instead of cls.counter and deferred filters
+            record their key instead of being evaluated. The stages after a
+            deferred filter or gatherer then see examples that it may reject
+            later, an exception raised for one of them ends its trace and is
+            raised by Pipeline._replay only if the example gets that far. """
+        idxs = list(range(len(batch)))
+        exs = list(batch)
+        # Hooks display examples as they reach a function, keep the order fixed
+        schedulers = cls._schedulers if view_function is None else None
+        profiler = cls.profiler
+        plan = cls.get_plan()
+
+        def count(name, idx):
+            cls._count(name, None if traces is None else traces[idx])
+
+        def transform(stage, idxs, exs):
+            name = stage.name
             display = view_function == name
-            if name in Transformations._transforms:
-                old = dict(ex)
-                ex = obj(ex)
-                if ex != old:
+            new_exs = list(stage.fn(exs))
+            for i, (idx, old, ex) in enumerate(zip(idxs, exs, new_exs)):
+                if not isinstance(ex, Example):
+                    # A transformation still returning a dict
+                    ex = new_exs[i] = with_text(old, ex["is"], ex["en"])
+                if ex is old:
+                    continue
+                if same_text(ex, old):
+                    # keep the original so that its Analysis survives
+                    new_exs[i] = old
+                else:
                     out_ex = old if inverted else ex
                     if display:
                         print_ex(out_ex)
-                    cls.counter[name] = cls.counter.get(name, 0) + 1
+                    count(name, idx)
+            return new_exs
+
+        def rewrite(stage, idxs, exs):
+            new_exs = []
+            for idx, (ex, fired) in zip(idxs, list(stage.fn(exs, profiler))):
+                for name in fired:
+                    count(name, idx)
+                new_exs.append(ex)
+            return new_exs
+
+        def step(pos, idxs, exs):
+            """ Apply the stage (or scheduler block) at pos, returns the
+                position of the next one and the surviving idxs and exs """
+            if schedulers and pos in schedulers:
+                scheduler = schedulers[pos]
+                idxs, exs = scheduler.run_block(idxs, exs, count, profiler)
+                return pos + len(scheduler.names), idxs, exs
+            stage = plan[pos]
+            pos += 1
+            name = stage.name
+            display = view_function == name
+            if profiler is not None:
+                start = time.perf_counter()
+            if stage.kind == Stage.FUSED:
+                if view_function in (member.name for member in stage.members):
+                    # Hooks show the output of a single transformation
+                    for member in stage.members:
+                        exs = transform(member, idxs, exs)
+                else:
+                    exs = rewrite(stage, idxs, exs)
+                if profiler is not None:
+                    profiler.record(name, time.perf_counter() - start, len(exs))
+            elif stage.kind == Stage.TRANSFORM:
+                new_exs = transform(stage, idxs, exs)
+                if profiler is not None:
+                    profiler.record(name, time.perf_counter() - start, len(exs))
+                exs = new_exs
+            elif traces is not None and stage.make_key is not None:
+                make_key = stage.make_key
+                for idx, ex in zip(idxs, exs):
+                    traces[idx].append((name, make_key(ex)))
+                if profiler is not None:
+                    profiler.record(name, time.perf_counter() - start, len(exs))
+            elif stage.kind == Stage.GATHER:
+                raise ValueError("Gatherer {0} needs traces".format(name))
             else:
-                if display and inverted:
-                    print_ex(ex)
-                if not fn(ex):
-                    cls.counter[name] = cls.counter.get(name, 0) + 1
+                mask = stage.fn(exs)
+                if profiler is not None:
+                    profiler.record(name, time.perf_counter() - start, len(exs))
+                kept_idxs, kept_exs = [], []
+                for idx, ex, keep in zip(idxs, exs, mask):
+                    if display and inverted:
+                        print_ex(ex)
+                    if keep:
+                        kept_idxs.append(idx)
+                        kept_exs.append(ex)
+                        continue
+                    count(name, idx)
                     if display and not inverted:
                         print_ex(ex)
-                    return None
-
-        return ex
+                idxs, exs = kept_idxs, kept_exs
+            return pos, idxs, exs
+
+        def step_each(pos, idxs, exs):
+            """ step() one example at a time, recording the exception of an
+                example that raises in its trace """
+            next_pos, kept_idxs, kept_exs = len(plan), [], []
+            for idx, ex in zip(idxs, exs):
+                trace_len = len(traces[idx])
+                try:
+                    next_pos, one_idx, one_ex = step(pos, [idx], [ex])
+                except Exception as error:
+                    del traces[idx][trace_len:]
+                    traces[idx].append(error)
+                    continue
+                kept_idxs.extend(one_idx)
+                kept_exs.extend(one_ex)
+            return next_pos, kept_idxs, kept_exs
+
+        pos = 0
+        is_deferred = False  # whether a stage has recorded keys to resolve later
+        while pos < len(plan) and exs:
+            if not is_deferred:
+                is_deferred = traces is not None and plan[pos].make_key is not None
+                pos, idxs, exs = step(pos, idxs, exs)
+                continue
+            trace_lens = [len(traces[idx]) for idx in idxs]
+            try:
+                pos, idxs, exs = step(pos, idxs, exs)
+            except Exception:
+                # Undo the counts of the batch and find the example(s)
+                for idx, trace_len in zip(idxs, trace_lens):
+                    del traces[idx][trace_len:]
+                pos, idxs, exs = step_each(pos, idxs, exs)
+
+        results = [None] * len(batch)
+        for idx, ex in zip(idxs, exs):
+            results[idx] = ex
+        return results
 
     @classmethod
     def summarize_counter(cls, indent=4, file=sys.stdout):
@@ -807,8 +2611,51 @@ class Pipeline:
                 count=count,
                 pct=100 * count / (total or 1),
             )
-            msg = filter_msg if name in Filters._filters else transform_msg
+            # Gatherers reject examples, like filters
+            msg = transform_msg if name in Transformations._transforms else filter_msg
             print(msg)
+        if deduplicate in cls._fns:
+            print("-" * 80)
+            print(
+                "{indent}Deduplication: {desc}".format(
+                    indent=" " * indent, desc=Deduplifier.describe()
+                )
+            )
+        if cls.profiler is not None:
+            cls.profiler.summarize(cls.profile_names(), indent=indent)
+
+    @classmethod
+    def function_names(cls):
+        return [stage.name for stage in cls.get_plan()]
+
+    @classmethod
+    def hook_names(cls):
+        """ Names of the functions that can be hooked: the stages of the
+            compiled plan, with the members of fused stages in their place """
+        cls.compile_plan()
+        names = []
+        for stage in cls.get_plan():
+            if stage.kind == Stage.FUSED:
+                names.extend(member.name for member in stage.members)
+            else:
+                names.append(stage.name)
+        return names
+
+    @classmethod
+    def profile_names(cls):
+        """ function_names with the members of each fused stage after it """
+        names = []
+        for stage in cls.get_plan():
+            names.append(stage.name)
+            names.extend(member.name for member in stage.members or ())
+        return names
+
+    @classmethod
+    def write_profile(cls, prefix):
+        """ Write per-function timings to prefix.json and prefix.prom """
+        names = cls.profile_names()
+        cls.profiler.write_json(prefix + ".json", names)
+        cls.profiler.write_prometheus(prefix + ".prom", cls.__name__, names)
 
 
 class MinimalPipeline(Pipeline):
@@ -847,6 +2694,203 @@ class MinimalPipeline(Pipeline):
     end_time = None
 
 
+class OffsetReader:
+    """ Iterate over the lines of a binary file object, remembering the byte
+        offset after every stride-th line until it is asked for by
+        offset_after. A pipeline with gatherers reads the whole input before
+        the first checkpoint, so offsets are kept once per batch rather than
+        for every line. """
+
+    def __init__(self, fh, offset=0, line_count=0, stride=1):
+        self._fh = fh
+        self._fh.seek(offset)
+        self.stride = stride
+        self._offsets = collections.deque()  # (line count, offset) pairs
+        self._line_count = line_count  # lines read so far
+        self._offset = offset
+
+    def __iter__(self):
+        for raw in iter_lines(self._fh):
+            self._offset += len(raw)
+            self._line_count += 1
+            if self._line_count % self.stride == 0:
+                self._offsets.append((self._line_count, self._offset))
+            yield decode_line(raw)
+
+    def offset_after(self, line_count):
+        """ Offset of the end of line number line_count, or None if it was
+            not kept. Earlier offsets are forgotten. """
+        while self._offsets and self._offsets[0][0] <= line_count:
+            count, offset = self._offsets.popleft()
+            if count == line_count:
+                return offset
+        if line_count == self._line_count:
+            return self._offset
+        return None
+
+
+class Checkpoint:
+    """ Periodically save the progress of a pipeline run so that it can be
+        resumed after a crash: input and output offsets, counters and the
+        state of stateful filters. Called by the pipeline
+        whenever all examples read so far have been written out.
+
+        The keys of deduplicate are appended to a journal (path + ".keys")
+        as they are added, so that each checkpoint writes only the keys
+        since the previous one. The LSH index of near_duplicate is saved
+        whole by every checkpoint, which makes the total written grow with
+        the square of the run length; keep checkpoint_every large with it.
+
+        Pipelines with gatherers only write output once the gatherers have
+        seen the whole input and are finalized. They no longer change after
+        that and are saved once (path + ".gatherers"), a resumed run
+        restores them instead of gathering again. """
+
+    VERSION = 3
+    KEYS_SUFFIX = ".keys"
+    GATHERERS_SUFFIX = ".gatherers"
+    # Class attributes holding the state of stateful filters
+    _STATEFUL = [
+        (Deduplifier, ("_num_external_keys",)),
+        (NearDeduplifier, ("threshold", "num_perm", "shingle_size", "_index")),
+    ]
+
+    def __init__(self, path, out_file, every=DEFAULT_CHECKPOINT_EVERY):
+        self.path = path
+        self.out_file = out_file
+        self.every = every
+        self.reader = None
+        self.state = None
+        self._last_saved = 0
+        self._saved_gatherers = False
+
+    def lines(self, in_file):
+        """ Lines of in_file, starting where the loaded checkpoint left off """
+        offset, line_count = 0, 0
+        if self.state is not None:
+            offset, line_count = self.state["in_offset"], self.state["lines"]
+        self.reader = OffsetReader(in_file.buffer, offset, line_count)
+        return self.reader
+
+    def load(self):
+        import pickle
+
+        with open(self.path, "rb") as fh:
+            self.state = pickle.load(fh)
+        if self.state.get("version") != self.VERSION:
+            raise ValueError("Unsupported checkpoint {0}".format(self.path))
+        self.out_file.seek(self.state["out_offset"])
+        self.out_file.truncate()
+        return self.state
+
+    def _keys_path(self):
+        return self.path + self.KEYS_SUFFIX
+
+    def restore(self, pipeline, stride=1):
+        """ Restore counters and filter state at the start of a resumed run,
+            or start a new key journal. The pipeline calls the checkpoint
+            every stride lines. """
+        if self.reader is not None:
+            self.reader.stride = stride
+        Deduplifier._added = []
+        if self.state is None:
+            open(self._keys_path(), "wb").close()
+            return
+        pipeline.counter.clear()
+        pipeline.counter.update(self.state["counter"])
+        pipeline.start_time = time.time() - self.state["elapsed"]
+        self._last_saved = self.state["lines"]
+        for (owner, attrs) in self._STATEFUL:
+            for attr in attrs:
+                key = owner.__name__ + "." + attr
+                if key in self.state["filters"]:
+                    setattr(owner, attr, self.state["filters"][key])
+        self._restore_keys()
+        if self.state["gatherers"]:
+            import pickle
+
+            with open(self.path + self.GATHERERS_SUFFIX, "rb") as fh:
+                pipeline._gatherers = pickle.load(fh)
+            self._saved_gatherers = True
+
+    def _restore_keys(self):
+        import pickle
+
+        keys_offset = self.state["keys_offset"]
+        with open(self._keys_path(), "r+b") as fh:
+            while fh.tell() < keys_offset:
+                for key in pickle.load(fh):
+                    Deduplifier._set.add(key)
+            # Keys journaled after the checkpoint are added again
+            fh.truncate(keys_offset)
+
+    def _append_keys(self):
+        """ Journal the keys added since the last checkpoint, returns the
+            size of the journal """
+        import pickle
+
+        with open(self._keys_path(), "ab") as fh:
+            pickle.dump(Deduplifier._added, fh, pickle.HIGHEST_PROTOCOL)
+            fh.flush()
+            os.fsync(fh.fileno())
+            return fh.tell()
+
+    def _save_gatherers(self, pipeline):
+        import pickle
+
+        tmp_path = self.path + self.GATHERERS_SUFFIX + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            pickle.dump(pipeline._gatherers, fh, pickle.HIGHEST_PROTOCOL)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.path + self.GATHERERS_SUFFIX)
+        self._saved_gatherers = True
+
+    def __call__(self, pipeline):
+        num_lines = pipeline.counter["total"]
+        in_offset = self.reader.offset_after(num_lines)
+        if in_offset is not None and num_lines - self._last_saved >= self.every:
+            self.save(pipeline, in_offset)
+
+    def save(self, pipeline, in_offset=None):
+        num_lines = pipeline.counter["total"]
+        if in_offset is None:
+            in_offset = self.reader.offset_after(num_lines)
+        self.out_file.flush()
+        if pipeline._gatherers and not self._saved_gatherers:
+            self._save_gatherers(pipeline)
+        state = {
+            "version": self.VERSION,
+            "pipeline": pipeline.__name__,
+            "lines": num_lines,
+            "in_offset": in_offset,
+            "out_offset": self.out_file.tell(),
+            "keys_offset": self._append_keys(),
+            "gatherers": bool(pipeline._gatherers),
+            "counter": dict(pipeline.counter),
+            "elapsed": time.time() - pipeline.start_time,
+            "filters": {
+                owner.__name__ + "." + attr: getattr(owner, attr)
+                for (owner, attrs) in self._STATEFUL
+                for attr in attrs
+            },
+        }
+        import pickle
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            pickle.dump(state, fh, pickle.HIGHEST_PROTOCOL)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.path)
+        Deduplifier._added = []
+        self._last_saved = num_lines
+
+    def close(self):
+        """ Stop journaling the keys of deduplicate """
+        Deduplifier._added = None
+
+
 def do_pipeline(
     in_file=None,
     out_file=sys.stdout,
@@ -854,23 +2898,196 @@ def do_pipeline(
     summary=False,
     view_function=None,
     inverted=False,
+    jobs=1,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    adaptive=False,
+    attribution="canonical",
+    profile=False,
+    profile_out=None,
+    dedup_backend="set",
+    dedup_capacity=1 << 16,
+    tmp_dir=None,
+    near_dup_threshold=0.8,
+    min_freq_sketch_width=None,
+    checkpoint_path=None,
+    checkpoint_every=DEFAULT_CHECKPOINT_EVERY,
+    resume=False,
+    pipeline=None,
+    shard=None,
+    merge=None,
     **kwargs
 ):
-    examples = lines_to_examples(in_file)
-    pipeline = MinimalPipeline
-    for ex in pipeline.run(examples, view_function=view_function, inverted=inverted):
+    pipeline = pipeline or MinimalPipeline
+    NearDeduplifier.configure(threshold=near_dup_threshold)
+    MinFrequency.configure(sketch_width=min_freq_sketch_width)
+    profile = profile or profile_out is not None
+    if dedup_backend != "external":
+        Deduplifier.use_backend(dedup_backend, capacity=dedup_capacity)
+    if shard is not None:
+        # out_file is a binary shard file for merge_shards
+        input_size = os.fstat(in_file.buffer.fileno()).st_size
+        start, end = shard_range(input_size, *shard)
+        lines = iter_range_lines(in_file.buffer, start, end)
+        pipeline.run_shard(
+            map(decode_line, lines),
+            out_file,
+            shard,
+            input_size,
+            jobs=jobs,
+            chunk_size=chunk_size,
+            adaptive=adaptive,
+            attribution=attribution,
+            profile=profile,
+        )
+        if profile_out is not None:
+            pipeline.write_profile(profile_out)
+        return
+    # Output lines are written in batches, the checkpoint flushes the batch
+    # before it saves the output offset
+    writer = LineWriter(out_file)
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = Checkpoint(checkpoint_path, writer, every=checkpoint_every)
+        if resume:
+            checkpoint.load()
+        in_file = checkpoint.lines(in_file)
+    index = None
+    if jobs > 1 and checkpoint is None and can_index(getattr(in_file, "name", None)):
+        # The workers read their chunks of the input, only byte ranges are
+        # sent to them
+        in_file = index = TSVIndex(in_file.name)
+    if merge is not None:
+        lines = pipeline.merge_shards(merge, profile=profile, tmp_dir=tmp_dir)
+    elif dedup_backend == "external":
+        results = pipeline.run_external(
+            in_file,
+            jobs=jobs,
+            chunk_size=chunk_size,
+            tmp_dir=tmp_dir,
+            adaptive=adaptive,
+            attribution=attribution,
+            profile=profile,
+        )
+    elif jobs > 1:
+        results = pipeline.run_parallel(
+            in_file,
+            jobs,
+            chunk_size=chunk_size,
+            adaptive=adaptive,
+            attribution=attribution,
+            profile=profile,
+            checkpoint=checkpoint,
+            tmp_dir=tmp_dir,
+        )
+    else:
+        examples = lines_to_examples(in_file)
+        results = pipeline.run(
+            examples,
+            view_function=view_function,
+            inverted=inverted,
+            adaptive=adaptive,
+            attribution=attribution,
+            profile=profile,
+            checkpoint=checkpoint,
+            tmp_dir=tmp_dir,
+        )
+    if merge is None:
+        lines = map(example_to_line, results)
+    for line in lines:
         if not quiet and view_function is None:
-            print("\t".join([ex["en"], ex["is"]]), file=out_file)
+            writer.write_line(line)
+    writer.flush()
+    if checkpoint is not None:
+        checkpoint.close()
+    if index is not None:
+        index.close()
     if summary:
         pipeline.summarize_counter()
+    if profile_out is not None:
+        pipeline.write_profile(profile_out)
 
 
 def lines_to_examples(lines):
     for line in lines:
         line = line.strip("\n")
-        src, tgt = line.split("\t")[:2]
-        ex = {"en": src, "is": tgt}
-        yield ex
+        fields = line.split("\t")
+        # The line is written out as is unless a transformation changes it
+        yield Example(fields[0], fields[1], line=line if len(fields) == 2 else None)
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _spool(items, tmp_dir=None):
+    """ Pickle the items to a temporary file in tmp_dir, returns its path """
+    import pickle
+    import tempfile
+
+    fd, path = tempfile.mkstemp(suffix=".spool", dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            for item in items:
+                pickle.dump(item, spool, pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _unspool(path):
+    """ The items of a file written by _spool """
+    import pickle
+
+    with open(path, "rb") as spool:
+        while True:
+            try:
+                yield pickle.load(spool)
+            except EOFError:
+                return
+
+
+_WORKER_PIPELINE = None
+
+
+def _init_worker(pipeline):
+    # The worker is forked, see Pipeline._iter_traced, so pipeline and its
+    # state are inherited rather than pickled. This only records which
+    # pipeline the tasks run.
+    global _WORKER_PIPELINE
+    _WORKER_PIPELINE = pipeline
+
+
+def _process_chunk(lines):
+    """ Worker side of Pipeline.run_parallel """
+    pipeline = _WORKER_PIPELINE
+    if pipeline.profiler is not None:
+        # Each chunk reports only its own timings
+        pipeline.profiler = Profiler()
+    # and what it gathered, if the gatherers were not restored finalized
+    gathered = {}
+    if pipeline._is_gathering():
+        gathered = pipeline._gatherers = {
+            name: gatherer.partial() for (name, gatherer) in pipeline._gatherers.items()
+        }
+    return pipeline.trace_lines(lines), pipeline.profiler, gathered
+
+
+def _process_range(path, start, end):
+    """ Worker side of Pipeline.run_parallel for bytes start to end of the
+        file at path, which start and end with whole lines """
+    import io
+
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    # Lines as they are read from a text file
+    return _process_chunk(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8"))
 
 
 class TransformationPipeline(Pipeline):
@@ -885,8 +3102,15 @@ class TransformationPipeline(Pipeline):
 
 
 def do_fns(
-    in_file=None, transforms=[], filters=[], quiet=False, use_pipeline=False, **kwargs
+    in_file=None,
+    out_file=None,
+    transforms=[],
+    filters=[],
+    quiet=False,
+    use_pipeline=False,
+    **kwargs
 ):
+    writer = LineWriter(out_file or sys.stdout)
     for ex in lines_to_examples(in_file):
         for transform in transforms:
             ex = Transformations.apply(transform, ex)
@@ -897,15 +3121,33 @@ def do_fns(
                 filter_name = filter_name.strip("_inv")
             if Filters.apply(filter_name, ex, inverted=inverted):
                 if not quiet:
-                    print("\t".join([ex["en"], ex["is"]]))
+                    writer.write_line("\t".join([ex.source, ex.target]))
+    writer.flush()
 
 
 def valid_view_function(string):
+    """ A registered filter or transformation, whether it is a stage of the
+        selected pipeline is checked once the arguments are parsed """
     import argparse
 
-    if string in [fn.__name__ for fn in Pipeline._fns]:
+    if string in Filters._filters or string in Transformations._transforms:
         return string
-    raise argparse.ArgumentError("Invalid filter/transformation name")
+    raise argparse.ArgumentTypeError(
+        "{0!r} is not a filter or transformation".format(string)
+    )
+
+
+def shard_spec(string):
+    """ Parse K/N, shard number K (from 1) of N """
+    import argparse
+
+    try:
+        shard, num_shards = (int(part) for part in string.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected K/N, e.g. 2/8")
+    if not 1 <= shard <= num_shards:
+        raise argparse.ArgumentTypeError("K must be between 1 and N")
+    return (shard, num_shards)
 
 
 if __name__ == "__main__":
@@ -925,10 +3167,13 @@ if __name__ == "__main__":
         "-i",
         "--in_file",
         dest="in_file",
-        type=argparse.FileType("r"),
-        default=sys.stdin,
+        type=str,
+        default=None,
         required=0,
-        help="Sample file to run filter through, defaults to stdin",
+        help=(
+            "Sample file to run filter through, defaults to stdin. May be "
+            "compressed with gzip, xz, bzip2 or zstd."
+        ),
     )
     parser.add_argument(
         "-f",
@@ -992,16 +3237,261 @@ if __name__ == "__main__":
         "-o",
         "--out_file",
         dest="out_file",
-        type=argparse.FileType("w"),
+        type=str,
         required=False,
-        default=sys.stdout,
-        help="File where pipline output will be written",
+        default=None,
+        help=(
+            "File where pipline output will be written, defaults to stdout. "
+            "Compressed if the name ends with .gz, .xz, .bz2 or .zst."
+        ),
     )
 
-    # TODO: define pipeline via config file
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        required=False,
+        default=1,
+        help=(
+            "Number of worker processes used by the pipeline. They are forked, "
+            "which Windows does not support."
+        ),
+    )
+    parser.add_argument(
+        "--chunk_size",
+        dest="chunk_size",
+        type=int,
+        required=False,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of lines sent to a worker process at a time (with --jobs).",
+    )
+    parser.add_argument(
+        "--adaptive",
+        dest="adaptive",
+        action="store_true",
+        required=False,
+        default=False,
+        help=(
+            "Reorder consecutive filters by measured cost and rejection rate. "
+            "The output is unchanged."
+        ),
+    )
+    parser.add_argument(
+        "--attribution",
+        dest="attribution",
+        choices=FilterScheduler.ATTRIBUTION_MODES,
+        required=False,
+        default="canonical",
+        help=(
+            "Which filter an example is counted against when reordered (with "
+            "--adaptive): the first in pipeline order (canonical) or the first "
+            "one evaluated (first)."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Measure time spent in each function and add it to the summary.",
+    )
+    parser.add_argument(
+        "--profile_out",
+        dest="profile_out",
+        type=str,
+        required=False,
+        default=None,
+        help=(
+            "Write per-function timings to PROFILE_OUT.json and "
+            "PROFILE_OUT.prom (Prometheus text format). Implies --profile."
+        ),
+    )
+    parser.add_argument(
+        "--dedup_backend",
+        dest="dedup_backend",
+        choices=Deduplifier.BACKENDS + ("external",),
+        required=False,
+        default="set",
+        help=(
+            "How deduplicate stores seen sentence pairs: full keys (set), "
+            "64/128 bit hashes of them (much smaller, small collision risk) "
+            "or sorted runs of hashes on disk (external, see --tmp_dir)."
+        ),
+    )
+    parser.add_argument(
+        "--tmp_dir",
+        dest="tmp_dir",
+        type=str,
+        required=False,
+        default=None,
+        help=(
+            "Directory for temporary files of external deduplication and of "
+            "pipelines with gatherers."
+        ),
+    )
+    parser.add_argument(
+        "--dedup_capacity",
+        dest="dedup_capacity",
+        type=int,
+        required=False,
+        default=1 << 16,
+        help="Expected number of unique pairs, presizes the hashed key store.",
+    )
+    parser.add_argument(
+        "--near_dup_threshold",
+        dest="near_dup_threshold",
+        type=float,
+        required=False,
+        default=0.8,
+        help="Estimated Jaccard similarity at which near_duplicate rejects a pair.",
+    )
+    parser.add_argument(
+        "--min_freq_sketch_width",
+        dest="min_freq_sketch_width",
+        type=int,
+        required=False,
+        default=None,
+        help=(
+            "Let MinFrequency count words approximately in a count-min sketch "
+            "with this many counters per row (4 rows of 8 bytes each), to "
+            "bound its memory. Counts are exact by default."
+        ),
+    )
+    parser.add_argument(
+        "--config",
+        dest="config",
+        type=argparse.FileType("r"),
+        required=False,
+        default=None,
+        help=(
+            "JSON file defining the pipeline's stages, their parameters and "
+            "hook, see Pipeline.from_config. Defaults to MinimalPipeline."
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint_path",
+        type=str,
+        required=False,
+        default=None,
+        help=(
+            "Periodically save progress to this file so that the run can be "
+            "continued with --resume. Requires --in_file and --out_file."
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        dest="checkpoint_every",
+        type=int,
+        required=False,
+        default=DEFAULT_CHECKPOINT_EVERY,
+        help="Number of input lines between checkpoints.",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Continue a run from the file given with --checkpoint.",
+    )
+    parser.add_argument(
+        "--shard",
+        dest="shard",
+        type=shard_spec,
+        required=False,
+        default=None,
+        help=(
+            "Process only the lines that start in byte range K of N of "
+            "--in_file (K from 1, as in split -n l/K/N) and write a shard "
+            "file to --out_file, for --merge."
+        ),
+    )
+    parser.add_argument(
+        "--merge",
+        dest="merge",
+        type=str,
+        required=False,
+        default=None,
+        nargs="+",
+        help=(
+            "Combine the shard files written with --shard into the output of "
+            "a single run over the whole input, with one summary (-s)."
+        ),
+    )
 
     args = parser.parse_args()
-    if args.filters or args.transforms:
-        do_fns(**vars(args))
+    args.pipeline = None
+    if args.config is not None:
+        import json
+
+        try:
+            args.pipeline = Pipeline.from_config(json.load(args.config))
+        except ValueError as exc:
+            parser.error("{0}: {1}".format(args.config.name, exc))
+        if args.view_function is None:
+            args.view_function = args.pipeline.hook
+            args.inverted = args.inverted or args.pipeline.hook_inverted
+    if args.view_function is not None and not (args.filters or args.transforms):
+        pipeline = args.pipeline or MinimalPipeline
+        if args.view_function not in pipeline.hook_names():
+            parser.error(
+                "--hook {0} is not a stage of {1}".format(
+                    args.view_function, pipeline.__name__
+                )
+            )
+    if args.jobs < 1:
+        parser.error("--jobs must be a positive integer")
+    if args.jobs > 1 and args.view_function is not None:
+        parser.error("--hook cannot be combined with --jobs")
+    if args.resume and args.checkpoint_path is None:
+        parser.error("--resume requires --checkpoint")
+    if args.checkpoint_path is not None:
+        if args.out_file is None or args.in_file is None:
+            parser.error("--checkpoint requires --in_file and --out_file")
+        if compression_of_path(args.out_file):
+            parser.error("--checkpoint requires an uncompressed --out_file")
+        if args.dedup_backend == "external":
+            parser.error("--checkpoint cannot be combined with external dedup")
+    if args.shard is not None or args.merge is not None:
+        option = "--shard" if args.shard is not None else "--merge"
+        if args.shard is not None and args.merge is not None:
+            parser.error("--shard cannot be combined with --merge")
+        if args.checkpoint_path is not None or args.dedup_backend == "external":
+            parser.error(
+                option + " cannot be combined with --checkpoint or external dedup"
+            )
+        if args.filters or args.transforms or args.view_function is not None:
+            parser.error(option + " cannot be combined with -f, -t or --hook")
+    if args.shard is not None:
+        if args.in_file is None or args.out_file is None:
+            parser.error("--shard requires --in_file and --out_file")
+        if args.summary:
+            parser.error("The summary of a sharded run is printed by --merge")
+    if args.merge is not None:
+        # Shards are read instead of the input
+        args.in_file = None
+        args.merge = [open_input(path, encoding=None) for path in args.merge]
     else:
-        do_pipeline(**vars(args))
+        args.in_file = open_input(args.in_file)
+    seekable = args.in_file is None or args.in_file.buffer.seekable()
+    if not seekable and (args.checkpoint_path or args.shard):
+        args.in_file.close()
+        parser.error("--checkpoint and --shard require an uncompressed --in_file")
+    args.out_file = open_output(
+        args.out_file,
+        "r+" if args.resume else "w",
+        encoding=None if args.shard else "utf-8",
+    )
+    try:
+        if args.filters or args.transforms:
+            do_fns(**vars(args))
+        else:
+            do_pipeline(**vars(args))
+    finally:
+        # Compressed output is only complete once closed
+        for fh in [args.in_file, args.out_file] + (args.merge or []):
+            if fh not in (None, sys.stdin, sys.stdout):
+                fh.close()
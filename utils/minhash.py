@@ -0,0 +1,158 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     MinHash near-duplicate index
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     MinHash signatures of character shingles and an LSH banding index for
+     finding near duplicates in a stream of texts.
+
+     Signatures use one permutation hashing with rotation densification
+     (Li et al. 2012, Shrivastava & Li 2014): every shingle is hashed once
+     and the hash decides both the bin it goes to and its value, so the cost
+     is linear in the length of the text rather than in length times the
+     number of hash functions. Shingle hashes are CRC32 so signatures are
+     the same in every process and every run.
+
+"""
+
+import array
+import zlib
+
+_HASH_BITS = 32
+_EMPTY = 1 << _HASH_BITS
+_ROTATION_OFFSET = 1 << _HASH_BITS  # separates borrowed from own bin values
+
+
+def choose_bands(num_perm, threshold):
+    """ Split num_perm rows into bands such that the LSH candidate threshold,
+        approximately (1 / bands) ** (1 / rows), is closest to threshold """
+    best = None
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def minhash_signature(text, num_perm, shingle_size):
+    """ MinHash signature (tuple of num_perm ints) of the set of
+        shingle_size-byte shingles of text """
+    data = text.encode("utf-8")
+    if len(data) < shingle_size:
+        shingles = [data]
+    else:
+        shingles = [
+            data[i : i + shingle_size]
+            for i in range(len(data) - shingle_size + 1)
+        ]
+    bins = [_EMPTY] * num_perm
+    for hashed in map(zlib.crc32, shingles):
+        # Low bits pick the bin, the full hash is the value within the bin
+        b = hashed % num_perm
+        if hashed < bins[b]:
+            bins[b] = hashed
+    if _EMPTY in bins:
+        # Rotation densification, an empty bin borrows the value of the
+        # next non-empty bin to its right (there is at least one)
+        filled = list(bins)
+        for b in range(num_perm):
+            if bins[b] != _EMPTY:
+                continue
+            distance = 1
+            while bins[(b + distance) % num_perm] == _EMPTY:
+                distance += 1
+            filled[b] = bins[(b + distance) % num_perm] + distance * _ROTATION_OFFSET
+        bins = filled
+    return tuple(bins)
+
+
+def estimate_jaccard(sig1, sig2):
+    return sum(a == b for (a, b) in zip(sig1, sig2)) / len(sig1)
+
+
+class MinHashLSH:
+    """ LSH banding index over MinHash signatures. Each added signature is
+        stored once (num_perm 8-byte ints, densified values need more than
+        32 bits) and registered in one bucket per band. A bucket keeps up to
+        max_bucket signatures, a bucket of one is a plain index, so memory
+        and query time per example are bounded by bands * max_bucket. Only
+        when a band key is shared by more than max_bucket dissimilar earlier
+        signatures can a near duplicate that matches none of them in other
+        bands be missed. """
+
+    max_bucket = 16
+
+    def __init__(self, threshold=0.8, num_perm=32):
+        if not 0 < threshold <= 1:
+            raise ValueError("Jaccard threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self._buckets = [dict() for _ in range(self.bands)]
+        self._signatures = array.array("Q")
+        self._len = 0
+
+    def _band_keys(self, sig):
+        rows = self.rows
+        # hash() of a tuple of ints does not depend on PYTHONHASHSEED
+        return [hash(sig[i * rows : (i + 1) * rows]) for i in range(self.bands)]
+
+    def _signature(self, idx):
+        return self._signatures[idx * self.num_perm : (idx + 1) * self.num_perm]
+
+    def query(self, sig):
+        """ True if a near duplicate of sig is in the index """
+        return self._query(sig, self._band_keys(sig))
+
+    def _query(self, sig, keys):
+        checked = set()
+        for (buckets, key) in zip(self._buckets, keys):
+            entry = buckets.get(key)
+            if entry is None:
+                continue
+            for idx in entry if isinstance(entry, list) else (entry,):
+                if idx in checked:
+                    continue
+                checked.add(idx)
+                if estimate_jaccard(sig, self._signature(idx)) >= self.threshold:
+                    return True
+        return False
+
+    def insert_if_unique(self, sig):
+        """ Add sig unless it has a near duplicate, returns whether it was
+            added """
+        keys = self._band_keys(sig)
+        if self._query(sig, keys):
+            return False
+        idx = self._len
+        self._signatures.extend(sig)
+        self._len += 1
+        for (buckets, key) in zip(self._buckets, keys):
+            entry = buckets.get(key)
+            if entry is None:
+                buckets[key] = idx
+            elif not isinstance(entry, list):
+                buckets[key] = [entry, idx]
+            elif len(entry) < self.max_bucket:
+                entry.append(idx)
+        return True
+
+    def __len__(self):
+        return self._len
@@ -0,0 +1,397 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Compressed streaming input and output
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Open corpus files that may be compressed with gzip, xz, bzip2 or
+     zstandard. Input compression is recognized from the first bytes of the
+     file, so compressed stdin works too, output compression from the file
+     name suffix. Compressed streams are decompressed or compressed on a
+     background thread in blocks of BLOCK_SIZE bytes, the codecs release the
+     GIL so this overlaps with filtering in the main thread. Plain files are
+     opened with a BLOCK_SIZE buffer and stay seekable, as checkpoints
+     and byte range sharding require. LineWriter batches output lines into
+     few large writes.
+
+"""
+
+import io
+import os
+import queue
+import re
+import sys
+import threading
+
+BLOCK_SIZE = 1 << 20
+DEFAULT_BATCH_LINES = 1 << 12
+_QUEUE_BLOCKS = 8  # blocks in flight between the main and background thread
+# Splits after a \r that is not part of a \r\n
+_LONE_CR = re.compile(rb"(?<=\r)(?!\n)")
+
+SUFFIXES = {
+    ".gz": "gzip",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".bz2": "bzip2",
+    ".zst": "zstd",
+}
+_MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"BZh", "bzip2"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+
+
+def compression_of_path(path):
+    """ Compression implied by the suffix of path, None if uncompressed """
+    return SUFFIXES.get(os.path.splitext(str(path))[1].lower())
+
+
+def strip_compression_suffix(path):
+    """ path without a compression suffix, e.g. corpus.tsv.gz -> corpus.tsv """
+    path = str(path)
+    return os.path.splitext(path)[0] if compression_of_path(path) else path
+
+
+def _sniff_compression(fh):
+    """ Compression of the buffered binary stream fh, judged from its first
+        bytes without consuming them """
+    head = fh.peek(8)[:8]
+    for (magic, compression) in _MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def file_compression(path):
+    """ Compression of the file at path, judged from its first bytes """
+    with open(str(path), "rb") as fh:
+        return _sniff_compression(fh)
+
+
+def _open_codec(compression, fh, mode):
+    """ Binary file object that decompresses (mode "rb") from or compresses
+        (mode "wb") to the binary file object fh """
+    if compression == "gzip":
+        import gzip
+
+        return gzip.GzipFile(fileobj=fh, mode=mode, compresslevel=6)
+    if compression == "xz":
+        import lzma
+
+        return lzma.LZMAFile(fh, mode=mode)
+    if compression == "bzip2":
+        import bz2
+
+        return bz2.BZ2File(fh, mode=mode)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Reading or writing .zst files requires zstandard")
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(
+                fh, read_across_frames=True
+            )
+        return zstandard.ZstdCompressor().stream_writer(fh)
+    raise ValueError("Unknown compression {0}".format(compression))
+
+
+class _Closing:
+    """ Wrap a codec file object so that closing it also closes the file
+        object underneath """
+
+    def __init__(self, codec, fh):
+        self._codec = codec
+        self._fh = fh
+
+    def read(self, size=-1):
+        return self._codec.read(size)
+
+    def write(self, data):
+        return self._codec.write(data)
+
+    def flush(self):
+        self._codec.flush()
+
+    def close(self):
+        try:
+            self._codec.close()
+        finally:
+            self._fh.close()
+
+
+class _BackgroundReader(io.RawIOBase):
+    """ Raw binary stream of the blocks read from source by a background
+        thread, at most _QUEUE_BLOCKS ahead of the consumer """
+
+    def __init__(self, source, close_source=True):
+        super().__init__()
+        self._source = source
+        self._close_source = close_source
+        self._queue = queue.Queue(maxsize=_QUEUE_BLOCKS)
+        self._stopped = False
+        self._pending = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while not self._stopped:
+                block = self._source.read(BLOCK_SIZE)
+                if not block:
+                    break
+                self._queue.put(block)
+            self._queue.put(None)
+        except Exception as exc:
+            self._queue.put(exc)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if not self._pending:
+            if self._eof:
+                return 0
+            block = self._queue.get()
+            if isinstance(block, Exception):
+                self._eof = True
+                raise block
+            if block is None:
+                self._eof = True
+                return 0
+            self._pending = memoryview(block)
+        size = min(len(buf), len(self._pending))
+        buf[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        self._stopped = True
+        # Unblock the producer if it is waiting for room in the queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        if self._close_source:
+            self._source.close()
+        super().close()
+
+
+class _BackgroundWriter(io.RawIOBase):
+    """ Raw binary stream whose writes are handed to a background thread
+        that writes them to sink. Errors from the sink are raised by a later
+        write or by close. """
+
+    def __init__(self, sink):
+        super().__init__()
+        self._sink = sink
+        self._queue = queue.Queue(maxsize=_QUEUE_BLOCKS)
+        self._error = None
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._sink.write(block)
+            except Exception as exc:
+                self._error = exc
+        try:
+            self._sink.close()
+        except Exception as exc:
+            self._error = self._error or exc
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def writable(self):
+        return True
+
+    def write(self, buf):
+        self._raise_error()
+        # buf is a view of the caller's buffer, which will be reused
+        data = bytes(buf)
+        self._queue.put(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        super().close()
+        self._raise_error()
+
+
+def _text(binary, encoding, newline=None):
+    if encoding is None:
+        return binary
+    text = io.TextIOWrapper(binary, encoding=encoding, newline=newline)
+    # Decode in large chunks rather than the default of 8 KiB
+    text._CHUNK_SIZE = BLOCK_SIZE
+    return text
+
+
+def open_input(path=None, encoding="utf-8"):
+    """ Open path (stdin if None or "-") for reading, decompressing it if it
+        is compressed. Returns a text stream, or a binary one if encoding
+        is None. """
+    if path is None or str(path) == "-":
+        binary = sys.stdin.buffer
+        close_source = False
+    else:
+        binary = open(str(path), "rb", buffering=BLOCK_SIZE)
+        close_source = True
+    compression = _sniff_compression(binary)
+    if compression is None:
+        if close_source:
+            return _text(binary, encoding)
+        return sys.stdin if encoding is not None else binary
+    source = _open_codec(compression, binary, "rb")
+    if close_source:
+        # Closing the codec does not close a file object it did not open
+        source = _Closing(source, binary)
+    reader = _BackgroundReader(source, close_source=close_source)
+    return _text(io.BufferedReader(reader, BLOCK_SIZE), encoding)
+
+
+def open_output(path=None, mode="w", encoding="utf-8"):
+    """ Open path (stdout if None or "-") for writing, compressing according
+        to its suffix. Mode "r+" opens a plain file for rewriting, as when a
+        checkpointed run resumes. Returns a text stream, or a binary one if
+        encoding is None. """
+    if path is None or str(path) == "-":
+        return sys.stdout if encoding is not None else sys.stdout.buffer
+    compression = compression_of_path(path)
+    if compression is None:
+        if encoding is None:
+            return open(str(path), mode + "b", buffering=BLOCK_SIZE)
+        return open(str(path), mode, encoding=encoding, buffering=BLOCK_SIZE)
+    if mode != "w":
+        raise ValueError("Compressed files can only be written from the start")
+    binary = open(str(path), "wb")
+    sink = _Closing(_open_codec(compression, binary, "wb"), binary)
+    writer = _BackgroundWriter(sink)
+    # Lines are left as they are, no newline translation
+    return _text(io.BufferedWriter(writer, BLOCK_SIZE), encoding, newline="")
+
+
+def shard_range(size, shard, num_shards):
+    """ Byte range [start, end) of shard number shard (1 to num_shards) when
+        size bytes are split into num_shards near equal ranges """
+    return (size * (shard - 1) // num_shards, size * shard // num_shards)
+
+
+def iter_range_lines(fh, start, end):
+    """ Lines (bytes, with their line endings, see iter_lines) of the
+        seekable binary file fh that start at an offset in [start, end). A
+        line that starts before start belongs to an earlier range even if it
+        ends inside this one. """
+    fh.seek(max(start - 1, 0))
+    lines = iter_lines(fh)
+    offset = 0
+    if start > 0:
+        # The line holding the byte before start, or its remainder, ends
+        # where the first line of the range starts
+        offset = start - 1 + len(next(lines, b""))
+    for raw in lines:
+        if offset >= end:
+            return
+        offset += len(raw)
+        yield raw
+
+
+def iter_lines(fh):
+    """ Lines (bytes, with their line endings) of the binary file object fh
+        from its current position. Like reading in text mode, a line ends at
+        \\n, \\r\\n or a lone \\r. """
+    for raw in fh:
+        if b"\r" not in raw:
+            yield raw
+            continue
+        # A line of fh ends only at \n or the end of the file, a \r inside
+        # it that is not followed by \n ends a line of its own
+        for part in _LONE_CR.split(raw):
+            if part:
+                yield part
+
+
+def decode_line(raw, encoding="utf-8"):
+    """ Decode a line from iter_lines, translating a \\r\\n or \\r ending to
+        \\n as reading in text mode does """
+    if raw.endswith(b"\r\n"):
+        raw = raw[:-2] + b"\n"
+    elif raw.endswith(b"\r"):
+        raw = raw[:-1] + b"\n"
+    return raw.decode(encoding)
+
+
+class LineWriter:
+    """ Write lines (without newlines) to the text stream fh in batches of
+        batch_lines, joined into a single write. Other attributes, such as
+        tell and seek, are those of fh, after flush(). """
+
+    def __init__(self, fh, batch_lines=DEFAULT_BATCH_LINES):
+        self._fh = fh
+        self._batch_lines = batch_lines
+        self._lines = []
+
+    def write_line(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self._batch_lines:
+            self._write_batch()
+
+    def write_lines(self, lines):
+        for line in lines:
+            self.write_line(line)
+
+    def _write_batch(self):
+        if self._lines:
+            self._lines.append("")
+            self._fh.write("\n".join(self._lines))
+            self._lines = []
+
+    def flush(self):
+        self._write_batch()
+        self._fh.flush()
+
+    def close(self):
+        self.flush()
+        if self._fh not in (sys.stdout, sys.stderr):
+            self._fh.close()
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,166 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Subword encoder
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Standalone reimplementation of the encoding half of tensor2tensor's
+     SubwordTextEncoder. It reads the same .subwords vocabulary files and
+     produces the same ids, without importing tensor2tensor or TensorFlow.
+
+"""
+
+import functools
+import re
+import sys
+import unicodedata
+
+# Characters used by the escaping scheme, always part of the alphabet
+_ESCAPE_CHARS = set("\\_u;0123456789")
+_TERMINAL = ""  # trie key holding the id of the subtoken ending at a node
+
+_ASCII_RUN_PROG = re.compile(r"[A-Za-z0-9]+|[^A-Za-z0-9]+")
+_UNICODE_RUN_PROG = None
+
+DEFAULT_CACHE_SIZE = 2 ** 18
+
+
+def _alphanumeric_ranges():
+    """ Ranges of code points in Unicode categories L* and N*, the same set
+        of characters tensor2tensor's tokenizer considers alphanumeric. """
+    ranges = []
+    start = None
+    for i in range(sys.maxunicode):
+        is_alnum = unicodedata.category(chr(i))[0] in "LN"
+        if is_alnum and start is None:
+            start = i
+        elif not is_alnum and start is not None:
+            ranges.append((start, i - 1))
+            start = None
+    if start is not None:
+        ranges.append((start, sys.maxunicode - 1))
+    return ranges
+
+
+def _unicode_run_prog():
+    global _UNICODE_RUN_PROG
+    if _UNICODE_RUN_PROG is None:
+        char_class = "".join(
+            "{0}-{1}".format(re.escape(chr(lo)), re.escape(chr(hi)))
+            for lo, hi in _alphanumeric_ranges()
+        )
+        _UNICODE_RUN_PROG = re.compile(
+            "[{0}]+|[^{0}]+".format(char_class)
+        )
+    return _UNICODE_RUN_PROG
+
+
+def tokenize(text):
+    """ Split text into alternating runs of alphanumeric and other characters.
+        Single spaces between two tokens are dropped. Matches
+        tensor2tensor.data_generators.tokenizer.encode. """
+    if not text:
+        return []
+    prog = _ASCII_RUN_PROG if text.isascii() else _unicode_run_prog()
+    runs = prog.findall(text)
+    last = len(runs) - 1
+    return [
+        run for (i, run) in enumerate(runs) if run != " " or i == 0 or i == last
+    ]
+
+
+def escape_token(token, alphabet):
+    """ Escape away underscores and characters outside the alphabet and
+        append the end-of-token marker. """
+    token = token.replace("\\", "\\\\").replace("_", "\\u")
+    ret = [
+        c if c in alphabet and c != "\n" else "\\%d;" % ord(c) for c in token
+    ]
+    return "".join(ret) + "_"
+
+
+class SubwordEncoder:
+    """ Encode text into subword ids with a vocabulary in the format written
+        by tensor2tensor's SubwordTextEncoder.store_to_file. Tokens are split
+        into subwords by greedy longest match, looked up in a trie, and the
+        encoding of each token is kept in an LRU cache. """
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE):
+        self._path = path
+        subtoken_strings = self._load_subtoken_strings(path)
+        self._subtoken_strings = subtoken_strings
+        self._alphabet = {c for s in subtoken_strings for c in s} | _ESCAPE_CHARS
+        # Later duplicates win, as in the dict built by tensor2tensor
+        string_to_id = {s: i for (i, s) in enumerate(subtoken_strings) if s}
+        self._trie = {}
+        for (subtoken, subtoken_id) in string_to_id.items():
+            node = self._trie
+            for c in subtoken:
+                node = node.setdefault(c, {})
+            node[_TERMINAL] = subtoken_id
+        self._token_to_ids = functools.lru_cache(maxsize=cache_size)(
+            self._token_to_ids_uncached
+        )
+
+    @staticmethod
+    def _load_subtoken_strings(path):
+        subtoken_strings = []
+        with open(str(path), "r", encoding="utf-8") as fp:
+            for line in fp:
+                s = line.strip()
+                # Some vocab files wrap words in single quotes, but others don't
+                if (s.startswith("'") and s.endswith("'")) or (
+                    s.startswith('"') and s.endswith('"')
+                ):
+                    s = s[1:-1]
+                subtoken_strings.append(s)
+        return subtoken_strings
+
+    @property
+    def vocab_size(self):
+        return len(self._subtoken_strings)
+
+    def encode(self, text):
+        ret = []
+        for token in tokenize(text):
+            ret.extend(self._token_to_ids(token))
+        return ret
+
+    def _token_to_ids_uncached(self, token):
+        escaped = escape_token(token, self._alphabet)
+        ret = []
+        start = 0
+        length = len(escaped)
+        while start < length:
+            node = self._trie
+            best_id = None
+            pos = start
+            while pos < length:
+                node = node.get(escaped[pos])
+                if node is None:
+                    break
+                pos += 1
+                if _TERMINAL in node:
+                    best_id, end = node[_TERMINAL], pos
+            if best_id is None:
+                raise ValueError(
+                    "Token substring not found in subtoken vocabulary: {0}".format(
+                        escaped[start:]
+                    )
+                )
+            ret.append(best_id)
+            start = end
+        return tuple(ret)
@@ -210,3 +210,75 @@ PUNCTUATION_SYMBOLS = (
 )
 
 SUBSTITUTE_FOR_NULL = "\xad"
+
+# Classes of code points, as bits in SYMBOL_CLASSES
+WHITELISTED = 1
+BANNED = 2
+WRONG_QUOTE = 4  # quote-like characters that are not Icelandic quotes
+PUNCTUATION = 8
+SOFT_HYPHEN = 16
+
+WRONG_QUOTES = set(QUOTE_LIKE) - set("'\",") - set(ICE_QUOTE.ALL)
+
+
+def _build_symbol_classes():
+    table = {}
+    for (chars, bit) in [
+        (SYMBOL_WHITELIST, WHITELISTED),
+        (BANNED_SYMBOLS, BANNED),
+        (WRONG_QUOTES, WRONG_QUOTE),
+        (PUNCTUATION_SYMBOLS, PUNCTUATION),
+        (SUBSTITUTE_FOR_NULL, SOFT_HYPHEN),
+    ]:
+        for char in chars:
+            table[char] = table.get(char, 0) | bit
+    return table
+
+
+# Character -> class bits, characters that are not listed have none
+SYMBOL_CLASSES = _build_symbol_classes()
+
+
+def chars_in_class(bit, ascii_only=False):
+    return frozenset(
+        char
+        for (char, bits) in SYMBOL_CLASSES.items()
+        if bits & bit and (char.isascii() or not ascii_only)
+    )
+
+
+WHITELISTED_CHARS = chars_in_class(WHITELISTED)
+_SCANNED_CLASSES = (BANNED, WRONG_QUOTE, PUNCTUATION, SOFT_HYPHEN)
+_CLASS_MEMBERS = [(bit, chars_in_class(bit)) for bit in _SCANNED_CLASSES]
+_ASCII_CLASS_MEMBERS = [
+    (bit, chars_in_class(bit, ascii_only=True)) for bit in _SCANNED_CLASSES
+]
+
+
+class SymbolScan:
+    """ Character classes of one or more texts, found with a single pass over
+        each text. classes has the bit of every class (other than WHITELISTED)
+        that some character belongs to. ASCII texts are only checked against
+        the few ASCII members of each class. """
+
+    __slots__ = ("classes", "all_whitelisted")
+
+    def __init__(self, *texts):
+        chars = set()
+        for text in texts:
+            chars.update(text)
+        members = (
+            _ASCII_CLASS_MEMBERS
+            if all(text.isascii() for text in texts)
+            else _CLASS_MEMBERS
+        )
+        classes = 0
+        for (bit, class_chars) in members:
+            if class_chars and not chars.isdisjoint(class_chars):
+                classes |= bit
+        self.classes = classes
+        self.all_whitelisted = chars <= WHITELISTED_CHARS
+
+    def has(self, bit):
+        """ Whether some character is in the class bit """
+        return bool(self.classes & bit)
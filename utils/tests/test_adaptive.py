@@ -0,0 +1,82 @@
+import bench_corpus
+import filters
+from filters import Example, FilterScheduler, Profiler, Stage
+
+
+def mixed_lines():
+    pairs = bench_corpus.generate_bitext(1500, noise=0.6)
+    return [eng + "\t" + ice for (eng, ice) in pairs + pairs[::5]]
+
+
+def run(lines, **kwargs):
+    filters.Deduplifier.use_backend("set")
+    pipeline = filters.MinimalPipeline
+    results = pipeline.run(filters.lines_to_examples(lines), batch_size=16, **kwargs)
+    kept = [filters.example_to_line(ex) for ex in results]
+    return kept, dict(pipeline.counter)
+
+
+def reordered():
+    schedulers = filters.MinimalPipeline._schedulers.values()
+    return any(s.order != sorted(s.order) for s in schedulers)
+
+
+def test_canonical_attribution_matches_fixed_order():
+    lines = mixed_lines()
+    expected = run(lines)
+    assert run(lines, adaptive=True, attribution="canonical") == expected
+    assert reordered()
+
+
+def test_first_attribution_keeps_the_same_examples():
+    lines = mixed_lines()
+    expected_kept, expected_counter = run(lines)
+    kept, counter = run(lines, adaptive=True, attribution="first")
+    assert reordered()
+    assert kept == expected_kept
+    # Every rejected example is counted once, maybe against another filter
+    assert sum(counter.values()) == sum(expected_counter.values())
+    transforms = filters.Transformations._transforms
+    assert {name: n for (name, n) in counter.items() if name in transforms} == {
+        name: n for (name, n) in expected_counter.items() if name in transforms
+    }
+
+
+def filter_stage(name, scalar):
+    def fn(exs):
+        return [scalar(ex) for ex in exs]
+
+    return Stage(name, Stage.FILTER, fn, scalar, None)
+
+
+def test_raising_batch_is_recorded_once():
+    def short(ex):
+        return len(ex.source) > 3
+
+    def ratio(ex):
+        # Raises on the examples that short rejects
+        return 10 / (len(ex.source) - 3) < 2
+
+    def ascii(ex):
+        return ex.source.isascii()
+
+    scheduler = FilterScheduler(
+        [
+            filter_stage("short", short),
+            filter_stage("ascii", ascii),
+            filter_stage("ratio", ratio),
+        ]
+    )
+    # As if reordered, ratio now raises after ascii ran, before short rejects
+    scheduler.order = [1, 2, 0]
+    exs = [Example(src, "x") for src in ("abc", "abcdef", "abcdefghijklm")]
+    profiler = Profiler()
+    rejected = []
+    idxs, kept = scheduler.run_block(
+        [0, 1, 2], exs, lambda name, idx: rejected.append((name, idx)), profiler
+    )
+    assert idxs == [2]
+    assert sorted(rejected) == [("ratio", 1), ("short", 0)]
+    assert scheduler._calls == [3, 2, 2]
+    assert scheduler._rejects == [1, 0, 1]
+    assert [stats.calls for stats in profiler.stats.values()] == [3, 2, 2]
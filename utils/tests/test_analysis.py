@@ -0,0 +1,66 @@
+import filters
+from filters import Example, analyze
+
+
+def transform(stages, lines):
+    pipeline = filters.Pipeline.from_config(
+        {"name": "TransformPipeline", "stages": stages}
+    )
+    pipeline.compile_plan()
+    pipeline.init_schedulers(False)
+    pipeline.counter.clear()
+    batch = list(filters.lines_to_examples(lines))
+    for ex in batch:
+        # Memoized before the transformations run
+        analyze(ex).words("is")
+    return batch, pipeline.process_batch(batch)
+
+
+def test_analysis_is_memoized():
+    ex = Example("Two words", "Tvö orð")
+    analysis = analyze(ex)
+    words = analysis.words("is")
+    assert words == ["Tvö", "orð"]
+    assert analyze(ex) is analysis
+    assert analysis.words("is") is words
+    calls = []
+    assert analysis.cached("key", lambda: calls.append(1) or 5) == 5
+    assert analysis.cached("key", lambda: calls.append(1) or 6) == 5
+    assert calls == [1] and analysis.is_cached("key")
+
+
+def test_setting_a_sentence_invalidates_the_analysis():
+    ex = Example("Two words", "Tvö orð")
+    analysis = analyze(ex)
+    ex["is"] = "Þrjú orð hér"
+    assert analyze(ex) is not analysis
+    assert analyze(ex).words("is") == ["Þrjú", "orð", "hér"]
+    assert analyze(ex).words("en") == ["Two", "words"]
+
+
+def test_transformation_that_replaces_strings_invalidates_the_analysis():
+    batch, results = transform(["soft_hyphen"], ["Some\xadthing\tOrð\xadið"])
+    (old,), (new,) = batch, results
+    assert old.analysis.words("is") == ["Orð", "ið"]
+    assert new is not old
+    assert analyze(new).words("is") == ["Orðið"]
+    assert analyze(new).words("en") == ["Something"]
+
+
+def test_unchanged_example_keeps_its_analysis():
+    batch, results = transform(
+        ["soft_hyphen", "merge_spaces"], ["Nothing to do\tEkkert að gera"]
+    )
+    (old,), (new,) = batch, results
+    analysis = old.analysis
+    assert new is old
+    assert analyze(new) is analysis
+
+
+def test_fused_transformation_invalidates_the_analysis():
+    batch, results = transform(["merge_spaces"], ["Extra  spaces\tAuka  bil "])
+    (old,), (new,) = batch, results
+    assert old.analysis.words("is") == ["Auka", "bil"]
+    assert (new.source, new.target) == ("Extra spaces", "Auka bil")
+    assert not old.analysis.is_valid_for(new)
+    assert analyze(new) is not old.analysis
@@ -0,0 +1,75 @@
+import pytest
+
+import bench_corpus
+import filters
+
+
+def bench_lines(num_pairs):
+    return [
+        eng + "\t" + ice for (eng, ice) in bench_corpus.generate_bitext(num_pairs)
+    ]
+
+
+def run_lines(pipeline, lines, batch_size):
+    filters.Deduplifier.use_backend("set")
+    results = pipeline.run(filters.lines_to_examples(lines), batch_size=batch_size)
+    return [filters.example_to_line(ex) for ex in results], dict(pipeline.counter)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 64])
+def test_batch_size_does_not_change_results(batch_size):
+    lines = bench_lines(300)
+    lines += lines[:40]  # duplicates within and across batches
+    pipeline = filters.MinimalPipeline
+    expected = run_lines(pipeline, lines, batch_size=len(lines))
+    # Batch sizes over 1 leave a partial batch at the end
+    assert batch_size == 1 or len(lines) % batch_size
+    assert run_lines(pipeline, lines, batch_size) == expected
+    assert expected[1]["deduplicate"] >= 40
+
+
+def test_process_batch_marks_rejected_examples():
+    lines = ["Good sentence here\tGóð setning hér", "\tTómt", "Another one\tÖnnur"]
+    pipeline = filters.Pipeline.from_config(
+        {"name": "NullPipeline", "stages": ["null_sentence"]}
+    )
+    pipeline.compile_plan()
+    pipeline.init_schedulers(False)
+    pipeline.counter.clear()
+    batch = list(filters.lines_to_examples(lines))
+    results = pipeline.process_batch(batch)
+    assert len(results) == len(batch)
+    assert results[0] is batch[0] and results[2] is batch[2]
+    assert results[1] is None
+    assert pipeline.counter["null_sentence"] == 1
+
+
+def test_scalar_filters_get_a_batch_version():
+    exs = list(filters.lines_to_examples(["A b\tC d", " \tC d", "A b\t"]))
+    for name in ("null_sentence", "alphanumeric", "case_mismatch"):
+        scalar = filters.Filters._filters[name]
+        mask = filters.Filters.get_batch(name)(exs)
+        assert mask == [bool(scalar(ex)) for ex in exs]
+        inverted = filters.Filters.apply_batch(name, exs, inverted=True)
+        assert inverted == [not keep for keep in mask]
+    with pytest.raises(KeyError):
+        filters.Filters.get_batch("no_such_filter")
+
+
+def test_registered_batch_versions_match_scalar_ones():
+    # Some filters expect words on both sides, null_sentence and
+    # alphanumeric come first in a pipeline
+    exs = [
+        ex
+        for ex in filters.lines_to_examples(bench_lines(200))
+        if filters.null_sentence(ex) and filters.alphanumeric(ex)
+    ]
+    for (name, batch_fun) in list(filters.Filters._batch_filters.items()):
+        scalar = filters.Filters._filters[name]
+        if name in ("deduplicate", "near_duplicate"):
+            continue  # stateful
+        assert batch_fun(exs) == [bool(scalar(ex)) for ex in exs], name
+    for (name, batch_fun) in list(filters.Transformations._batch_transforms.items()):
+        scalar = filters.Transformations._transforms[name]
+        expected = [filters.example_to_line(scalar(ex)) for ex in exs]
+        assert [filters.example_to_line(ex) for ex in batch_fun(exs)] == expected
@@ -0,0 +1,112 @@
+import os
+import pickle
+
+import bench_corpus
+import filters
+from stream_io import LineWriter
+
+
+def run_checkpointed(
+    in_path,
+    out_path,
+    ck_path,
+    resume=False,
+    stop_after=None,
+    pipeline=filters.MinimalPipeline,
+):
+    """ Run pipeline with checkpoints, stopping as if it crashed after
+        stop_after output lines. Returns the checkpoint. """
+    filters.Deduplifier.use_backend("set")
+    mode = "r+" if resume else "w"
+    with open(str(in_path), encoding="utf-8") as in_file, open(
+        str(out_path), mode, encoding="utf-8"
+    ) as out_file:
+        writer = LineWriter(out_file, batch_lines=7)
+        checkpoint = filters.Checkpoint(str(ck_path), writer, every=20)
+        if resume:
+            checkpoint.load()
+        examples = filters.lines_to_examples(checkpoint.lines(in_file))
+        results = pipeline.run(
+            examples, checkpoint=checkpoint, batch_size=5
+        )
+        for (count, ex) in enumerate(results):
+            if count == stop_after:
+                results.close()
+                return checkpoint
+            writer.write_line(filters.example_to_line(ex))
+        writer.flush()
+    return checkpoint
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    corpus = tmp_path / "corpus.tsv"
+    pairs = bench_corpus.generate_bitext(400)
+    # Duplicates on both sides of the crash
+    bench_corpus.write_tsv(str(corpus), pairs + pairs[:200])
+    expected = tmp_path / "expected.tsv"
+    run_checkpointed(corpus, expected, tmp_path / "expected.ck")
+    expected_counter = dict(filters.MinimalPipeline.counter)
+
+    out, ck_path = tmp_path / "out.tsv", tmp_path / "out.ck"
+    run_checkpointed(corpus, out, ck_path, stop_after=150)
+    run_checkpointed(corpus, out, ck_path, resume=True)
+    assert out.read_text(encoding="utf-8") == expected.read_text(encoding="utf-8")
+    assert filters.MinimalPipeline.counter == expected_counter
+
+
+def test_checkpoints_journal_dedup_keys(tmp_path):
+    corpus = tmp_path / "corpus.tsv"
+    bench_corpus.write_tsv(str(corpus), bench_corpus.generate_bitext(200))
+    ck_path = tmp_path / "out.ck"
+    run_checkpointed(corpus, tmp_path / "out.tsv", ck_path)
+    with open(str(ck_path), "rb") as fh:
+        state = pickle.load(fh)
+    assert "Deduplifier._set" not in state["filters"]
+    keys = []
+    with open(str(ck_path) + filters.Checkpoint.KEYS_SUFFIX, "rb") as fh:
+        while fh.tell() < state["keys_offset"]:
+            keys.extend(pickle.load(fh))
+    assert len(keys) == len(set(keys)) == len(filters.Deduplifier._set)
+
+
+def test_resumed_run_with_gatherer(tmp_path):
+    pipeline = filters.Pipeline.from_config(
+        {
+            "name": "GatherPipeline",
+            "stages": ["null_sentence", "MinFrequency", "deduplicate"],
+        }
+    )
+    corpus = tmp_path / "corpus.tsv"
+    pairs = bench_corpus.generate_bitext(400)
+    bench_corpus.write_tsv(str(corpus), pairs + pairs[:200])
+    expected = tmp_path / "expected.tsv"
+    run_checkpointed(corpus, expected, tmp_path / "expected.ck", pipeline=pipeline)
+    expected_counter = dict(pipeline.counter)
+    assert expected_counter.get("MinFrequency")
+
+    out, ck_path = tmp_path / "out.tsv", tmp_path / "out.ck"
+    checkpoint = run_checkpointed(
+        corpus, out, ck_path, stop_after=100, pipeline=pipeline
+    )
+    # The whole input has been read, an offset is kept per batch of 5 lines
+    assert checkpoint.reader._line_count == 600
+    assert len(checkpoint.reader._offsets) <= 600 // 5
+    assert os.path.exists(str(ck_path) + filters.Checkpoint.GATHERERS_SUFFIX)
+    run_checkpointed(corpus, out, ck_path, resume=True, pipeline=pipeline)
+    assert out.read_text(encoding="utf-8") == expected.read_text(encoding="utf-8")
+    assert pipeline.counter == expected_counter
+
+
+def test_close_stops_journaling(tmp_path):
+    corpus = tmp_path / "corpus.tsv"
+    bench_corpus.write_tsv(str(corpus), bench_corpus.generate_bitext(50))
+    filters.Deduplifier.use_backend("set")
+    with open(str(corpus), encoding="utf-8") as in_file, open(
+        str(tmp_path / "out.tsv"), "w", encoding="utf-8"
+    ) as out_file:
+        filters.do_pipeline(
+            in_file, out_file, checkpoint_path=str(tmp_path / "out.ck")
+        )
+    assert filters.Deduplifier._added is None
+    assert filters.Deduplifier.is_unique_example(filters.Example("a", "b"))
+    assert filters.Deduplifier._added is None
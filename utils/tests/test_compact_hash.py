@@ -0,0 +1,90 @@
+import pytest
+
+import bench_corpus
+import compact_hash
+import filters
+from compact_hash import CompactHashSet
+
+
+@pytest.mark.parametrize("bits", [64, 128])
+def test_set_interface(bits):
+    keys = ["key {0}".format(i) for i in range(1000)]
+    hashes = CompactHashSet(bits=bits, capacity=4)
+    assert all(hashes.add(key) for key in keys)
+    assert not any(hashes.add(key) for key in keys)
+    assert len(hashes) == len(keys)
+    assert all(key in hashes for key in keys)
+    assert "another key" not in hashes
+    # Grown from a capacity of 4, without passing max_load
+    assert len(hashes) <= hashes._size * hashes.max_load
+    assert hashes.memory_usage() == hashes._size * bits // 8
+
+
+@pytest.mark.parametrize("bits", [64, 128])
+def test_probing_wraps_around(bits):
+    hashes = CompactHashSet(bits=bits, capacity=4)
+    size = hashes._size
+    last = size - 1
+    # Both hash to the last slot, the second probes on to slot 0
+    first, second = (last,) * hashes._words, (last + size,) * hashes._words
+    for words in (first, second):
+        slot, found = hashes._find(words)
+        assert not found
+        hashes._insert(words, slot)
+    assert hashes._find(first) == (last, True)
+    assert hashes._find(second) == (0, True)
+    hashes._grow()
+    assert hashes._find(first)[1] and hashes._find(second)[1]
+
+
+def test_collisions_are_false_duplicates(monkeypatch):
+    hashes = CompactHashSet(bits=64)
+    # Keep only 4 bits of the hash, 20 keys must collide
+    narrow = compact_hash.hash_key
+    monkeypatch.setattr(
+        compact_hash, "hash_key", lambda key, bits: (narrow(key, bits) & 15) or 1
+    )
+    added = [hashes.add("key {0}".format(i)) for i in range(20)]
+    assert added.count(True) == len(hashes) <= 15
+    assert added.count(False) >= 5
+
+
+def test_collision_probability():
+    hashes = CompactHashSet(bits=64)
+    assert hashes.collision_probability() == 0
+    for i in range(1000):
+        hashes.add(str(i))
+    assert hashes.collision_probability() == pytest.approx(1000 * 999 / 2 ** 65)
+    assert CompactHashSet(bits=128).collision_probability() == 0
+
+
+def test_use_backend():
+    Deduplifier = filters.Deduplifier
+    for backend, bits in (("hash64", 64), ("hash128", 128), ("set", None)):
+        Deduplifier.use_backend(backend)
+        if bits is None:
+            assert isinstance(Deduplifier._set, set)
+        else:
+            assert Deduplifier._set.bits == bits
+        assert Deduplifier.is_unique_key("a\tb")
+        assert not Deduplifier.is_unique_key("a\tb")
+        assert Deduplifier.is_unique_key("a\tc")
+        assert str(len(Deduplifier._set)) in Deduplifier.describe()
+    with pytest.raises(ValueError):
+        Deduplifier.use_backend("hash32")
+
+
+def test_hash_backends_keep_the_same_lines():
+    pairs = bench_corpus.generate_bitext(1000)
+    lines = [eng + "\t" + ice for (eng, ice) in pairs + pairs[::2]]
+    results = {}
+    for backend in ("set", "hash64", "hash128"):
+        filters.Deduplifier.use_backend(backend, capacity=16)
+        kept = filters.MinimalPipeline.run(filters.lines_to_examples(lines))
+        results[backend] = (
+            [filters.example_to_line(ex) for ex in kept],
+            dict(filters.MinimalPipeline.counter),
+        )
+    filters.Deduplifier.use_backend("set")
+    assert results["hash64"] == results["set"] == results["hash128"]
+    assert results["set"][1]["deduplicate"]
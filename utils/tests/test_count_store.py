@@ -0,0 +1,29 @@
+import collections
+import os
+import pickle
+
+from count_store import CountMinSketch, CountTable, open_counts, write_counts
+
+
+def test_table_pickles_its_contents(tmp_path):
+    counts = collections.Counter("the cat and the hat and the bat".split())
+    path = str(tmp_path / "words.counts")
+    write_counts(path, counts)
+    table = open_counts(path)
+    os.remove(path)
+    copy = pickle.loads(pickle.dumps(table))
+    assert isinstance(copy, CountTable)
+    assert dict(copy.items()) == dict(counts)
+    assert copy.get("the") == 3
+    assert copy.get("dog") == 0
+
+
+def test_mapped_sketch_pickles_its_counts(tmp_path):
+    sketch = CountMinSketch(64, 3)
+    sketch.update("a b a c a".split())
+    path = str(tmp_path / "words.counts")
+    write_counts(path, sketch)
+    copy = pickle.loads(pickle.dumps(open_counts(path)))
+    assert [copy.get(word) for word in "abcd"] == [
+        sketch.get(word) for word in "abcd"
+    ]
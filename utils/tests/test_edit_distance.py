@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from edit_distance import _banded_distance, bounded_edit_distance
+
+editdistance = pytest.importorskip("editdistance")
+
+
+def random_pairs(num, alphabet="abc", max_len=14):
+    rand = random.Random(0)
+    for _ in range(num):
+        yield tuple(
+            "".join(rand.choice(alphabet) for _ in range(rand.randrange(max_len)))
+            for _ in range(2)
+        )
+
+
+@pytest.mark.parametrize("bound", range(9))
+def test_bounded_matches_editdistance(bound):
+    for a, b in random_pairs(3000):
+        expected = min(editdistance.eval(a, b), bound)
+        assert bounded_edit_distance(a, b, bound) == expected, (a, b)
+
+
+@pytest.mark.parametrize("bound", range(1, 9))
+def test_band_matches_editdistance(bound):
+    for a, b in random_pairs(3000):
+        if abs(len(a) - len(b)) >= bound:
+            continue
+        expected = min(editdistance.eval(a, b), bound)
+        assert _banded_distance(a, b, bound) == expected, (a, b)
+
+
+def test_sequences_of_tokens():
+    a = "the cat sat on the mat".split()
+    b = "the dog sat on a mat".split()
+    assert bounded_edit_distance(a, b, 3) == 2
+    assert bounded_edit_distance(a, b, 2) == 2
+    assert bounded_edit_distance(a, b, 1) == 1
@@ -0,0 +1,92 @@
+import pickle
+
+import pytest
+
+import filters
+from filters import Example
+
+
+def test_dict_style_access():
+    ex = Example("Source", "Markmál", file_id="doc1", align_score=0.5)
+    assert (ex["en"], ex["is"]) == ("Source", "Markmál")
+    assert (ex["file_id"], ex["align_score"]) == ("doc1", 0.5)
+    assert "is" in ex and "en" in ex and "other" not in ex
+    assert ex.get("is") == "Markmál"
+    assert ex.get("other", "default") == "default"
+    with pytest.raises(KeyError):
+        ex["other"]
+    with pytest.raises(KeyError):
+        ex["other"] = "value"
+    ex["is"] = "Nýtt"
+    assert ex.target == "Nýtt"
+
+
+def test_from_dict():
+    ex = Example.from_dict({"is": "Markmál", "en": "Source", "file_id": "doc1"})
+    assert (ex.source, ex.target, ex.file_id, ex.align_score) == (
+        "Source",
+        "Markmál",
+        "doc1",
+        None,
+    )
+    assert ex == Example("Source", "Markmál", file_id="doc1")
+    assert ex != Example("Source", "Markmál")
+
+
+def test_slots():
+    ex = Example("Source", "Markmál")
+    assert not hasattr(ex, "__dict__")
+    with pytest.raises(AttributeError):
+        ex.other = "value"
+    with pytest.raises(TypeError):
+        hash(ex)
+    assert str(ex) == "Source\tMarkmál"
+
+
+def test_pickle_round_trip():
+    ex = Example("Source", "Markmál", "doc1", 0.5, line="Source\tMarkmál")
+    copy = pickle.loads(pickle.dumps(ex))
+    assert copy == ex
+    assert copy.line == ex.line
+
+
+def test_dict_style_filters_and_transformations(monkeypatch):
+    def legacy_short(ex):
+        return len(ex["en"]) < 20 and ex.get("file_id") is None
+
+    def legacy_upper(ex):
+        # Transformations used to return a new dict
+        return {"is": ex["is"].upper(), "en": ex["en"]}
+
+    monkeypatch.setattr(filters.Filters, "_filters", dict(filters.Filters._filters))
+    monkeypatch.setattr(
+        filters.Filters, "_batch_filters", dict(filters.Filters._batch_filters)
+    )
+    monkeypatch.setattr(
+        filters.Transformations,
+        "_transforms",
+        dict(filters.Transformations._transforms),
+    )
+    monkeypatch.setattr(
+        filters.Transformations,
+        "_batch_transforms",
+        dict(filters.Transformations._batch_transforms),
+    )
+    filters.Filters.register(legacy_short)
+    filters.Transformations.register(legacy_upper)
+    pipeline = filters.Pipeline.from_config(
+        {"name": "LegacyPipeline", "stages": ["legacy_short", "legacy_upper"]}
+    )
+    lines = [
+        "Short\tStutt",
+        "A rather long English sentence\tLöng setning",
+        "Also short\tLíka stutt",
+    ]
+    results = list(pipeline.run(filters.lines_to_examples(lines)))
+    assert all(isinstance(ex, Example) for ex in results)
+    assert list(map(filters.example_to_line, results)) == [
+        "Short\tSTUTT",
+        "Also short\tLÍKA STUTT",
+    ]
+    assert pipeline.counter["legacy_short"] == 1
+    assert pipeline.counter["legacy_upper"] == 2
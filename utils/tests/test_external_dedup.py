@@ -0,0 +1,100 @@
+import os
+import random
+
+import bench_corpus
+import external_dedup
+import filters
+from external_dedup import ExternalDeduplifier, ExternalSorter, FirstOccurrences
+
+
+def gather_dedup_pipeline():
+    return filters.Pipeline.from_config(
+        {
+            "name": "GatherDedupPipeline",
+            "stages": ["null_sentence", "MinFrequency", "deduplicate", "alphanumeric"],
+        }
+    )
+
+
+def run_lines(run, pipeline, lines, **kwargs):
+    filters.Deduplifier.use_backend("set")
+    if run == pipeline.run:
+        results = run(filters.lines_to_examples(lines), **kwargs)
+    else:
+        results = run(lines, **kwargs)
+    return [filters.example_to_line(ex) for ex in results], dict(pipeline.counter)
+
+
+def test_gatherer_rejections_are_not_first_occurrences(tmp_path):
+    # The singleton has rare words, but the deduplication key of the pair
+    # after it, which ignores spaces
+    lines = ["Common words here\tAlgeng orð hér"] * 3 + [
+        "Zebrastripes\tSebrarendur",
+        "Zebra stripes\tSebra rendur",
+        "Zebra stripes\tSebra rendur",
+    ]
+    pipeline = gather_dedup_pipeline()
+    expected = run_lines(pipeline.run, pipeline, lines)
+    assert len(expected[0]) == 2
+    assert expected[1]["MinFrequency"] == 1
+    assert expected[1]["deduplicate"] == 3
+    external = run_lines(
+        pipeline.run_external, pipeline, lines, tmp_dir=str(tmp_path), max_records=2
+    )
+    assert external == expected
+
+
+def test_external_run_matches_run_with_gatherer(tmp_path):
+    pairs = bench_corpus.generate_bitext(400)
+    lines = [eng + "\t" + ice for (eng, ice) in pairs + pairs[::3]]
+    pipeline = gather_dedup_pipeline()
+    expected = run_lines(pipeline.run, pipeline, lines)
+    assert expected[1].get("deduplicate") and expected[1].get("MinFrequency")
+    for jobs in (1, 2):
+        external = run_lines(
+            pipeline.run_external,
+            pipeline,
+            lines,
+            jobs=jobs,
+            tmp_dir=str(tmp_path),
+            max_records=50,
+        )
+        assert external == expected
+
+
+def test_sorter_spills_and_merges_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(external_dedup, "_FAN_IN", 4)
+    rand = random.Random(0)
+    records = [(rand.getrandbits(64), rand.randrange(5), i) for i in range(1000)]
+    sorter = ExternalSorter(3, tmp_dir=str(tmp_path), max_records=7)
+    for record in records:
+        sorter.add(record)
+    # 142 runs of 7 records, merged in fours as they accumulate
+    assert len(sorter._runs) < 4 * 4
+    assert len(os.listdir(str(tmp_path))) == len(sorter._runs)
+    assert sorter._levels == sorted(sorter._levels, reverse=True)
+    assert list(sorter) == sorted(records)
+    assert sorter.num_records == len(records)
+    sorter.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_default_buffer_is_bounded():
+    sorter = ExternalSorter(3)
+    assert sorter._max_records * 176 <= external_dedup.DEFAULT_BUFFER_BYTES
+
+
+def test_first_occurrences(tmp_path):
+    rand = random.Random(1)
+    keys = [str(rand.randrange(300)) for _ in range(2000)]
+    dedup = ExternalDeduplifier(tmp_dir=str(tmp_path), max_records=11)
+    seqs = [dedup.add(key) for key in keys]
+    assert seqs == list(range(len(keys)))
+    firsts = FirstOccurrences(dedup)
+    seen = set()
+    for (seq, key) in enumerate(keys):
+        assert firsts.is_first(seq) == (key not in seen)
+        seen.add(key)
+    assert dedup.num_unique_keys == len(seen)
+    dedup.close()
+    assert os.listdir(str(tmp_path)) == []
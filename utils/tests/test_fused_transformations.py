@@ -0,0 +1,71 @@
+import itertools
+
+import pytest
+
+import bench_corpus
+from filters import (
+    Example,
+    FusedRewrite,
+    MinimalPipeline,
+    Profiler,
+    Stage,
+    TransformationPipeline,
+    Transformations,
+    same_text,
+)
+
+EXTRA = [
+    ("- Some - thing -  here", "• Eitt­hvað  - hér „ok”"),
+    ("A – dash — or­two", "‚Fyrir‘ “hana” „“"),
+    ("• bullet", "•  punktur  – hér"),
+    ("plain", "plain"),
+]
+
+
+def examples():
+    pairs = bench_corpus.generate_bitext(2000, noise=1.0) + EXTRA
+    return [Example(eng, ice) for (eng, ice) in pairs]
+
+
+def apply_one_by_one(names, ex):
+    fired = []
+    for name in names:
+        new_ex = Transformations.apply(name, ex)
+        if not same_text(new_ex, ex):
+            fired.append(name)
+            ex = new_ex
+    return ex, fired
+
+
+def fused_runs():
+    runs = []
+    for pipeline in (MinimalPipeline, TransformationPipeline):
+        for stage in pipeline.compile_plan():
+            if stage.kind == Stage.FUSED:
+                runs.append(stage.fn.names)
+    names = list(Transformations._text_transforms)
+    runs.extend([names, names[::-1]])
+    runs.extend(itertools.islice(itertools.permutations(names, 3), 0, None, 7))
+    return runs
+
+
+@pytest.mark.parametrize("names", fused_runs(), ids="+".join)
+def test_fused_matches_one_by_one(names):
+    exs = examples()
+    results = FusedRewrite(names)(exs)
+    assert len(results) == len(exs)
+    for ex, (fused_ex, fired) in zip(exs, results):
+        expected_ex, expected_fired = apply_one_by_one(names, ex)
+        assert (fused_ex.source, fused_ex.target) == (
+            expected_ex.source,
+            expected_ex.target,
+        )
+        assert list(fired) == expected_fired
+
+
+def test_members_are_profiled():
+    names = list(Transformations._text_transforms)
+    profiler = Profiler()
+    FusedRewrite(names)(examples(), profiler)
+    assert profiler.members <= set(names)
+    assert profiler.members
@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import filters
+
+FILTERS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "filters.py")
+
+
+def test_valid_view_function():
+    assert filters.valid_view_function("null_sentence") == "null_sentence"
+    assert filters.valid_view_function("soft_hyphen") == "soft_hyphen"
+    with pytest.raises(argparse.ArgumentTypeError):
+        filters.valid_view_function("no_such_function")
+
+
+def test_hook_names_are_those_of_the_plan():
+    pipeline = filters.Pipeline.from_config(
+        {
+            "name": "HookPipeline",
+            "stages": ["null_sentence", "soft_hyphen", "merge_spaces"],
+        }
+    )
+    names = pipeline.hook_names()
+    assert names == ["null_sentence", "soft_hyphen", "merge_spaces"]
+    fused = [
+        stage.name
+        for stage in pipeline.get_plan()
+        if stage.kind == filters.Stage.FUSED
+    ]
+    assert fused and not set(fused) & set(names)
+
+
+def run_filters(*args):
+    return subprocess.run(
+        [sys.executable, FILTERS] + [str(arg) for arg in args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def test_hook_must_be_a_stage_of_the_selected_pipeline(tmp_path):
+    corpus = tmp_path / "corpus.tsv"
+    corpus.write_text("Some text here\tEinhver texti hér\n", encoding="utf-8")
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"stages": ["null_sentence", "banned_symbol"]}))
+    # banned_symbol is not in MinimalPipeline
+    result = run_filters("-i", corpus, "--hook", "banned_symbol")
+    assert result.returncode == 2
+    assert "not a stage of MinimalPipeline" in result.stderr
+    result = run_filters("-i", corpus, "--config", config, "--hook", "banned_symbol")
+    assert result.returncode == 0
+    result = run_filters("-i", corpus, "--config", config, "--hook", "soft_hyphen")
+    assert "not a stage of ConfigPipeline" in result.stderr
+    result = run_filters("-i", corpus, "--hook", "no_such_function")
+    assert "is not a filter or transformation" in result.stderr
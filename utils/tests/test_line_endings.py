@@ -0,0 +1,85 @@
+import io
+import os
+import subprocess
+import sys
+
+import filters
+from stream_io import decode_line, iter_lines
+
+FILTERS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "filters.py")
+PAIRS = [
+    ("Some text here.", "Einhver texti hér."),
+    ("Another sentence, longer.", "Önnur setning, lengri."),
+    ("Another sentence, longer.", "Önnur setning, lengri."),
+    ("The third one.", "Sú þriðja."),
+]
+
+
+def write_corpus(path, newline):
+    data = "".join(eng + "\t" + ice + newline for (eng, ice) in PAIRS)
+    path.write_bytes(data.encode("utf-8"))
+    return path
+
+
+def run_filters(*args):
+    subprocess.run([sys.executable, FILTERS] + [str(arg) for arg in args], check=True)
+
+
+def test_decode_line():
+    assert decode_line(b"a\tb\r\n") == "a\tb\n"
+    assert decode_line(b"a\tb\n") == "a\tb\n"
+    assert decode_line(b"a\r") == "a\n"
+    assert decode_line(b"a") == "a"
+
+
+def test_iter_lines_splits_like_text_mode():
+    data = b"a\rb\r\nc\n\r\rd\te\r\n\r\nf\rg"
+    raw_lines = list(iter_lines(io.BytesIO(data)))
+    assert b"".join(raw_lines) == data
+    text_lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8").readlines()
+    assert list(map(decode_line, raw_lines)) == text_lines
+
+
+def test_offset_reader_keeps_offsets_per_stride():
+    data = b"".join(b"line %d\r" % i for i in range(100))
+    reader = filters.OffsetReader(io.BytesIO(data), stride=10)
+    assert len(list(reader)) == 100
+    assert len(reader._offsets) == 10
+    assert reader.offset_after(5) is None
+    assert reader.offset_after(20) == data.index(b"line 20")
+    assert len(reader._offsets) == 8
+    assert reader.offset_after(100) == len(data)
+    assert not reader._offsets
+
+
+def test_checkpointed_run_reads_crlf_as_text_mode(tmp_path):
+    crlf = write_corpus(tmp_path / "crlf.tsv", "\r\n")
+    expected = tmp_path / "expected.tsv"
+    run_filters("-i", write_corpus(tmp_path / "lf.tsv", "\n"), "-o", expected)
+    out = tmp_path / "out.tsv"
+    run_filters("-i", crlf, "-o", out, "--checkpoint", tmp_path / "ck")
+    assert out.read_bytes() == expected.read_bytes()
+    assert len(out.read_bytes().splitlines()) == 3
+
+
+def test_checkpointed_run_reads_lone_cr_as_text_mode(tmp_path):
+    cr = write_corpus(tmp_path / "cr.tsv", "\r")
+    expected = tmp_path / "expected.tsv"
+    run_filters("-i", cr, "-o", expected)
+    assert len(expected.read_bytes().splitlines()) == 3
+    out = tmp_path / "out.tsv"
+    run_filters("-i", cr, "-o", out, "--checkpoint", tmp_path / "ck")
+    assert out.read_bytes() == expected.read_bytes()
+
+
+def test_sharded_run_reads_crlf_as_text_mode(tmp_path):
+    crlf = write_corpus(tmp_path / "crlf.tsv", "\r\n")
+    expected = tmp_path / "expected.tsv"
+    run_filters("-i", crlf, "-o", expected)
+    shards = [tmp_path / "shard{0}".format(k) for k in (1, 2)]
+    for (k, shard) in enumerate(shards, 1):
+        run_filters("-i", crlf, "-o", shard, "--shard", "{0}/2".format(k))
+    out = tmp_path / "out.tsv"
+    run_filters("--merge", *shards, "-o", out)
+    assert out.read_bytes() == expected.read_bytes()
+    assert len(out.read_bytes().splitlines()) == 3
@@ -0,0 +1,116 @@
+import pytest
+
+import filters
+import minhash
+from minhash import MinHashLSH, choose_bands, estimate_jaccard, minhash_signature
+
+
+@pytest.mark.parametrize("num_perm", [8, 16, 32, 64])
+@pytest.mark.parametrize("threshold", [0.5, 0.7, 0.8, 0.9])
+def test_choose_bands(num_perm, threshold):
+    bands, rows = choose_bands(num_perm, threshold)
+    assert bands * rows == num_perm
+
+    def error(b):
+        return abs((1 / b) ** (b / num_perm) - threshold)
+
+    divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    assert error(bands) == min(map(error, divisors))
+
+
+def test_choose_bands_values():
+    assert choose_bands(32, 0.8) == (4, 8)
+    assert choose_bands(8, 0.7) == (2, 4)
+    assert choose_bands(1, 0.5) == (1, 1)
+
+
+@pytest.mark.parametrize("text", ["a", "ab", "abcde", "stutt"])
+def test_short_text_is_densified(text):
+    sig = minhash_signature(text, 32, 5)
+    assert len(sig) == 32
+    assert minhash._EMPTY not in sig
+    # A single shingle fills one bin, the others borrow its value
+    own = [value for value in sig if value < minhash._ROTATION_OFFSET]
+    assert len(own) == 1
+    assert all(value % minhash._ROTATION_OFFSET == own[0] for value in sig)
+    assert len(set(sig)) == 32
+
+
+def test_signature_is_deterministic():
+    text = "Þetta er prófun á MinHash undirskrift"
+    assert minhash_signature(text, 64, 5) == minhash_signature(text, 64, 5)
+    assert estimate_jaccard(*[minhash_signature(text, 64, 5)] * 2) == 1.0
+    other = minhash_signature("Allt annar texti um eitthvað annað", 64, 5)
+    assert estimate_jaccard(minhash_signature(text, 64, 5), other) < 0.2
+
+
+def test_estimate_jaccard_tracks_overlap():
+    words = ["orð{0}".format(i) for i in range(400)]
+    text = " ".join(words)
+    near = " ".join(words[:360] + ["annað{0}".format(i) for i in range(40)])
+    estimate = estimate_jaccard(
+        minhash_signature(text, 256, 5), minhash_signature(near, 256, 5)
+    )
+    assert 0.7 < estimate < 0.9
+
+
+def test_bucket_keeps_every_signature():
+    # Two bands of four rows. b shares its first band with a but is not
+    # similar to it, c is similar to b and shares only that band with it
+    index = MinHashLSH(threshold=0.7, num_perm=8)
+    assert (index.bands, index.rows) == (2, 4)
+    a = (1, 2, 3, 4, 5, 6, 7, 8)
+    b = (1, 2, 3, 4, 15, 16, 17, 18)
+    c = (1, 2, 3, 4, 15, 16, 17, 99)
+    assert index.insert_if_unique(a)
+    assert index.insert_if_unique(b)
+    assert index.query(c)
+    assert not index.insert_if_unique(c)
+    assert len(index) == 2
+
+
+def test_bucket_is_capped(monkeypatch):
+    monkeypatch.setattr(MinHashLSH, "max_bucket", 3)
+    index = MinHashLSH(threshold=0.7, num_perm=8)
+    sigs = [(1, 2, 3, 4, i, i, i, i) for i in range(10, 20)]
+    assert all(index.insert_if_unique(sig) for sig in sigs)
+    (bucket,) = [value for value in index._buckets[0].values()]
+    assert bucket == [0, 1, 2]
+    # Found through the bucket while it holds the earlier signature
+    assert index.query((1, 2, 3, 4, 10, 10, 10, 99))
+    # Past the cap only the second band finds it
+    assert index.query((1, 2, 3, 4, 15, 15, 15, 15))
+    assert not index.query((1, 2, 3, 4, 15, 15, 15, 99))
+
+
+def near_duplicate_verdicts(lines, **kwargs):
+    filters.NearDeduplifier.configure(**kwargs)
+    try:
+        return [
+            filters.near_duplicate(ex) for ex in filters.lines_to_examples(lines)
+        ]
+    finally:
+        filters.NearDeduplifier.configure()
+
+
+def test_near_duplicate_verdicts():
+    source = "The committee will meet again on the first Monday of every month"
+    target = "Nefndin mun hittast aftur fyrsta mánudag hvers mánaðar"
+    lines = [
+        source + "\t" + target,
+        # Differs only in case, punctuation and digits
+        source.upper() + "!\t" + target + ".",
+        # One word changed
+        source.replace("again", "later") + "\t" + target,
+        "A completely different sentence about the weather\tAllt önnur setning",
+        source + " and every other Friday as well\t" + target + " og hvern föstudag",
+    ]
+    assert near_duplicate_verdicts(lines) == [True, False, False, True, True]
+    # At a threshold of 1 only an exact match after normalization is rejected
+    assert near_duplicate_verdicts(lines, threshold=1.0) == [
+        True,
+        False,
+        True,
+        True,
+        True,
+    ]
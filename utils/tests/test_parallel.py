@@ -0,0 +1,77 @@
+import multiprocessing
+
+import pytest
+
+import bench_corpus
+import filters
+
+
+def test_parallel_run_uses_configured_stages():
+    # Workers inherit the configured plan even where spawn is the default
+    # start method
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        check_parallel_run()
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+def check_parallel_run():
+    pipeline = filters.Pipeline.from_config(
+        {
+            "name": "ParamPipeline",
+            "stages": [{"name": "min_word_count", "params": {"min_count": 6}}],
+        }
+    )
+    lines = [eng + "\t" + ice for (eng, ice) in bench_corpus.generate_bitext(300)]
+    serial = list(pipeline.run(filters.lines_to_examples(lines)))
+    serial_counter = dict(pipeline.counter)
+    parallel = list(pipeline.run_parallel(lines, 2, chunk_size=50))
+    assert list(map(filters.example_to_line, parallel)) == list(
+        map(filters.example_to_line, serial)
+    )
+    assert pipeline.counter == serial_counter
+    assert serial_counter.get("min_word_count")
+
+
+def raising_pipeline():
+    # ocr_word_boundary_avg_length divides by zero on a side without words
+    return filters.Pipeline.from_config(
+        {
+            "name": "RaisingPipeline",
+            "stages": ["near_duplicate", "ocr_word_boundary_avg_length"],
+        }
+    )
+
+
+def test_parallel_run_skips_errors_of_rejected_examples():
+    source = "The committee will meet again on the first Monday of every month"
+    # The second pair is a near duplicate of the first, its target has no
+    # words once punctuation is removed
+    lines = [source + "\tJá", source + "\t-"] + [
+        eng + "\t" + ice
+        for (eng, ice) in bench_corpus.generate_bitext(100)
+        if ice.strip()
+    ]
+    pipeline = raising_pipeline()
+    filters.NearDeduplifier.configure()
+    serial = list(pipeline.run(filters.lines_to_examples(lines)))
+    serial_counter = dict(pipeline.counter)
+    assert serial_counter["near_duplicate"] >= 1
+    for jobs in (1, 2):
+        filters.NearDeduplifier.configure()
+        parallel = list(pipeline.run_parallel(lines, jobs, chunk_size=10))
+        assert list(map(filters.example_to_line, parallel)) == list(
+            map(filters.example_to_line, serial)
+        )
+        assert pipeline.counter == serial_counter
+
+
+def test_parallel_run_raises_errors_of_kept_examples():
+    lines = ["Some text here\tEinhver texti", "Other words\t-"]
+    pipeline = raising_pipeline()
+    for jobs in (1, 2):
+        filters.NearDeduplifier.configure()
+        with pytest.raises(ZeroDivisionError):
+            list(pipeline.run_parallel(lines, jobs, chunk_size=10))
@@ -0,0 +1,76 @@
+import bench_corpus
+import filters
+from filters import Example, example_to_line
+
+
+def transform_pipeline():
+    return filters.Pipeline.from_config(
+        {
+            "name": "PassthroughPipeline",
+            "stages": ["null_sentence", "soft_hyphen", "merge_spaces"],
+        }
+    )
+
+
+def run_batch(pipeline, lines):
+    pipeline.compile_plan()
+    pipeline.init_schedulers(False)
+    pipeline.counter.clear()
+    filters.Deduplifier.use_backend("set")
+    batch = list(filters.lines_to_examples(lines))
+    return batch, pipeline.process_batch(batch)
+
+
+def test_untouched_line_is_passed_through():
+    line = "Nothing to change here\tEkkert að breyta hér"
+    (ex,) = filters.lines_to_examples([line + "\n"])
+    assert ex.line == line
+    batch, results = run_batch(filters.MinimalPipeline, [line + "\n"])
+    assert results[0] is batch[0]
+    # The input string itself, not a copy
+    assert example_to_line(results[0]) is batch[0].line
+
+
+def test_transformed_line_is_rebuilt():
+    lines = ["Soft\xadhyphen\tMjúkt\xadbandstrik", "Plain text\tVenjulegur texti"]
+    pipeline = transform_pipeline()
+    batch, results = run_batch(pipeline, lines)
+    assert results[0].line is None
+    assert example_to_line(results[0]) == "Softhyphen\tMjúktbandstrik"
+    assert example_to_line(results[1]) is batch[1].line
+    assert pipeline.counter["soft_hyphen"] == 1
+
+
+def test_lines_without_two_fields_are_rebuilt():
+    (ex,) = filters.lines_to_examples(["a\tb\tc\n"])
+    assert ex.line is None
+    assert example_to_line(ex) == "a\tb"
+
+
+def test_setting_a_field_drops_the_line():
+    ex = Example("Source", "Markmál", line="Source\tMarkmál")
+    ex["en"] = "Other"
+    assert ex.line is None
+    assert example_to_line(ex) == "Other\tMarkmál"
+
+
+def test_output_lines_are_input_lines_unless_transformed(tmp_path):
+    corpus = tmp_path / "corpus.tsv"
+    pairs = bench_corpus.generate_bitext(500)
+    bench_corpus.write_tsv(str(corpus), pairs)
+    inputs = set(corpus.read_text(encoding="utf-8").splitlines())
+    out = tmp_path / "out.tsv"
+    filters.Deduplifier.use_backend("set")
+    with open(str(corpus), encoding="utf-8") as in_file, open(
+        str(out), "w", encoding="utf-8"
+    ) as out_file:
+        filters.do_pipeline(in_file, out_file)
+    counter = filters.MinimalPipeline.counter
+    num_transformed = sum(
+        count
+        for (name, count) in counter.items()
+        if name in filters.Transformations._transforms
+    )
+    outputs = out.read_text(encoding="utf-8").splitlines()
+    assert outputs
+    assert sum(line not in inputs for line in outputs) <= num_transformed
@@ -0,0 +1,106 @@
+import json
+import re
+
+import pytest
+
+import bench_corpus
+import filters
+from filters import FunctionStats, Profiler
+
+PROM_SAMPLE = re.compile(
+    r'^filters_function_(\w+)\{pipeline="(\w+)",function="(\w+)"\} (\S+)$'
+)
+
+
+def make_profiler():
+    profiler = Profiler()
+    profiler.record("alphanumeric", 0.2, 100)
+    profiler.record("alphanumeric", 0.1, 100)
+    profiler.record("fused", 0.4, 50)
+    profiler.record("soft_hyphen", 0.1, 50, member=True)
+    return profiler
+
+
+def test_function_stats():
+    stats = FunctionStats()
+    stats.add(0.001 * 99, 99)  # 10 us per example
+    stats.add(0.01, 1)  # 10 ms
+    assert (stats.calls, stats.batches) == (100, 2)
+    assert stats.mean == pytest.approx((0.099 + 0.01) / 100)
+    # Quantiles are bucket upper bounds, within 2 ** (1 / 8) of the value
+    assert 0.001 < stats.quantile(0.5) <= 0.001 * 2 ** (1 / 8)
+    assert 0.01 < stats.quantile(0.995) <= 0.01 * 2 ** (1 / 8)
+    other = FunctionStats()
+    other.add(0.05, 10)
+    stats.merge(other)
+    assert (stats.calls, stats.batches) == (110, 3)
+    assert stats.total_time == pytest.approx(0.159)
+    assert FunctionStats().quantile(0.99) == 0.0
+
+
+def test_json_export(tmp_path):
+    path = tmp_path / "profile.json"
+    make_profiler().write_json(str(path))
+    profile = json.loads(path.read_text())
+    # Fused stage members do not count towards the total
+    assert profile["seconds_total"] == pytest.approx(0.7)
+    functions = {fn["name"]: fn for fn in profile["functions"]}
+    assert list(functions) == ["alphanumeric", "fused", "soft_hyphen"]
+    keys = {key for (key, _, _) in Profiler.METRICS}
+    for fn in functions.values():
+        assert set(fn) == keys | {"name", "member"}
+    alphanumeric = functions["alphanumeric"]
+    assert alphanumeric["seconds_total"] == pytest.approx(0.3)
+    assert (alphanumeric["calls_total"], alphanumeric["batches_total"]) == (200, 2)
+    assert alphanumeric["mean_seconds"] == pytest.approx(0.3 / 200)
+    assert alphanumeric["time_share"] == pytest.approx(0.3 / 0.7)
+    assert functions["soft_hyphen"]["member"]
+    assert not functions["fused"]["member"]
+
+
+def test_json_export_in_plan_order(tmp_path):
+    path = tmp_path / "profile.json"
+    make_profiler().write_json(str(path), names=["soft_hyphen", "missing", "fused"])
+    profile = json.loads(path.read_text())
+    assert [fn["name"] for fn in profile["functions"]] == ["soft_hyphen", "fused"]
+
+
+def test_prometheus_export(tmp_path):
+    path = tmp_path / "profile.prom"
+    profiler = make_profiler()
+    profiler.write_prometheus(str(path), "TestPipeline")
+    functions = {fn["name"]: fn for fn in profiler.to_dict()["functions"]}
+    samples = {}
+    types = {}
+    for line in path.read_text().splitlines():
+        if line.startswith("# TYPE "):
+            (_, _, metric, kind) = line.split(" ")
+            types[metric] = kind
+            continue
+        if line.startswith("#"):
+            continue
+        (key, pipeline_name, name, value) = PROM_SAMPLE.match(line).groups()
+        assert pipeline_name == "TestPipeline"
+        samples[(key, name)] = float(value)
+    for (key, kind, _) in Profiler.METRICS:
+        assert types["filters_function_" + key] == kind
+        for (name, fn) in functions.items():
+            assert samples.pop((key, name)) == pytest.approx(fn[key])
+    assert not samples
+
+
+def test_write_profile_of_a_run(tmp_path):
+    pipeline = filters.MinimalPipeline
+    lines = [eng + "\t" + ice for (eng, ice) in bench_corpus.generate_bitext(200)]
+    filters.Deduplifier.use_backend("set")
+    list(pipeline.run(filters.lines_to_examples(lines), profile=True, batch_size=50))
+    pipeline.write_profile(str(tmp_path / "profile"))
+    profile = json.loads((tmp_path / "profile.json").read_text())
+    names = [fn["name"] for fn in profile["functions"]]
+    assert names == [name for name in pipeline.profile_names() if name in names]
+    assert "null_sentence" in names
+    null_sentence = profile["functions"][names.index("null_sentence")]
+    assert null_sentence["calls_total"] == 200
+    assert null_sentence["batches_total"] == 4
+    prom = (tmp_path / "profile.prom").read_text()
+    assert 'pipeline="MinimalPipeline",function="null_sentence"' in prom
@@ -0,0 +1,132 @@
+""" The combined pattern scan and the symbol table against the filters as
+    they were written before, one regular expression or set per filter """
+
+import random
+import re
+
+import pytest
+
+import bench_corpus
+from filters import Example, Filters, RejectPatterns
+from symbols import BANNED_SYMBOLS, ICE_QUOTE, QUOTE_LIKE, SYMBOL_WHITELIST
+
+
+def quote_inside_word(ex):
+    prog = re.compile(r'\w+"\w')
+    return not (prog.search(ex.target) or prog.search(ex.source))
+
+
+def ocr_wrong_symbol(ex):
+    return not re.search(r",,", ex.target)
+
+
+def missing_letter(ex):
+    substrings = [
+        r" a ",
+        r" e ",
+        r" i ",
+        r" o ",
+        r" u ",
+        r" y ",
+        r"\bvi\b",
+        r"\bess\b",
+        r"\bme\b",
+        r"\bessum\b",
+    ]
+    return not re.search("(" + "|".join(substrings) + ")", ex.target)
+
+
+def corrupt_symbol(ex):
+    prog = re.compile(r"\w[" + re.escape("?") + r"]+\w")
+    return not (prog.search(ex.target) or prog.search(ex.source))
+
+
+def improper_line_split(ex):
+    ice_matches = re.findall(r"(\b(?!\d)\w+)- (\b(?!eða|og)\w+\b)", ex.target)
+    eng_matches = re.findall(r"(\b(?!\d)\w+- \b(?!or|and)\w+\b)", ex.source)
+    return len(ice_matches) == 0 or len(eng_matches) == 0
+
+
+def dot_pattern(ex):
+    prog = re.compile("(" + r"\.\s+" + "){2,}")
+    return not (prog.search(ex.target) or prog.search(ex.source))
+
+
+def banned_symbol(ex):
+    prog = re.compile("[" + re.escape(BANNED_SYMBOLS) + "]")
+    ice, eng = ex.target, ex.source
+    return not ("\\" in ice or "\\" in eng or prog.search(ice) or prog.search(eng))
+
+
+def whitelist_symbol(ex):
+    return not (set(ex.target) | set(ex.source)) - SYMBOL_WHITELIST
+
+
+def wrong_quotes(ex):
+    quotes = set(QUOTE_LIKE) - set("'\",") - set(ICE_QUOTE.ALL)
+    return not (set(ex.target) | set(ex.source)) & quotes
+
+
+BASELINES = [
+    quote_inside_word,
+    ocr_wrong_symbol,
+    missing_letter,
+    corrupt_symbol,
+    improper_line_split,
+    dot_pattern,
+    banned_symbol,
+    whitelist_symbol,
+    wrong_quotes,
+]
+PATTERN_FILTERS = [fun.__name__ for fun in BASELINES[:6]]
+
+PIECES = (
+    ["a", "e", "vi", "me", "ess", "essum", "og", "eða", "or", "and", "12", "orð"]
+    + [" ", "  ", "-", "- ", ".", ". ", ". .", ",", ",,", "?", "??", '"', "\\"]
+    + ["\t", "\xa0", "þ", "é", "ß", "orð- orð", "word- word", "- og"]
+    + list(QUOTE_LIKE + BANNED_SYMBOLS)
+    + random.Random(0).sample(sorted(SYMBOL_WHITELIST), 20)
+)
+
+
+def random_examples(num, seed=0):
+    rng = random.Random(seed)
+
+    def sentence():
+        return "".join(rng.choice(PIECES) for _ in range(rng.randrange(12)))
+
+    return [Example(sentence(), sentence()) for _ in range(num)]
+
+
+def all_examples():
+    pairs = bench_corpus.generate_bitext(1000, noise=1.0)
+    return [Example(eng, ice) for (eng, ice) in pairs] + random_examples(5000)
+
+
+@pytest.fixture(params=["all", "used", "unused"])
+def active_patterns(request):
+    # Patterns of all filters, of those of a plan, or the filter on its own
+    if request.param == "used":
+        RejectPatterns.use(PATTERN_FILTERS)
+    elif request.param == "unused":
+        RejectPatterns.use([])
+    yield request.param
+    RejectPatterns._active = None
+    RejectPatterns._combined = {}
+
+
+@pytest.mark.parametrize("baseline", BASELINES, ids=lambda fun: fun.__name__)
+def test_filter_matches_baseline(baseline, active_patterns):
+    name = baseline.__name__
+    exs = all_examples()
+    expected = [bool(baseline(ex)) for ex in exs]
+    assert [bool(Filters.apply(name, ex)) for ex in exs] == expected
+    # Fresh examples, so that nothing is cached from the scalar run
+    exs = all_examples()
+    mask = []
+    for start in range(0, len(exs), 97):
+        batch = exs[start : start + 97]
+        mask.extend(bool(keep) for keep in Filters.apply_batch(name, batch))
+    assert mask == expected
+    # Some examples of each kind, or the comparison says little
+    assert 0 < sum(expected) < len(expected)
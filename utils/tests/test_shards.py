@@ -0,0 +1,87 @@
+import io
+import random
+
+import pytest
+
+import bench_corpus
+import filters
+from stream_io import iter_range_lines, shard_range
+
+
+def stateful_pipeline():
+    return filters.Pipeline.from_config(
+        {
+            "name": "ShardPipeline",
+            "stages": [
+                "null_sentence",
+                "merge_spaces",
+                "MinFrequency",
+                "deduplicate",
+                "near_duplicate",
+            ],
+        }
+    )
+
+
+def write_mixed_corpus(path, num_pairs=300):
+    """ Pairs with duplicates, one-word variants and rare words, ending in
+        \\n, \\r\\n or a lone \\r at random """
+    rng = random.Random(5)
+    pairs = bench_corpus.generate_bitext(num_pairs)
+    pairs += pairs[: num_pairs // 3]
+    pairs += [(eng + " again", ice) for (eng, ice) in pairs[: num_pairs // 5]]
+    rng.shuffle(pairs)
+    endings = ["\n", "\r\n", "\r"]
+    data = "".join(
+        eng + "\t" + ice + rng.choice(endings) for (eng, ice) in pairs
+    ).encode("utf-8")
+    path.write_bytes(data)
+    return data
+
+
+def test_range_lines_cover_the_input_once():
+    data = b"a\rb\r\nc\n\r\r\nd\te\r\n\r\nf\rg"
+    fh = io.BytesIO(data)
+    expected = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8").readlines()
+    for num_shards in range(1, len(data) + 1):
+        lines = []
+        for shard in range(1, num_shards + 1):
+            start, end = shard_range(len(data), shard, num_shards)
+            lines.extend(iter_range_lines(fh, start, end))
+        assert b"".join(lines) == data
+        assert len(lines) == len(expected)
+
+
+@pytest.mark.parametrize("num_shards", [1, 2, 5])
+def test_merged_shards_match_run(tmp_path, num_shards):
+    corpus = tmp_path / "corpus.tsv"
+    write_mixed_corpus(corpus)
+    pipeline = stateful_pipeline()
+    expected = tmp_path / "expected.tsv"
+    filters.Deduplifier.use_backend("set")
+    with open(str(corpus), encoding="utf-8") as in_file, open(
+        str(expected), "w", encoding="utf-8"
+    ) as out_file:
+        filters.do_pipeline(in_file, out_file, pipeline=pipeline)
+    expected_counter = dict(pipeline.counter)
+    for name in ("MinFrequency", "deduplicate", "near_duplicate"):
+        assert expected_counter.get(name)
+
+    shard_paths = [tmp_path / "shard{0}".format(k) for k in range(num_shards)]
+    for (k, shard_path) in enumerate(shard_paths, 1):
+        with open(str(corpus), encoding="utf-8") as in_file, open(
+            str(shard_path), "wb"
+        ) as out_file:
+            filters.do_pipeline(
+                in_file, out_file, pipeline=pipeline, shard=(k, num_shards)
+            )
+    out = tmp_path / "out.tsv"
+    shard_files = [open(str(path), "rb") for path in shard_paths]
+    try:
+        with open(str(out), "w", encoding="utf-8") as out_file:
+            filters.do_pipeline(None, out_file, pipeline=pipeline, merge=shard_files)
+    finally:
+        for fh in shard_files:
+            fh.close()
+    assert out.read_bytes() == expected.read_bytes()
+    assert dict(pipeline.counter) == expected_counter
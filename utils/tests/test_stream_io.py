@@ -0,0 +1,168 @@
+import gzip
+import importlib.util
+import io
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import stream_io
+from stream_io import (
+    BLOCK_SIZE,
+    file_compression,
+    open_input,
+    open_output,
+    strip_compression_suffix,
+)
+
+UTILS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODECS = [
+    ("gz", "gzip"),
+    ("xz", "xz"),
+    ("bz2", "bzip2"),
+    pytest.param(
+        "zst",
+        "zstd",
+        marks=pytest.mark.skipif(
+            importlib.util.find_spec("zstandard") is None,
+            reason="zstandard is not installed",
+        ),
+    ),
+]
+
+
+def corpus_lines(num_lines):
+    return [
+        "Lína {0} með íslenskum stöfum\tLine {0}, þ.e. ð\n".format(i)
+        for i in range(num_lines)
+    ]
+
+
+@pytest.mark.parametrize("suffix,compression", CODECS)
+def test_codec_round_trip(tmp_path, suffix, compression):
+    path = tmp_path / ("corpus.tsv." + suffix)
+    # More than a block, so that the background threads pass several
+    lines = corpus_lines(60000)
+    assert len("".join(lines).encode("utf-8")) > 2 * BLOCK_SIZE
+    with open_output(str(path)) as fh:
+        fh.writelines(lines)
+    assert file_compression(str(path)) == compression
+    assert strip_compression_suffix(str(path)) == str(tmp_path / "corpus.tsv")
+    with open_input(str(path)) as fh:
+        assert list(fh) == lines
+    with open_input(str(path), encoding=None) as fh:
+        assert fh.read() == "".join(lines).encode("utf-8")
+
+
+def test_compression_is_sniffed_not_guessed(tmp_path):
+    # A compressed file without a suffix and a plain one with a suffix
+    lines = corpus_lines(10)
+    hidden = tmp_path / "corpus.tsv"
+    hidden.write_bytes(gzip.compress("".join(lines).encode("utf-8")))
+    plain = tmp_path / "plain.tsv.gz"
+    plain.write_text("".join(lines), encoding="utf-8")
+    for path in (hidden, plain):
+        with open_input(str(path)) as fh:
+            assert list(fh) == lines
+
+
+def read_stdin(data):
+    script = (
+        "import sys, stream_io\n"
+        "with stream_io.open_input(None) as fh:\n"
+        "    sys.stdout.buffer.write(fh.read().encode('utf-8'))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        input=data,
+        stdout=subprocess.PIPE,
+        cwd=UTILS_DIR,
+        check=True,
+    )
+    return result.stdout
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, None])
+def test_stdin_is_sniffed(compress):
+    text = "".join(corpus_lines(1000)).encode("utf-8")
+    data = compress(text) if compress else text
+    assert read_stdin(data) == text
+
+
+class FailingSink:
+    def __init__(self, fail_on_close=False):
+        self.written = []
+        self.closed = False
+        self.fail_on_close = fail_on_close
+
+    def write(self, data):
+        if not self.fail_on_close:
+            raise OSError("No space left on device")
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+        if self.fail_on_close:
+            raise OSError("Flush failed")
+
+
+def test_writer_error_is_raised_by_close():
+    writer = stream_io._BackgroundWriter(FailingSink())
+    text = stream_io._text(io.BufferedWriter(writer, BLOCK_SIZE), "utf-8", "")
+    text.write("a line\n")
+    with pytest.raises(OSError, match="No space left"):
+        text.close()
+    assert writer._sink.closed
+
+
+def test_writer_error_is_raised_by_a_later_write():
+    writer = stream_io._BackgroundWriter(FailingSink())
+    writer.write(b"first block")
+    deadline = time.time() + 10
+    while writer._error is None and time.time() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(OSError, match="No space left"):
+        writer.write(b"second block")
+    # Raised once
+    writer.close()
+
+
+def test_sink_close_error_is_raised():
+    sink = FailingSink(fail_on_close=True)
+    writer = stream_io._BackgroundWriter(sink)
+    writer.write(b"data")
+    with pytest.raises(OSError, match="Flush failed"):
+        writer.close()
+    assert sink.written == [b"data"]
+
+
+def test_reader_error_is_raised(tmp_path):
+    path = tmp_path / "broken.tsv.gz"
+    data = gzip.compress("".join(corpus_lines(20000)).encode("utf-8"))
+    path.write_bytes(data[: len(data) // 2])
+    with pytest.raises(EOFError):
+        with open_input(str(path)) as fh:
+            for _ in fh:
+                pass
+
+
+def test_early_close_of_a_blocked_reader(tmp_path):
+    path = tmp_path / "big.tsv.gz"
+    line = "Sama línan aftur og aftur\tThe same line again and again\n"
+    num_blocks = 3 * stream_io._QUEUE_BLOCKS
+    with gzip.open(str(path), "wt", encoding="utf-8") as fh:
+        fh.write(line * (num_blocks * BLOCK_SIZE // len(line)))
+    fh = open_input(str(path))
+    assert next(fh) == line
+    reader = fh.buffer.raw
+    # The producer fills the queue and then waits for room in it
+    deadline = time.time() + 10
+    while not reader._queue.full() and time.time() < deadline:
+        time.sleep(0.01)
+    assert reader._queue.full()
+    assert reader._thread.is_alive()
+    fh.close()
+    assert not reader._thread.is_alive()
+    assert reader._source._fh.closed
@@ -0,0 +1,71 @@
+import pytest
+
+import bench_corpus
+from subword_encoder import SubwordEncoder, tokenize
+
+
+def write_vocab(path, lines):
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    return path
+
+
+def test_tokenize_matches_t2t_tokenizer_tests():
+    # Cases from tensor2tensor's tokenizer_test
+    assert tokenize("Dude - that's so cool.") == [
+        "Dude",
+        " - ",
+        "that",
+        "'",
+        "s",
+        "so",
+        "cool",
+        ".",
+    ]
+    assert tokenize("Łukasz est né en 1981.") == [
+        "Łukasz",
+        "est",
+        "né",
+        "en",
+        "1981",
+        ".",
+    ]
+    assert tokenize(" Spaces at the ends ") == [
+        " ",
+        "Spaces",
+        "at",
+        "the",
+        "ends",
+        " ",
+    ]
+
+
+def test_vocab_lines_are_stripped_and_unquoted(tmp_path):
+    path = write_vocab(
+        tmp_path / "vocab.subwords",
+        ["'<pad>'", "'<EOS>'", "  'ab_'  ", '"a"', "\tb", "'_'", "'c_'"],
+    )
+    encoder = SubwordEncoder(path)
+    assert encoder._subtoken_strings == ["<pad>", "<EOS>", "ab_", "a", "b", "_", "c_"]
+
+
+def test_greedy_longest_match(tmp_path):
+    path = write_vocab(
+        tmp_path / "vocab.subwords",
+        ["'<pad>'", "'<EOS>'", "'ab_'", "'a'", "'b'", "'_'", "'c_'", "' _'"],
+    )
+    encoder = SubwordEncoder(path)
+    assert encoder.encode("ab") == [2]
+    assert encoder.encode("abc") == [3, 4, 6]
+    assert encoder.encode("ab c") == [2, 6]
+
+
+def test_same_ids_as_t2t(tmp_path):
+    text_encoder = pytest.importorskip("tensor2tensor.data_generators.text_encoder")
+    pairs = bench_corpus.generate_bitext(200)
+    path = str(tmp_path / "vocab.subwords")
+    bench_corpus.write_vocab(path, pairs)
+    reference = text_encoder.SubwordTextEncoder(path)
+    encoder = SubwordEncoder(path)
+    for pair in pairs:
+        for text in pair:
+            assert encoder.encode(text) == reference.encode(text)
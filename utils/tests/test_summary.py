@@ -0,0 +1,22 @@
+import bench_corpus
+import filters
+
+
+def test_gatherer_rejections_are_summarized_as_filtered(capsys):
+    pipeline = filters.Pipeline.from_config(
+        {"name": "SummaryPipeline", "stages": ["merge_spaces", "MinFrequency"]}
+    )
+    lines = [eng + "\t" + ice for (eng, ice) in bench_corpus.generate_bitext(300)]
+    list(pipeline.run(filters.lines_to_examples(lines)))
+    rejected = pipeline.counter["MinFrequency"]
+    assert rejected
+    capsys.readouterr()
+    pipeline.summarize_counter()
+    rows = {
+        line.split()[0]: line.split()[1:]
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith("    ")
+    }
+    # Count, share of the total and share of the filtered examples
+    assert rows["MinFrequency"][0] == str(rejected)
+    assert rows["MinFrequency"][2] == "100.00%"
@@ -0,0 +1,63 @@
+import os
+
+import tsv_index
+from tsv_index import CACHE_SUFFIX, TSVIndex, iter_selected_lines
+
+DATA = "a\tb\nc\td\r\ne\tf\rg\th\n\ni\tj"
+
+
+def write_tsv(tmp_path, data=DATA):
+    path = tmp_path / "corpus.tsv"
+    path.write_bytes(data.encode("utf-8"))
+    return path
+
+
+def text_lines(path):
+    with open(str(path), encoding="utf-8") as fh:
+        return list(fh)
+
+
+def test_lines_split_as_in_text_mode(tmp_path):
+    path = write_tsv(tmp_path)
+    expected = text_lines(path)
+    with TSVIndex(path) as index:
+        assert len(index) == len(expected)
+        assert list(index.lines()) == expected
+        assert [index[idx] for idx in range(len(index))] == [
+            line.rstrip("\n") for line in expected
+        ]
+        assert index.field(2, 1) == "f"
+        assert index.fields(1) == ["c", "d"]
+
+
+def test_selected_lines_agree_with_scan(tmp_path):
+    path = write_tsv(tmp_path)
+    idxs = [1, 2, 5]
+    # invert scans the file, the complement of the complement is idxs
+    complement = [idx for idx in range(len(text_lines(path))) if idx not in idxs]
+    assert list(iter_selected_lines(path, idxs)) == list(
+        iter_selected_lines(path, complement, invert=True)
+    )
+
+
+def test_no_cache_unless_asked(tmp_path):
+    path = write_tsv(tmp_path)
+    TSVIndex(path).close()
+    assert os.listdir(str(tmp_path)) == ["corpus.tsv"]
+    TSVIndex(path, cache=True).close()
+    assert (tmp_path / ("corpus.tsv" + CACHE_SUFFIX)).exists()
+    with TSVIndex(path, cache=True) as index:
+        assert isinstance(index._offsets, memoryview)
+        assert list(index.lines()) == text_lines(path)
+
+
+def test_unwritable_cache_is_skipped(tmp_path, monkeypatch):
+    path = write_tsv(tmp_path)
+
+    def deny(*args):
+        raise PermissionError("read-only")
+
+    monkeypatch.setattr(tsv_index.os, "replace", deny)
+    with TSVIndex(path, cache=True) as index:
+        assert len(index) == len(text_lines(path))
+    assert os.listdir(str(tmp_path)) == ["corpus.tsv"]
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+import bench_corpus
+from filters import has_word_tokens
+
+tokenizer = pytest.importorskip("tokenizer")
+
+PIECES = [
+    "orð",
+    "og",
+    "eða",
+    "hálf",
+    "janúar",
+    "kl.",
+    "klukkan",
+    "tvö",
+    "árið",
+    "kr.",
+    "millj.",
+    "km",
+    "m²",
+    "°C",
+    "%",
+    "12",
+    "3.",
+    "1,5",
+    "Reykjavík",
+    "fjármála-",
+    "efnahagsráðuneyti",
+    "e.g.",
+    "t.d.",
+    "word",
+    "-",
+    ",",
+    ".",
+    "?",
+    "„",
+    "“",
+    "Ⅷ",
+    "x²",
+]
+
+
+def word_count(text):
+    return sum(
+        1
+        for tok in tokenizer.tokenize(text)
+        if tok.txt is not None and tok.kind == tokenizer.TOK.WORD
+    )
+
+
+def sentences():
+    rng = random.Random(0)
+    for (eng, ice) in bench_corpus.generate_bitext(1000, noise=1.0):
+        yield eng
+        yield ice
+    for _ in range(2000):
+        words = [rng.choice(PIECES) for _ in range(rng.randrange(10))]
+        yield " ".join(words)
+        yield "".join(rng.choice(("", " ")) + word for word in words)
+
+
+def test_has_word_tokens_matches_tokenizer():
+    for text in sentences():
+        count = word_count(text)
+        for min_count in range(0, 8):
+            assert has_word_tokens(text, min_count) == (count >= min_count), (
+                text,
+                min_count,
+                count,
+            )
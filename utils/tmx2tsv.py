@@ -57,9 +57,17 @@
 """
 
 import os
-import xml.etree.cElementTree as ET
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
+from stream_io import (
+    LineWriter,
+    compression_of_path,
+    open_input,
+    open_output,
+    strip_compression_suffix,
+)
+
 _SPEC = "{http://www.w3.org/XML/1998/namespace}"
 _LANG_SPEC = "{spec}lang".format(spec=_SPEC)
 
@@ -67,7 +75,8 @@ _LANG_SPEC = "{spec}lang".format(spec=_SPEC)
 class TMXFile:
     def __init__(self, path):
         self._path = path
-        self._tree = ET.parse(str(self._path))
+        with open_input(self._path, encoding=None) as fh:
+            self._tree = ET.parse(fh)
         self._root = None
         self._src_lang = None
         self._tgt_lang = None
@@ -105,8 +114,9 @@ class TMXFile:
         for trnsl_unit in self.root.iterfind("./body/tu"):
             variants = trnsl_unit.findall("tuv")[:2]
 
-            src_seg = variants[0].find("seg").text
-            tgt_seg = variants[1].find("seg").text
+            # An empty segment has no text
+            src_seg = variants[0].find("seg").text or ""
+            tgt_seg = variants[1].find("seg").text or ""
             if variants[0].attrib.get(_LANG_SPEC) != self.src_lang:
                 src_seg, tgt_seg = tgt_seg, src_seg
             if swap:
@@ -124,10 +134,9 @@ def path_filetype(path_string):
 
 def main(src_file, tgt_file):
     tmx = TMXFile(src_file)
-    with tgt_file.open("w", encoding="utf8") as out_file:
+    with LineWriter(open_output(tgt_file)) as writer:
         for row in tmx.bitext():
-            out_file.write("\t".join(row) )
-            out_file.write("\n")
+            writer.write_line("\t".join(row))
 
 
 if __name__ == "__main__":
@@ -147,11 +156,15 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    out_path = Path(__file__).resolve().with_name((args.src_path.with_suffix(".tsv").name))
+    # corpus.tmx.gz is written to corpus.tsv.gz
+    out_name = Path(strip_compression_suffix(args.src_path)).with_suffix(".tsv").name
+    if compression_of_path(args.src_path):
+        out_name += args.src_path.suffix
+    out_path = Path(args.tgt_path or "")
     if args.tgt_path is None:
-        out_path = Path(os.getcwd()) / args.src_path.with_suffix(".tsv").name
+        out_path = Path(os.getcwd()) / out_name
     elif Path(args.tgt_path).resolve().is_dir():
-        out_path = Path(args.tgt_path).resolve() / args.src_path.with_suffix(".tsv").name
+        out_path = Path(args.tgt_path).resolve() / out_name
     main(
         args.src_path,
         out_path,
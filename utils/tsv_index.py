@@ -0,0 +1,240 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Memory-mapped TSV line index
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Random access to the lines and fields of an uncompressed TSV file.
+     The file is memory-mapped and the start offset of every line is kept
+     in an array of 4 byte (or, for files over 4 GiB, 8 byte) integers, so
+     a line is fetched by slicing the map and nothing else is held in
+     memory. Lines end where they do when the file is read in text mode,
+     at \n, \r\n or a lone \r, so line numbers agree with those of a plain
+     scan of the file. If asked to, the offsets are cached next to the file
+     (path + ".lidx") and the cache is memory-mapped as well; it is rebuilt
+     when the size or modification time of the file changes.
+
+"""
+
+import array
+import bisect
+import itertools
+import mmap
+import os
+import re
+import struct
+
+from stream_io import compression_of_path, file_compression, open_input
+
+CACHE_SUFFIX = ".lidx"
+_CACHE_MAGIC = b"TSVLIDX2"
+# magic, typecode, padding, file size, file mtime in ns, number of offsets
+_CACHE_HEADER = struct.Struct("<8sc7xQQQ")
+# Line endings recognized by universal newlines in text mode
+_LINE_END = re.compile(rb"\r\n?|\n")
+
+
+def _strip_newline(raw):
+    if raw.endswith(b"\r\n"):
+        return raw[:-2]
+    if raw.endswith((b"\n", b"\r")):
+        return raw[:-1]
+    return raw
+
+
+class TSVIndex:
+    """ Line index of the uncompressed TSV file at path. Lines are returned
+        without their newline. If cache, the offsets are saved next to the
+        file for later instances, when the directory is writable. """
+
+    def __init__(self, path, cache=False):
+        self.path = str(path)
+        if compression_of_path(self.path):
+            raise ValueError("Cannot index compressed file {0}".format(self.path))
+        self._fh = open(self.path, "rb")
+        stat = os.fstat(self._fh.fileno())
+        self.size = stat.st_size
+        self._stat = (stat.st_size, stat.st_mtime_ns)
+        # An empty file cannot be mapped
+        self._map = (
+            mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.size
+            else b""
+        )
+        self._cache_map = None
+        self._offsets = self._load_cache() if cache else None
+        if self._offsets is None:
+            self._offsets = self._build()
+            if cache:
+                self._save_cache()
+
+    def _build(self):
+        """ Start offsets of all lines, followed by the size of the file """
+        typecode = "I" if self.size < 1 << 32 else "Q"
+        offsets = array.array(typecode, [0])
+        if self._map.find(b"\r") == -1:
+            self._fh.seek(0)
+            offsets.extend(itertools.accumulate(map(len, self._fh)))
+            return offsets
+        offsets.extend(match.end() for match in _LINE_END.finditer(self._map))
+        if offsets[-1] != self.size:
+            # The last line has no newline
+            offsets.append(self.size)
+        return offsets
+
+    def _cache_path(self):
+        return self.path + CACHE_SUFFIX
+
+    def _load_cache(self):
+        try:
+            with open(self._cache_path(), "rb") as fh:
+                cache_map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(cache_map) < _CACHE_HEADER.size or cache_map[:8] != _CACHE_MAGIC:
+            cache_map.close()
+            return None
+        (_, typecode, size, mtime_ns, count) = _CACHE_HEADER.unpack_from(cache_map)
+        offsets = memoryview(cache_map)[_CACHE_HEADER.size :]
+        offsets = offsets.cast(typecode.decode("ascii"))
+        if (size, mtime_ns) != self._stat or len(offsets) != count:
+            offsets.release()
+            cache_map.close()
+            return None
+        self._cache_map = cache_map
+        return offsets
+
+    def _save_cache(self):
+        """ Write the offsets next to the file, if the directory allows """
+        typecode = self._offsets.typecode.encode("ascii")
+        header = _CACHE_HEADER.pack(
+            _CACHE_MAGIC, typecode, *self._stat, len(self._offsets)
+        )
+        tmp_path = "{0}.{1}.tmp".format(self._cache_path(), os.getpid())
+        try:
+            with open(tmp_path, "wb") as fh:
+                fh.write(header)
+                self._offsets.tofile(fh)
+            os.replace(tmp_path, self._cache_path())
+        except OSError:
+            # E.g. PermissionError in a read-only corpus directory, the
+            # index works without the cache
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def offset(self, idx):
+        """ Byte offset of the start of line idx """
+        return self._offsets[idx]
+
+    def raw(self, idx):
+        """ Line idx as bytes, including its newline """
+        if not 0 <= idx < len(self):
+            raise IndexError("line index out of range")
+        return self._map[self._offsets[idx] : self._offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        return _strip_newline(self.raw(idx)).decode("utf-8")
+
+    def fields(self, idx):
+        return self[idx].split("\t")
+
+    def field(self, idx, field_idx):
+        """ Field field_idx (from 0) of line idx, decoding only that field """
+        raw = _strip_newline(self.raw(idx))
+        return raw.split(b"\t")[field_idx].decode("utf-8")
+
+    def iter_raw(self, start=0, stop=None):
+        """ Lines start to stop as bytes, with their newlines """
+        stop = len(self) if stop is None else min(stop, len(self))
+        offsets = self._offsets
+        data = self._map
+        for idx in range(start, stop):
+            yield data[offsets[idx] : offsets[idx + 1]]
+
+    def lines(self, start=0, stop=None):
+        """ Lines start to stop, with their newlines, as read from a file in
+            text mode (line endings translated to \n) """
+        for raw in self.iter_raw(start, stop):
+            line = _strip_newline(raw).decode("utf-8")
+            yield line + "\n" if raw.endswith((b"\n", b"\r")) else line
+
+    def __iter__(self):
+        return self.lines()
+
+    def split(self, num_parts):
+        """ Split the lines into at most num_parts consecutive (start, stop)
+            ranges with close to the same number of bytes each """
+        ranges = []
+        start = 0
+        for part in range(1, num_parts + 1):
+            end_offset = self.size * part // num_parts
+            stop = bisect.bisect_left(self._offsets, end_offset, start, len(self))
+            if part == num_parts:
+                stop = len(self)
+            if stop > start:
+                ranges.append((start, stop))
+                start = stop
+        return ranges
+
+    def close(self):
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        if self._cache_map is not None:
+            self._cache_map.close()
+        if self.size:
+            self._map.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def can_index(path):
+    """ Whether path is an uncompressed regular file that TSVIndex can map """
+    if path is None or str(path) == "-" or not os.path.isfile(str(path)):
+        return False
+    return file_compression(path) is None
+
+
+def iter_selected_lines(path, idxs, invert=False):
+    """ Yield the lines (without newlines) of the TSV file at path whose
+        indices are in the ascending iterable idxs, or not in it if invert.
+        Uncompressed files are read through a TSVIndex, so that only the
+        selected lines are read and decoded, other files are scanned. """
+    idxs = iter(idxs)
+    if not invert and can_index(path):
+        with TSVIndex(path) as index:
+            for idx in idxs:
+                yield index[idx]
+        return
+    next_idx = next(idxs, None)
+    with open_input(path) as fh:
+        for (idx, line) in enumerate(fh):
+            is_selected = idx == next_idx
+            if is_selected:
+                next_idx = next(idxs, None)
+            if is_selected != invert:
+                yield line.rstrip("\n")